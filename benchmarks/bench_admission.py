@@ -0,0 +1,159 @@
+"""
+Flood test of the order API's admission control: latency of well-behaved
+traders while one trader floods, with and without per-trader rate limits and a
+bounded engine queue.
+
+    python -m benchmarks.bench_admission [--polite 8] [--flooders 64] [--seconds 20] [--block-ms 1000]
+
+Every request rests a limit order and cancels it on the real engine (settlement
+stubbed, see benchmarks.stubs) through an EngineQueue, the way the /tx/*
+endpoints do, then settles one real signed transaction through a TxScheduler
+and ReceiptTracker on a fake node mining a block every --block-ms. "settle"
+waits on the engine thread only for the node to take the transaction, as the
+engine does; "receipt on worker" waits there for its receipt too, as it did
+before, so each command holds the engine for most of a block. --polite traders
+each send --polite-rate requests per second; --flooders threads all send as one trader, --flood-rate requests per
+second between them, and resend as soon as they are answered or refused, as a
+badly behaved client would. The flood rate is what one API process could parse,
+not what a client could send: past that the flood is the HTTP server's problem,
+not admission's.
+
+"off" has no limiter and an unbounded queue: every flood request reaches the
+engine and the polite ones wait behind them. "on" uses RateLimiter and an
+EngineQueue of --queue-size. Latency is from submit to answer, polite only;
+"max" includes the flooder's opening burst (--burst requests it is allowed to
+queue at once), which p99 only sees on short runs.
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+
+from web3 import Web3
+
+from benchmarks.stubs import BlockNode, build_engine
+from off_chain_systems.admission import RateLimiter, EngineQueue, RateLimited, Overloaded
+from off_chain_systems.position_manager import Side
+from off_chain_systems.receipt_tracker import ReceiptTracker
+from off_chain_systems.tx_scheduler import TxScheduler, TxPriority
+
+KEY = "0x" + "11" * 32
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def tx() -> dict:
+    return {"to": "0x00000000000000000000000000000000000000b2", "data": "0x", "value": 0,
+            "gas": 300000, "gasPrice": 10**9, "chainId": 31337}
+
+
+def run(args, flooders: int, admission: bool, receipt_on_worker: bool) -> dict:
+    engine, pm = build_engine()
+    node = BlockNode(args.block_ms / 1000).start()
+    w3 = Web3(node)
+    tracker = ReceiptTracker(w3)
+    scheduler = TxScheduler(w3, KEY, tracker)
+    settle = scheduler.send if receipt_on_worker else scheduler.settle
+    limiter = RateLimiter(args.rate, args.burst) if admission else None
+    commands = EngineQueue(args.queue_size if admission else 1 << 30)
+    commands.start()
+    stop = threading.Event()
+    latencies = []
+    counts = {"accepted": 0, "rate_limited": 0, "overloaded": 0}
+    counts_lock = threading.Lock()
+
+    def command(trader: str, price: float):
+        engine.add_limit_order(trader, Side.BUY, price, 1.0, 2)
+        engine.remove_limit_order(trader)
+        settle(TxPriority.FILL, tx())
+
+    def request(trader: str, price: float) -> str:
+        try:
+            if limiter is not None:
+                limiter.take(trader, "limit_order")
+            commands.submit(command, trader, price)
+            return "accepted"
+        except RateLimited:
+            return "rate_limited"
+        except Overloaded:
+            return "overloaded"
+
+    def polite(i: int):
+        trader = f"0xPolite{i}"
+        pm.create_account(trader)
+        rng = random.Random(i)
+        interval = 1 / args.polite_rate
+        # random phase, or every polite trader would send at the same instant
+        stop.wait(rng.uniform(0, interval))
+        while not stop.is_set():
+            start = time.perf_counter()
+            outcome = request(trader, rng.randint(100, 400) / 1000)
+            if outcome == "accepted":
+                latencies.append(time.perf_counter() - start)
+            with counts_lock:
+                counts[f"polite_{outcome}"] = counts.get(f"polite_{outcome}", 0) + 1
+            stop.wait(max(0.0, interval - (time.perf_counter() - start)))
+
+    def flood():
+        rng = random.Random()
+        interval = flooders / args.flood_rate
+        stop.wait(rng.uniform(0, interval))
+        while not stop.is_set():
+            start = time.perf_counter()
+            outcome = request("0xFlooder", rng.randint(100, 400) / 1000)
+            with counts_lock:
+                counts[outcome] += 1
+            stop.wait(max(0.0, interval - (time.perf_counter() - start)))
+
+    pm.create_account("0xFlooder")
+    threads = [threading.Thread(target=polite, args=(i,)) for i in range(args.polite)]
+    threads += [threading.Thread(target=flood) for _ in range(flooders)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    commands.stop()
+    tracker.stop()
+    node.stop()
+    return {"latencies": latencies, **counts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--polite", type=int, default=8)
+    parser.add_argument("--polite-rate", type=float, default=10.0)
+    parser.add_argument("--flooders", type=int, default=64)
+    parser.add_argument("--flood-rate", type=float, default=5000.0)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--block-ms", type=float, default=1000.0)
+    parser.add_argument("--rate", type=float, default=20.0)
+    parser.add_argument("--burst", type=float, default=100.0)
+    parser.add_argument("--queue-size", type=int, default=256)
+    args = parser.parse_args()
+
+    print(f"{args.polite} polite traders at {args.polite_rate:g}/s, one flooder at {args.flood_rate:,.0f}/s "
+          f"on {args.flooders} threads, a block every {args.block_ms:g} ms")
+    print(f"{'':<28} {'polite p50':>10} {'p99':>8} {'max':>8} {'flood ok':>9} {'429':>8} {'503':>8}")
+    for label, flooders, admission, receipt_on_worker in (
+        ("no flood, receipt on worker", 0, True, True),
+        ("no flood, settle", 0, True, False),
+        ("flood, admission off", args.flooders, False, False),
+        ("flood, admission on", args.flooders, True, False),
+    ):
+        r = run(args, flooders, admission, receipt_on_worker)
+        lat = r["latencies"]
+        print(f"{label:<28} {statistics.median(lat) * 1000:>8.2f}ms {percentile(lat, 0.99) * 1000:>6.2f}ms "
+              f"{max(lat) * 1000:>6.2f}ms {r['accepted']:>9,} {r['rate_limited']:>8,} {r['overloaded']:>8,}")
+        refused = r.get("polite_rate_limited", 0) + r.get("polite_overloaded", 0)
+        if refused:
+            print(f"  {refused:,} polite requests refused")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Requests per second of the order API with the engine stubbed out.
+
+    python -m benchmarks.bench_api
+
+Compares the previous handler shape (dict body, hand-parsed fields, responses
+built from t.__dict__ and pushed through jsonable_encoder) against the typed
+request models + orjson responses, with and without the embedded book.
+"""
+import time
+from types import SimpleNamespace
+
+from benchmarks.stubs import import_server
+from fastapi import FastAPI, Body
+from fastapi.testclient import TestClient
+
+from off_chain_systems.matching_engine import Trade
+from off_chain_systems.position_manager import Side
+
+REQUESTS = 2000
+BOOK_DEPTH = 50
+
+
+class StubEngine:
+    def __init__(self):
+        self.order_id = 0
+        self.trade_events = [
+            Trade(time.time(), i, 0.5, 1.0, "0xTaker", "0xMaker", Side.BUY, 0.0003, 0.0001)
+            for i in range(20)
+        ]
+        self._snapshot = {
+            "bids": [[0.5 - i / 1000, 10.0] for i in range(BOOK_DEPTH)],
+            "asks": [[0.5 + i / 1000, 10.0] for i in range(BOOK_DEPTH)],
+        }
+
+    def snapshot(self):
+        return self._snapshot
+
+    def market_order(self, **kwargs):
+        pass
+
+
+def legacy_app(engine) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/tx/market_order")
+    def place_market_order(order: dict = Body(...)):
+        Side.BUY if order["direction"].lower() == "buy" else Side.SELL
+        order["trader_address"], order["quantity"], order["leverage"]
+        engine.market_order()
+        return {
+            "status": "ok",
+            "orderbook": engine.snapshot(),
+            "trades": [t.__dict__ for t in engine.trade_events[-20:]],
+        }
+
+    return app
+
+
+def rps(client: TestClient, url: str, payload: dict, requests: int = REQUESTS) -> float:
+    for _ in range(50):
+        client.post(url, json=payload)
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.post(url, json=payload)
+    return requests / (time.perf_counter() - start)
+
+
+def encode_us(engine, rounds: int = 5000) -> tuple[float, float]:
+    """Per-response encoding cost alone, outside the HTTP stack."""
+    import json
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        body = {"status": "ok", "orderbook": engine.snapshot(), "trades": [t.__dict__ for t in engine.trade_events]}
+        json.dumps(jsonable_encoder(body)).encode()
+    legacy = (time.perf_counter() - start) / rounds * 1e6
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        orjson.dumps({"status": "ok", "orderbook": engine.snapshot(), "trades": engine.trade_events})
+    fast = (time.perf_counter() - start) / rounds * 1e6
+    return legacy, fast
+
+
+def main():
+    server = import_server()
+    engine = StubEngine()
+    server.engine = engine
+    server.pm = SimpleNamespace(create_account=lambda _address: None)
+
+    payload = {"trader_address": "0xTrader", "direction": "buy", "quantity": 1.0, "leverage": 2}
+
+    legacy = TestClient(legacy_app(engine))
+    typed = TestClient(server.app)
+
+    print(f"legacy dict + jsonable_encoder   {rps(legacy, '/tx/market_order', payload):8.0f} req/s")
+    print(f"typed models + orjson            {rps(typed, '/tx/market_order', payload):8.0f} req/s")
+    print(f"typed models + orjson, no book   {rps(typed, '/tx/market_order?include_book=false', payload):8.0f} req/s")
+
+    legacy_us, fast_us = encode_us(engine)
+    print(f"encode only: jsonable_encoder {legacy_us:.1f} us, orjson {fast_us:.1f} us per response")
+
+
+if __name__ == "__main__":
+    main()
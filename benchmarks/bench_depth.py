@@ -0,0 +1,97 @@
+"""
+Price-impact queries on deep books: walking the ask levels best-first (what a
+quote costs without an index) vs. the DepthIndex Fenwick trees.
+
+    python -m benchmarks.bench_depth [--levels 100 1000 9999] [--tick 0.0001] [--queries 2000]
+
+Each resting ask is one maker order on its own tick. "cost" is the VWAP of
+taking a random share of the side, "within" the size resting up to a random
+price between the best ask and 1, "update" one resting-size change in the index. The
+book is the real engine's (settlement stubbed, see benchmarks.stubs), so the
+index is fed through rest_order like in production.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.stubs import build_engine
+from off_chain_systems import matching_engine
+from off_chain_systems.position_manager import Side
+
+
+def build_book(tick: float, levels: int, rng: random.Random):
+    matching_engine.TICK_SIZE = tick
+    engine, pm = build_engine()
+    ticks = round(1 / tick)
+    for i, t in enumerate(rng.sample(range(1, ticks), levels)):
+        pm.create_account(f"0xMaker{i}")
+        engine.add_limit_order(f"0xMaker{i}", Side.SELL, round(t * tick, 6), float(rng.randint(1, 10)), 2)
+    return engine
+
+
+def walk(ladder, quantity: float, limit: float) -> tuple[float, float]:
+    filled, notional = 0.0, 0.0
+    levels, prices = ladder.levels, ladder.prices
+    for tick in range(ladder.low, ladder.high + 1):
+        level = levels[tick]
+        if level is None:
+            continue
+        price = prices[tick]
+        if price > limit:
+            break
+        for order in level:
+            take = min(quantity - filled, order.quantity)
+            filled += take
+            notional += take * price
+            if filled >= quantity:
+                return filled, notional
+    return filled, notional
+
+
+def timed(run, queries: list) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        run(query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[100, 1000, 9999])
+    parser.add_argument("--tick", type=float, default=0.0001)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    ticks = round(1 / args.tick) - 1
+
+    print(f"tick {args.tick} ({ticks:,} ticks), us per query")
+    print(f"{'levels':>7} {'query':>7} {'walk':>9} {'index':>9} {'speedup':>8}")
+    for levels in args.levels:
+        levels = min(levels, ticks)
+        rng = random.Random(args.seed)
+        engine = build_book(args.tick, levels, rng)
+        asks, depth = engine.asks, engine.ask_depth
+        total, best = depth.total(), engine.get_best_ask()
+        sizes = [rng.uniform(0, total) for _ in range(args.queries)]
+        limits = [rng.uniform(best, 1.0) for _ in range(args.queries)]
+
+        # both sides must agree before either is timed
+        for size, limit in zip(sizes[:200], limits[:200]):
+            assert abs(walk(asks, size, 1.0)[1] - depth.cost(size)[1]) < 1e-6
+            assert abs(walk(asks, float("inf"), limit)[0] - depth.within(limit)[0]) < 1e-6
+
+        for query, runs in (
+            ("cost", (lambda q: walk(asks, q, 1.0), depth.cost, sizes)),
+            ("within", (lambda q: walk(asks, float("inf"), q), depth.within, limits)),
+        ):
+            walked, indexed = timed(runs[0], runs[2]), timed(runs[1], runs[2])
+            print(f"{levels:>7,} {query:>7} {walked * 1e6:>9.2f} {indexed * 1e6:>9.2f} {walked / indexed:>7.0f}x")
+
+        prices = asks.keys()
+        updates = [(rng.choice(prices), rng.choice((-1.0, 1.0))) for _ in range(args.queries)]
+        update = timed(lambda u: depth.add(*u), updates)
+        print(f"{levels:>7,} {'update':>7} {'-':>9} {update * 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Good-till-time expiry on a deep book: the engine's timing wheel vs. a periodic
+scan of every open order for expires_at <= now.
+
+    python -m benchmarks.bench_expiry [--orders 100000] [--due 10 1000 10000]
+
+Rests --orders GTT asks (settlement stubbed, see benchmarks.stubs) with
+expiries spread over an hour, then runs one expiry pass per wheel tick, as the
+server's expiry loop does, across the window in which the first --due of them
+fall due. The wheel's passes include taking those orders off the book; the
+scan only finds them, and costs the same whether anything is due or not.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.stubs import build_engine
+from off_chain_systems.matching_engine import TimeInForce
+from off_chain_systems.position_manager import Side
+
+
+def build_book(orders: int, rng: random.Random, now: float):
+    engine, pm = build_engine()
+    # the first deadline is far enough out that none passes while the book is built
+    expiries = [now + rng.uniform(600, 4200) for _ in range(orders)]
+    for i, expires_at in enumerate(expiries):
+        trader = f"0xMaker{i}"
+        pm.create_account(trader)
+        engine.add_limit_order(trader, Side.SELL, rng.randint(501, 999) / 1000, 1.0, 2, TimeInForce.GTT, expires_at)
+    return engine, sorted(expiries)
+
+
+def scan(engine, now: float) -> list:
+    return [trader for trader, (order, _) in engine.open_orders.items()
+            if order.expires_at is not None and order.expires_at <= now]
+
+
+def timed_scan(engine, now: float) -> float:
+    start = time.perf_counter()
+    scan(engine, now)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--due", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    engine, expiries = build_book(args.orders, random.Random(args.seed), time.time())
+    tick = engine.expiries.tick
+    # catch the wheel up to just before the first deadline, off the clock
+    now = expiries[0] - tick
+    engine.expire_orders(now)
+
+    scan_s = min(timed_scan(engine, now) for _ in range(5))
+    print(f"{args.orders:,} resting GTT orders, one pass per {tick}s tick")
+    print(f"  scan, any pass   {scan_s * 1000:>8.2f} ms")
+    print(f"{'due':>7} {'passes':>8} {'wheel ms/pass':>14} {'us/expired':>11} {'scan / wheel':>13}")
+    expired, elapsed, passes = 0, 0.0, 0
+    for due in sorted(args.due):
+        while expired < due:
+            now += tick
+            start = time.perf_counter()
+            expired += len(engine.expire_orders(now))
+            elapsed += time.perf_counter() - start
+            passes += 1
+        per_pass = elapsed / passes
+        print(f"{expired:>7,} {passes:>8,} {per_pass * 1000:>14.3f} {elapsed / expired * 1e6:>11.2f} "
+              f"{scan_s / per_pass:>12,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Matching engine throughput / latency / memory under synthetic order flow.
+
+    python -m benchmarks.bench_flow                       # every scenario
+    python -m benchmarks.bench_flow steady --orders 20000 --save
+    python -m benchmarks.bench_flow steady --pace --rate 5000
+
+--save writes benchmarks/results/<scenario>-<commit>.json, compare two
+runs with python -m benchmarks.compare OLD.json NEW.json.
+"""
+import argparse
+from dataclasses import replace
+
+from benchmarks.flow import FlowConfig
+from benchmarks.harness import run, save, summary_lines
+
+SCENARIOS = {
+    # default mix: mostly passive flow, a quarter of it cancels
+    "steady": FlowConfig(),
+    # quote-stuffing style flow, most orders are pulled before they trade
+    "cancel_heavy": FlowConfig(limit_weight=0.45, market_weight=0.02, cancel_weight=0.45, replace_weight=0.08),
+    # aggressive takers sweeping a thinner book
+    "taker_heavy": FlowConfig(limit_weight=0.55, market_weight=0.35, cancel_weight=0.08, replace_weight=0.02),
+    # liquidity spread evenly over a deep ladder
+    "deep_book": FlowConfig(price_distribution="uniform", depth_ticks=400, cancel_weight=0.15, limit_weight=0.7),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--orders", type=int, help="events per scenario")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--rate", type=float, help="Poisson arrival rate, events per second")
+    parser.add_argument("--pace", action="store_true", help="replay on the arrival schedule instead of back to back")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--save", action="store_true", help="write results to benchmarks/results/")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+
+    overrides = {
+        key: value for key, value in
+        (("orders", args.orders), ("seed", args.seed), ("arrival_rate", args.rate))
+        if value is not None
+    }
+
+    for name in args.scenarios or SCENARIOS:
+        config = replace(SCENARIOS[name], **overrides)
+        result = run(name, config, pace=args.pace, memory=not args.no_memory)
+        print("\n".join(summary_lines(result)))
+        if args.save:
+            print(f"  saved {save(result)}")
+
+
+if __name__ == "__main__":
+    main()
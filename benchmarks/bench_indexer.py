@@ -0,0 +1,154 @@
+"""
+Chain indexer throughput against a mocked node with a fixed RPC round trip.
+
+    python -m benchmarks.bench_indexer [--blocks 20000] [--traders 1000] [--rpc-ms 1]
+
+The node serves a synthetic perps event stream shaped like anvil under load:
+one transaction per block (automine), traders cycling open -> close with the
+odd third-party liquidation, and a funding update every 10 blocks. "ranged" is
+ChainIndexer with INDEXER_BATCH_BLOCKS, "per-block" the same indexer reading
+one block per eth_getLogs. "positions poll" is the alternative the indexer
+replaces: one positions(addr) eth_call per known account, which only gets one
+snapshot of the accounts per pass, however many blocks it covers.
+"""
+import argparse
+import random
+import time
+from bisect import bisect_left, bisect_right
+
+from benchmarks import stubs
+
+stubs.patch_web3()
+
+import boa  # noqa: E402
+from eth_abi import encode  # noqa: E402
+from eth_utils import event_abi_to_log_topic, to_checksum_address  # noqa: E402
+from vyper.compiler.output import build_abi_output  # noqa: E402
+from web3 import Web3  # noqa: E402
+from web3.providers.base import BaseProvider  # noqa: E402
+
+from off_chain_systems import indexer  # noqa: E402
+from off_chain_systems.position_manager import PositionManager  # noqa: E402
+
+PERPS = to_checksum_address("0x00000000000000000000000000000000000000c3")
+PRICE_SCALE = 10**6
+
+
+class EventEncoder:
+    def __init__(self, abi: list):
+        self.events = {e["name"]: e for e in abi if e["type"] == "event"}
+        self.topics = {name: "0x" + event_abi_to_log_topic(e).hex() for name, e in self.events.items()}
+
+    def log(self, name: str, block: int, **args) -> dict:
+        event = self.events[name]
+        indexed = ["0x" + encode([i["type"]], [args[i["name"]]]).hex() for i in event["inputs"] if i["indexed"]]
+        data = [i for i in event["inputs"] if not i["indexed"]]
+        return {
+            "address": PERPS, "blockNumber": hex(block), "logIndex": "0x0", "transactionIndex": "0x0",
+            "blockHash": "0x" + f"{block:064x}", "transactionHash": "0x" + f"{block:064x}", "removed": False,
+            "topics": [self.topics[name]] + indexed,
+            "data": "0x" + encode([i["type"] for i in data], [args[i["name"]] for i in data]).hex(),
+        }
+
+
+def event_stream(encoder: EventEncoder, blocks: int, traders: list, seed: int = 7) -> list:
+    """One transaction per block, as anvil automines them."""
+    rng = random.Random(seed)
+    open_traders, logs, funding_index = set(), [], 0
+    for block in range(1, blocks + 1):
+        if block % 10 == 0:
+            funding_index += 10**12 * 10
+            logs.append(encoder.log("FundingUpdated", block, funding_index=funding_index,
+                                    funding_rate_per_second=10**12, timestamp=block))
+            continue
+        trader = rng.choice(traders)
+        if trader not in open_traders:
+            logs.append(encoder.log("PositionOpened", block, trader=trader, margin=100 * PRICE_SCALE, leverage=2,
+                                    entry_price=rng.randint(200000, 800000), direction=rng.random() < 0.5,
+                                    funding_index_snapshot=funding_index))
+            open_traders.add(trader)
+        elif rng.random() < 0.1:
+            logs.append(encoder.log("PositionLiquidated", block, trader=trader, liquidator=traders[0], equity=0))
+            open_traders.discard(trader)
+        else:
+            logs.append(encoder.log("PositionClosed", block, trader=trader, price=500000, pnl=rng.randint(-10**7, 10**7)))
+            open_traders.discard(trader)
+    return logs
+
+
+class MockNode(BaseProvider):
+    def __init__(self, logs: list, head: int, latency: float):
+        super().__init__()
+        self.logs = logs
+        self.blocks = [int(entry["blockNumber"], 16) for entry in logs]
+        self.head = head
+        self.latency = latency
+        self.calls = 0
+        self.position = "0x" + encode(
+            ["(uint256,uint256,uint256,uint256,int256,bool,bool)"], [(100, 2, 500000, 200, 0, True, True)]
+        ).hex()
+
+    def make_request(self, method, params):
+        self.calls += 1
+        time.sleep(self.latency)
+        if method == "eth_blockNumber":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(self.head)}
+        if method == "eth_getLogs":
+            start, end = int(params[0]["fromBlock"], 16), int(params[0]["toBlock"], 16)
+            result = self.logs[bisect_left(self.blocks, start):bisect_right(self.blocks, end)]
+            return {"jsonrpc": "2.0", "id": 1, "result": result}
+        if method == "eth_call":
+            return {"jsonrpc": "2.0", "id": 1, "result": self.position}
+        if method == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(31337)}
+        raise AssertionError(f"unexpected RPC {method}")
+
+
+def run_indexer(logs: list, blocks: int, latency: float, batch_blocks: int) -> dict:
+    logs = [entry for entry in logs if int(entry["blockNumber"], 16) <= blocks]
+    node = MockNode(logs, blocks, latency)
+    pm = PositionManager()
+    chain_indexer = indexer.ChainIndexer(Web3(node), pm, "BTC", None, _start_block=1, _batch_blocks=batch_blocks)
+    start = time.perf_counter()
+    events = chain_indexer.poll()
+    elapsed = time.perf_counter() - start
+    return {"elapsed": elapsed, "events": events, "calls": node.calls}
+
+
+def run_positions_poll(abi: list, traders: list, latency: float) -> dict:
+    node = MockNode([], 0, latency)
+    contract = Web3(node).eth.contract(address=PERPS, abi=abi)
+    start = time.perf_counter()
+    for trader in traders:
+        contract.functions.positions(trader).call()
+    return {"elapsed": time.perf_counter() - start, "calls": node.calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=20000)
+    parser.add_argument("--traders", type=int, default=1000)
+    parser.add_argument("--rpc-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    abi = build_abi_output(boa.load_partial("src/perps_contract.vy").compiler_data)
+    indexer.PERPS_ADDRESS, indexer.PERPS_ABI = PERPS, abi
+    traders = [to_checksum_address(f"0x{i + 1:040x}") for i in range(args.traders)]
+    logs = event_stream(EventEncoder(abi), args.blocks, traders)
+    latency = args.rpc_ms / 1000
+
+    print(f"{args.blocks:,} blocks (1 tx each), {len(logs):,} events, {args.traders:,} traders, {args.rpc_ms}ms per RPC")
+    print(f"{'mode':>16} {'batch':>6} {'rpc calls':>10} {'seconds':>8} {'blocks/s':>10} {'events/s':>10}")
+    for mode, batch in (("per-block", 1), ("ranged", 100), ("ranged", indexer.INDEXER_BATCH_BLOCKS)):
+        # per-block is RPC bound, a slice of the chain is enough to measure its rate
+        n_blocks = min(args.blocks, 5000) if batch == 1 else args.blocks
+        r = run_indexer(logs, n_blocks, latency, batch)
+        print(f"{mode:>16} {batch:>6} {r['calls']:>10,} {r['elapsed']:>8.2f} "
+              f"{n_blocks / r['elapsed']:>10,.0f} {r['events'] / r['elapsed']:>10,.0f}")
+
+    r = run_positions_poll(abi, traders, latency)
+    print(f"{'positions poll':>16} {'-':>6} {r['calls']:>10,} {r['elapsed']:>8.2f}   one pass over every account")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Calling-thread cost of the queue-backed logger vs. the print() calls it replaced.
+
+    python -m benchmarks.bench_logging
+
+Both sides write to the same sink (a temp file), so the difference is
+formatting + I/O on the request thread vs. an enqueue. print() is measured
+both block-buffered and flushed per line (tty / PYTHONUNBUFFERED=1). Also runs the steady
+order-flow scenario with engine logging at INFO and silenced.
+"""
+import os
+import tempfile
+import time
+
+from benchmarks.flow import FlowConfig
+from benchmarks.harness import replay
+from off_chain_systems import log as tachyon_log
+
+CALLS = 100_000
+
+
+def per_call_ns(fn) -> float:
+    start = time.perf_counter_ns()
+    for i in range(CALLS):
+        fn(i)
+    return (time.perf_counter_ns() - start) / CALLS
+
+
+def main():
+    with tempfile.TemporaryFile("w") as sink:
+        def with_print(i):
+            print(f"Position created for 0xTrader{i}: BENCH, Side.BUY, qty={i}, avg_price=0.5", file=sink)
+
+        def with_print_flushed(i):
+            print(f"Position created for 0xTrader{i}: BENCH, Side.BUY, qty={i}, avg_price=0.5", file=sink, flush=True)
+
+        print_ns = per_call_ns(with_print)
+        # what a tty, or a container running with PYTHONUNBUFFERED=1, actually does
+        flushed_ns = per_call_ns(with_print_flushed)
+
+        tachyon_log.configure("INFO", "text", sink)
+        log = tachyon_log.get_logger("bench")
+
+        def with_logger(i):
+            log.info("Position %s opened for %s", i, "0xTrader", market="BENCH", quantity=i, entry_price=0.5)
+
+        def below_level(i):
+            log.debug("Account created for %s", "0xTrader", trader="0xTrader")
+
+        info_ns = per_call_ns(with_logger)
+        debug_ns = per_call_ns(below_level)
+        drain_start = time.perf_counter()
+        tachyon_log.flush()
+        drain_ms = (time.perf_counter() - drain_start) * 1e3
+
+        tachyon_log.configure("INFO", "json", sink)
+        json_ns = per_call_ns(with_logger)
+        tachyon_log.flush()
+
+    print(f"print() to buffered file:      {print_ns:7.0f} ns/call")
+    print(f"print() flushed per line:      {flushed_ns:7.0f} ns/call")
+    print(f"log.info, text, queued:        {info_ns:7.0f} ns/call  (writer drained the backlog {drain_ms:.0f} ms later)")
+    print(f"log.info, json, queued:        {json_ns:7.0f} ns/call")
+    print(f"log.debug below level:         {debug_ns:7.0f} ns/call")
+
+    config = FlowConfig(orders=5_000)
+    with open(os.devnull, "w") as devnull:
+        for level in ("INFO", "WARNING"):
+            tachyon_log.configure(level, "text", devnull)
+            rate = replay(config, quiet=False)["orders_per_sec"]
+            print(f"steady flow, engine logging at {level:<7}: {rate:8,.0f} orders/s")
+        tachyon_log.shutdown()
+
+
+if __name__ == "__main__":
+    main()
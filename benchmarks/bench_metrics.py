@@ -0,0 +1,67 @@
+"""
+Cost of the order path instrumentation.
+
+    python -m benchmarks.bench_metrics
+
+Measures a single stage timer enter/exit, then limit + market order rounds
+through a real OrderBook (settlement stubbed, see benchmarks.stubs) with
+METRICS_ENABLED on and off.
+"""
+import time
+
+from benchmarks.harness import muted_logs
+from benchmarks.stubs import build_engine
+from off_chain_systems import metrics
+from off_chain_systems.position_manager import Side
+
+TIMER_ROUNDS = 200_000
+ORDER_ROUNDS = 2000
+REPEATS = 9
+
+
+def timer_ns(enabled: bool) -> float:
+    metrics.METRICS_ENABLED = enabled
+    start = time.perf_counter_ns()
+    for _ in range(TIMER_ROUNDS):
+        with metrics.stage("bench"):
+            pass
+    return (time.perf_counter_ns() - start) / TIMER_ROUNDS
+
+
+def order_round_us(enabled: bool) -> float:
+    """One resting sell plus the market buy that takes it, per round."""
+    metrics.METRICS_ENABLED = enabled
+    engine, pm = build_engine()
+    pm.get_perp_price = lambda: 0.5
+
+    # the engine logs on every account and position, keep that out of the timing
+    with muted_logs():
+        for i in range(ORDER_ROUNDS):
+            pm.create_account(f"0xMaker{i}")
+            pm.create_account(f"0xTaker{i}")
+        start = time.perf_counter()
+        for i in range(ORDER_ROUNDS):
+            engine.add_limit_order(f"0xMaker{i}", Side.SELL, 0.5, 1, 2)
+            engine.market_order(f"0xTaker{i}", Side.BUY, 1, 2)
+        elapsed = time.perf_counter() - start
+    return elapsed / ORDER_ROUNDS * 1e6
+
+
+def main():
+    off_ns = min(timer_ns(False) for _ in range(REPEATS))
+    on_ns = min(timer_ns(True) for _ in range(REPEATS))
+    print(f"stage timer enter/exit: {on_ns:.0f} ns (disabled {off_ns:.0f} ns)")
+
+    # interleaved so machine noise hits both sides alike
+    off_runs, on_runs = [], []
+    for _ in range(REPEATS):
+        off_runs.append(order_round_us(False))
+        on_runs.append(order_round_us(True))
+    off_us, on_us = min(off_runs), min(on_runs)
+    print(f"limit + market round:   {on_us:.1f} us with metrics, {off_us:.1f} us without "
+          f"(+{on_us - off_us:.1f} us, {100 * (on_us - off_us) / off_us:.1f}%)")
+
+    metrics.METRICS_ENABLED = True
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Gas per market updated on oracle.vy under titanoboa: one legacy
+update_oracle / update_perp transaction per price vs. batched update_prices.
+
+    python -m benchmarks.bench_oracle_gas [--markets 1 10 50 100 256]
+
+Totals are per transaction: 21000 intrinsic + calldata + execution, since the
+intrinsic cost is what batching amortises and boa only meters execution.
+Every round advances the clock first, so timestamps are rewritten like they
+are on a live chain. "first write" is a market's first update (zero -> non-zero
+slots); "steady" is every update after that.
+"""
+import argparse
+
+import boa
+
+TX_BASE_GAS = 21000
+PRICE_SCALE = 10**6
+
+
+def calldata_gas(data: bytes) -> int:
+    return sum(16 if byte else 4 for byte in data)
+
+
+def tx_gas(contract, fn_name: str, *args) -> int:
+    fn = getattr(contract, fn_name)
+    data = fn.prepare_calldata(*args)
+    boa.env.reset_gas_used()
+    fn(*args)
+    return TX_BASE_GAS + calldata_gas(data) + boa.env.get_gas_used()
+
+
+def legacy_round(oracle, price: int) -> int:
+    """What a single-market oracle costs to refresh both prices: two transactions."""
+    boa.env.time_travel(seconds=10)
+    return tx_gas(oracle, "update_oracle", price) + tx_gas(oracle, "update_perp", price)
+
+
+def batch_round(oracle, market_ids: list, price: int, perp: bool) -> int:
+    boa.env.time_travel(seconds=10)
+    # PriceField.ORACLE, with PriceField.PERP
+    fields = [3 if perp else 1] * len(market_ids)
+    return tx_gas(oracle, "update_prices", market_ids, [price] * len(market_ids), [price] * len(market_ids), fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--markets", type=int, nargs="+", default=[1, 10, 50, 100, 256])
+    args = parser.parse_args()
+
+    updater = boa.env.generate_address()
+    with boa.env.prank(updater):
+        oracle = boa.load("src/oracle.vy", PRICE_SCALE // 2, updater, PRICE_SCALE // 2)
+        legacy = legacy_round(oracle, 410000)
+
+        print(f"legacy update_oracle + update_perp: {legacy:,} gas per market per refresh (2 txs)")
+        print(f"{'markets':>8} {'oracle only':>12} {'oracle+perp':>12} {'first write':>12} {'vs legacy':>10}")
+        next_id = 1
+        for n in args.markets:
+            market_ids = list(range(next_id, next_id + n))
+            next_id += n
+            first = batch_round(oracle, market_ids, 420000, perp=True) // n
+            oracle_only = batch_round(oracle, market_ids, 430000, perp=False) // n
+            both = batch_round(oracle, market_ids, 440000, perp=True) // n
+            print(f"{n:>8} {oracle_only:>12,} {both:>12,} {first:>12,} {both / legacy:>9.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Oracle keeper cycle time vs. number of markets, against a mocked Polymarket
+API and RPC node that both add a fixed round-trip latency.
+
+    python -m benchmarks.bench_oracle_keeper [--markets 1 10 100 250 500] [--api-ms 20] [--rpc-ms 2]
+
+"per-token" is the original cycle: one GET /midpoint per market and one
+awaited transaction per update. "batched" is the current keeper: POST
+/midpoints in MIDPOINT_BATCH_SIZE chunks and one update_prices transaction per
+MAX_BATCH markets, all sent concurrently. "sign" is the CPU time the batched
+keeper spends encoding + signing a cycle. Also reports startup (slug -> token
+resolution) with a cold and a warm token cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from web3 import AsyncWeb3
+from web3.providers.async_base import AsyncBaseProvider
+
+ORACLE_ABI = [{
+    "type": "function",
+    "name": "update_prices",
+    "inputs": [
+        {"name": "_market_ids", "type": "uint256[]"},
+        {"name": "_oracle_prices", "type": "uint256[]"},
+        {"name": "_perp_prices", "type": "uint256[]"},
+        {"name": "_fields", "type": "uint256[]"},
+    ],
+    "outputs": [],
+    "stateMutability": "nonpayable",
+}, {
+    "type": "function",
+    "name": "markets",
+    "inputs": [{"name": "arg0", "type": "uint256"}],
+    "outputs": [{"name": "", "type": "tuple", "components": [
+        {"name": "oracle_price", "type": "uint256"},
+        {"name": "perp_price", "type": "uint256"},
+        {"name": "last_update_time", "type": "uint256"},
+        {"name": "last_update_time_perp", "type": "uint256"},
+    ]}],
+    "stateMutability": "view",
+}]
+ORACLE = "0x00000000000000000000000000000000000000a1"
+# the keeper reads its ABI from the environment at import time
+os.environ.setdefault("ORACLE_ABI", json.dumps(ORACLE_ABI))
+
+from keeper import oracle_update_script as oracle_keeper  # noqa: E402
+
+KEEPER_KEY = "0x" + "11" * 32
+REPEATS = 3
+
+
+class MockPolymarket(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency: float):
+        super().__init__(("127.0.0.1", 0), MockPolymarketHandler)
+        self.latency = latency
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class MockPolymarketHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/events/slug/"):
+            token = "tok-" + url.path.rsplit("/", 1)[-1]
+            body = {"markets": [{"clobTokenIds": json.dumps([token, f"{token}-no"])}]}
+        else:
+            body = {"mid": "0.5"}
+        self.respond(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.respond({entry["token_id"]: "0.5" for entry in request})
+
+    def respond(self, body):
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockNode(AsyncBaseProvider):
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.sends = 0
+
+    async def make_request(self, method, params):
+        await asyncio.sleep(self.latency)
+        if method == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(31337)}
+        if method == "eth_getTransactionCount":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(self.sends)}
+        if method == "eth_call":
+            # never updated, so every market's first price is pushed
+            return {"jsonrpc": "2.0", "id": 1, "result": "0x" + "00" * 128}
+        self.sends += 1
+        return {"jsonrpc": "2.0", "id": 1, "result": "0x" + f"{self.sends:064x}"}
+
+    async def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+
+class PerTokenKeeper(oracle_keeper.OracleKeeper):
+    """The keeper as it was: a midpoint request per market, a transaction per market sent one at a time."""
+    async def fetch_prices(self) -> list:
+        active = self.active_markets()
+        prices = await asyncio.gather(
+            *(oracle_keeper.get_yes_token_price(self.client, market.token_id) for market in active),
+            return_exceptions=True
+        )
+        return list(zip(active, prices))
+
+    async def push_updates(self, _updates: list) -> list:
+        results = []
+        for market, price in _updates:
+            try:
+                results.append(await self.send_batch([(market, price)], self.sign_batch([(market, price)])))
+            except Exception as e:
+                await self.sync_nonce()
+                results.append(e)
+        return results
+
+
+def markets(n: int) -> list:
+    return [oracle_keeper.Market(f"m{i}", ORACLE, market_id=i) for i in range(n)]
+
+
+async def measure(keeper_class, n: int, rpc_latency: float, cache_path: str) -> dict:
+    async with oracle_keeper.make_http_client() as client:
+        cache = oracle_keeper.TokenCache(cache_path, oracle_keeper.TOKEN_CACHE_TTL)
+        # the mock price never moves, push it every cycle anyway
+        policy = oracle_keeper.UpdatePolicy(deviation_bps=0, heartbeat=0)
+        keeper = keeper_class(AsyncWeb3(MockNode(rpc_latency)), client, markets(n), KEEPER_KEY, cache, policy)
+        start = time.perf_counter()
+        await keeper.setup()
+        setup_ms = (time.perf_counter() - start) * 1e3
+
+        cycle_ms = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            assert await keeper.run_cycle() == n
+            cycle_ms.append((time.perf_counter() - start) * 1e3)
+    return {"setup_ms": setup_ms, "cycle_ms": min(cycle_ms)}
+
+
+def sign_ms(n: int) -> float:
+    """CPU floor of a batched cycle: encoding + signing n updates, no I/O."""
+    keeper = oracle_keeper.OracleKeeper(AsyncWeb3(), None, markets(n), KEEPER_KEY, oracle_keeper.TokenCache("", 0))
+    keeper.chain_id, keeper.nonce = 31337, 0
+    keeper.contracts[ORACLE] = keeper.w3.eth.contract(address=AsyncWeb3.to_checksum_address(ORACLE), abi=ORACLE_ABI)
+    start = time.perf_counter()
+    for batch in keeper.batch_updates([(market, 500000) for market in keeper.markets]):
+        keeper.sign_batch(batch)
+    return (time.perf_counter() - start) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--markets", type=int, nargs="+", default=[1, 10, 100, 250, 500])
+    parser.add_argument("--api-ms", type=float, default=20.0, help="mock Polymarket latency per request")
+    parser.add_argument("--rpc-ms", type=float, default=2.0, help="mock RPC latency per call")
+    args = parser.parse_args()
+
+    api = MockPolymarket(args.api_ms / 1e3)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    oracle_keeper.POLYMARKET_BASE_API = f"{api.url}/events/slug/"
+    oracle_keeper.POLYMARKET_CLOB_API = api.url
+    oracle_keeper.ORACLE_ABI = json.dumps(ORACLE_ABI)
+
+    print(f"api {args.api_ms:.0f} ms/request, rpc {args.rpc_ms:.0f} ms/call, "
+          f"{oracle_keeper.MAX_CONNECTIONS} connections, batch {oracle_keeper.MIDPOINT_BATCH_SIZE}")
+    print(f"{'markets':>8} {'per-token ms':>13} {'batched ms':>11} {'sign ms':>8} "
+          f"{'setup cold ms':>14} {'setup warm ms':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.markets:
+            cache_path = os.path.join(tmp, f"tokens-{n}.json")
+            per_token = asyncio.run(measure(PerTokenKeeper, n, args.rpc_ms / 1e3, os.path.join(tmp, "none.json")))
+            os.remove(os.path.join(tmp, "none.json"))
+            cold = asyncio.run(measure(oracle_keeper.OracleKeeper, n, args.rpc_ms / 1e3, cache_path))
+            warm = asyncio.run(measure(oracle_keeper.OracleKeeper, n, args.rpc_ms / 1e3, cache_path))
+            print(f"{n:>8} {per_token['cycle_ms']:>13.1f} {min(cold['cycle_ms'], warm['cycle_ms']):>11.1f} "
+                  f"{sign_ms(n):>8.1f} {cold['setup_ms']:>14.1f} {warm['setup_ms']:>14.1f}")
+    api.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Per-tick cost of the incremental premium TWAP vs. recomputing it from history.
+
+    python -m benchmarks.bench_premium_index
+
+Feeds PremiumIndex a synthetic stream of trades (random walk around the
+oracle) with an oracle tick every 10s of simulated time, at a few trade rates,
+into a 1h window. "recompute" is the same TWAP computed the obvious way, by
+walking every tick still in the window at funding time.
+"""
+import random
+import time
+
+from off_chain_systems.premium_index import PremiumIndex
+
+WINDOW = 3600.0
+TICKS = 200_000
+SAMPLES = 50
+
+
+def trade_stream(rate: float, seed: int = 7):
+    """(timestamp, kind, price) with `rate` trades per simulated second."""
+    rng = random.Random(seed)
+    oracle, perp, t, next_oracle = 0.5, 0.5, 0.0, 0.0
+    for _ in range(TICKS):
+        t += rng.expovariate(rate)
+        if t >= next_oracle:
+            oracle = min(max(oracle + rng.gauss(0, 0.002), 0.05), 0.95)
+            next_oracle += 10.0
+            yield t, "oracle", oracle
+        perp = min(max(perp + rng.gauss(0, 0.001), 0.05), 0.95)
+        yield t, "trade", perp
+
+
+def naive_twap(history: list, now: float) -> float:
+    """Walks every (t, premium) tick still inside the window."""
+    cutoff = now - WINDOW
+    area = covered = 0.0
+    for (t, premium), (next_t, _) in zip(history, history[1:] + [(now, None)]):
+        start = max(t, cutoff)
+        if next_t <= start:
+            continue
+        area += premium * (next_t - start)
+        covered += next_t - start
+    return area / covered
+
+
+def run(rate: float, resolution: float) -> dict:
+    events = list(trade_stream(rate))
+    index = PremiumIndex(_window=WINDOW, _resolution=resolution)
+    update_perp, update_oracle = index.update_perp, index.update_oracle
+
+    start = time.perf_counter_ns()
+    for t, kind, price in events:
+        if kind == "trade":
+            update_perp(price, t)
+        else:
+            update_oracle(price, t)
+    update_ns = (time.perf_counter_ns() - start) / len(events)
+
+    now = events[-1][0]
+    start = time.perf_counter_ns()
+    for _ in range(SAMPLES):
+        twap = index.twap(now)
+    twap_ns = (time.perf_counter_ns() - start) / SAMPLES
+
+    # the history a recompute would need: one (t, premium) per tick in the window,
+    # plus the last one before it, whose premium was still in force at the window edge
+    history, oracle, perp = [], None, None
+    for t, kind, price in events:
+        if kind == "trade":
+            perp = price
+        else:
+            oracle = price
+        if oracle is not None and perp is not None:
+            if history and t <= now - WINDOW:
+                history.pop()
+            history.append((t, (perp - oracle) / oracle))
+    start = time.perf_counter_ns()
+    naive = naive_twap(history, now)
+    naive_ns = time.perf_counter_ns() - start
+
+    return {
+        "update_ns": update_ns, "twap_ns": twap_ns, "naive_ns": naive_ns,
+        "segments": len(index.segments), "ticks_in_window": len(history), "error": abs(twap - naive),
+    }
+
+
+def main():
+    print(f"window {WINDOW:.0f}s, {TICKS:,} trades per run")
+    print(f"{'trades/s':>9} {'resolution':>10} {'ns/tick':>8} {'twap ns':>8} {'recompute us':>13} "
+          f"{'ticks in win':>13} {'segments':>9} {'|twap - exact|':>15}")
+    for rate in (10, 100, 1000):
+        for resolution in (0.0, 1.0):
+            r = run(rate, resolution)
+            print(f"{rate:>9} {resolution:>10.1f} {r['update_ns']:>8.0f} {r['twap_ns']:>8.0f} "
+                  f"{r['naive_ns'] / 1e3:>13,.0f} {r['ticks_in_window']:>13,} {r['segments']:>9,} {r['error']:>15.2e}")
+
+
+if __name__ == "__main__":
+    main()
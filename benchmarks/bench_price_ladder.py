@@ -0,0 +1,126 @@
+"""
+Book sides head to head: TickLadder (array of levels indexed by tick + bitmap)
+vs. the SortedDict keyed by float price it replaced.
+
+    python -m benchmarks.bench_price_ladder [--levels 50 400 999] [--ops 200000] [--tick 0.001]
+
+"churn" adds and removes whole levels at random ticks, "best" reads the best
+ask with peekitem(0), "get" looks a level up by price, "sweep" takes levels
+best-first until the side is empty, as market_order does. Then both back the
+engine for the bench_flow scenarios (settlement stubbed, see benchmarks.stubs),
+fastest of --repeat replays each, since the engine's own work dominates there.
+"""
+import argparse
+import contextlib
+import random
+import time
+
+from sortedcontainers import SortedDict
+
+from benchmarks.bench_flow import SCENARIOS
+from benchmarks.harness import replay
+from off_chain_systems import matching_engine
+from off_chain_systems.price_ladder import TickLadder
+
+
+class SortedBook(SortedDict):
+    """The previous book side: SortedDict keyed by price, with the grid OrderBook and its DepthIndex now expect."""
+
+    def __init__(self, _tick_size: float = 0.001):
+        super().__init__()
+        self.grid = TickLadder(_tick_size)
+        self.ticks = self.grid.ticks
+        self.prices = self.grid.prices
+
+    def tick(self, _price: float) -> int:
+        return self.grid.tick(_price)
+
+
+def prices(tick: float, count: int, rng: random.Random) -> list:
+    ticks = round(1 / tick)
+    return [round(t * tick, 6) for t in rng.sample(range(1, ticks), count)]
+
+
+def measure(book_type, tick: float, levels: int, ops: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    book = book_type(tick)
+    live = prices(tick, levels, rng)
+    for price in live:
+        book[price] = price
+    spare = [p for p in prices(tick, round(1 / tick) - 1, rng) if p not in book]
+    results = {}
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        i, j = rng.randrange(len(live)), rng.randrange(len(spare))
+        del book[live[i]]
+        book[spare[j]] = spare[j]
+        live[i], spare[j] = spare[j], live[i]
+    results["churn"] = (time.perf_counter() - start) / ops / 2
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        book.peekitem(0)
+    results["best"] = (time.perf_counter() - start) / ops
+
+    lookups = [rng.choice(live) for _ in range(ops)]
+    start = time.perf_counter()
+    for price in lookups:
+        book.get(price)
+    results["get"] = (time.perf_counter() - start) / ops
+
+    rounds = max(ops // levels, 1)
+    elapsed = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        while book:
+            price, _ = book.peekitem(0)
+            del book[price]
+        elapsed += time.perf_counter() - start
+        for price in live:
+            book[price] = price
+    results["sweep"] = elapsed / rounds / levels
+    return results
+
+
+@contextlib.contextmanager
+def engine_books(book_type):
+    previous = matching_engine.TickLadder
+    matching_engine.TickLadder = book_type
+    try:
+        yield
+    finally:
+        matching_engine.TickLadder = previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[50, 400, 999])
+    parser.add_argument("--ops", type=int, default=200000)
+    parser.add_argument("--tick", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3, help="engine replays per book, the fastest is kept")
+    args = parser.parse_args()
+    ticks = round(1 / args.tick) - 1
+
+    print(f"tick {args.tick} ({ticks:,} ticks), ns per operation")
+    print(f"{'levels':>7} {'book':>10} {'churn':>8} {'best':>8} {'get':>8} {'sweep':>8}")
+    for levels in args.levels:
+        levels = min(levels, ticks - 1)
+        for name, book_type in (("SortedDict", SortedBook), ("TickLadder", TickLadder)):
+            r = measure(book_type, args.tick, levels, args.ops, args.seed)
+            print(f"{levels:>7,} {name:>10} {r['churn'] * 1e9:>8.0f} {r['best'] * 1e9:>8.0f} "
+                  f"{r['get'] * 1e9:>8.0f} {r['sweep'] * 1e9:>8.0f}")
+
+    print(f"\n{'scenario':>12} {'book':>10} {'orders/s':>10} {'limit p50':>10} {'market p50':>11} {'market p99':>11}")
+    for scenario, config in SCENARIOS.items():
+        for name, book_type in (("SortedDict", SortedBook), ("TickLadder", TickLadder)):
+            with engine_books(book_type):
+                r = max((replay(config) for _ in range(args.repeat)), key=lambda run: run["orders_per_sec"])
+            kinds = r["by_kind"]
+            print(f"{scenario:>12} {name:>10} {r['orders_per_sec']:>10,.0f} {kinds['limit']['p50_us']:>8.1f}us "
+                  f"{kinds['market']['p50_us']:>9.1f}us {kinds['market']['p99_us']:>9.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Deep price levels: the old list level (list.remove per cancel and per filled
+order) vs. PriceLevel (deque head pops, tombstoned cancels).
+
+    python -m benchmarks.bench_price_level [--depths 1000 10000 50000] [--cancel 0.5]
+
+"cancel" removes a random --cancel share of the level, "sweep" then takes
+every order left, front to back, the way market_order consumes a level.
+"engine" runs market_order through a single level of that depth with
+settlement stubbed out (see benchmarks.stubs), old-list numbers there come
+from the baseline commit, this bench only times the current engine.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.stubs import build_engine
+from off_chain_systems.matching_engine import PriceLevel
+from off_chain_systems.position_manager import Side
+
+
+class Resting:
+    __slots__ = ("trader_id",)
+
+    def __init__(self, trader_id: int):
+        self.trader_id = trader_id
+
+
+def list_level(orders: list, cancelled: list) -> tuple[float, float]:
+    level = list(orders)
+    start = time.perf_counter()
+    for order in cancelled:
+        level.remove(order)
+    cancel = time.perf_counter() - start
+
+    start = time.perf_counter()
+    removal = []
+    for order in list(level):
+        removal.append(order)
+    for order in removal:
+        level.remove(order)
+    return cancel, time.perf_counter() - start
+
+
+def deque_level(orders: list, cancelled: list) -> tuple[float, float]:
+    level = PriceLevel()
+    slots = {order.trader_id: level.append(order) for order in orders}
+    start = time.perf_counter()
+    for order in cancelled:
+        level.discard(slots.pop(order.trader_id))
+    cancel = time.perf_counter() - start
+
+    start = time.perf_counter()
+    while level:
+        level.popleft()
+    return cancel, time.perf_counter() - start
+
+
+def engine_sweep(depth: int) -> float:
+    engine, pm = build_engine()
+    pm.create_account("0xTaker")
+    for i in range(depth):
+        pm.create_account(f"0xMaker{i}")
+        engine.add_limit_order(f"0xMaker{i}", Side.SELL, 0.5, 1.0, 2)
+    start = time.perf_counter()
+    engine.market_order("0xTaker", Side.BUY, float(depth), 2)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depths", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--cancel", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'depth':>7} {'level':>6} {'cancel ms':>10} {'sweep ms':>10} {'per fill us':>12}")
+    for depth in args.depths:
+        orders = [Resting(i) for i in range(depth)]
+        cancelled = random.Random(args.seed).sample(orders, int(depth * args.cancel))
+        left = depth - len(cancelled)
+        for name, run in (("list", list_level), ("deque", deque_level)):
+            cancel, sweep = run(orders, cancelled)
+            print(f"{depth:>7,} {name:>6} {cancel * 1000:>10.2f} {sweep * 1000:>10.2f} {sweep / left * 1e6:>12.3f}")
+        elapsed = engine_sweep(depth)
+        print(f"{depth:>7,} {'engine':>6} {'-':>10} {elapsed * 1000:>10.2f} {elapsed / depth * 1e6:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
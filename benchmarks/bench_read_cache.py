@@ -0,0 +1,94 @@
+"""
+Read endpoint throughput with 1k polling clients.
+
+    python -m benchmarks.bench_read_cache
+
+Every simulated client polls /orderbook and /trades once per round and the
+book mutates every few rounds (1k dashboards polling at 1 Hz against a book
+that changes every few seconds). Compares rebuilding the response on every GET against the
+version-keyed byte cache, with and without If-None-Match.
+"""
+import time
+
+from benchmarks.stubs import build_engine, import_server
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from off_chain_systems.position_manager import Side
+
+CLIENTS = 1000
+ROUNDS = 5
+ROUNDS_PER_CHANGE = 5
+LEVELS = 200
+
+
+def seed(engine):
+    for i in range(LEVELS):
+        engine.add_limit_order(f"0xBid{i}", Side.BUY, round(0.30 - i / 1000, 3), 5, 2)
+        engine.add_limit_order(f"0xAsk{i}", Side.SELL, round(0.70 + i / 1000, 3), 5, 2)
+
+
+def rebuild_app(engine) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/orderbook")
+    def get_orderbook():
+        return engine.snapshot()
+
+    @app.get("/trades")
+    def get_trades():
+        return {"trades": [t.__dict__ for t in engine.trade_events[-20:]]}
+
+    return app
+
+
+def poll(client: TestClient, engine, conditional: bool) -> tuple[float, int]:
+    etags = [{} for _ in range(CLIENTS)]
+    polls = 0
+    body_bytes = 0
+    start = time.perf_counter()
+    for round_number in range(ROUNDS):
+        for client_etags in etags:
+            for url in ("/orderbook", "/trades"):
+                headers = {"If-None-Match": client_etags[url]} if conditional and url in client_etags else {}
+                response = client.get(url, headers=headers)
+                if "ETag" in response.headers:
+                    client_etags[url] = response.headers["ETag"]
+                body_bytes += len(response.content)
+                polls += 1
+        if (round_number + 1) % ROUNDS_PER_CHANGE == 0:
+            engine.add_limit_order(f"0xMover{engine.order_id}", Side.BUY, 0.31, 1, 2)
+    return polls / (time.perf_counter() - start), body_bytes // polls
+
+
+def main():
+    server = import_server()
+    engine, pm = build_engine()
+    seed(engine)
+    server.engine = engine
+    server.pm = pm
+
+    rebuild = TestClient(rebuild_app(engine))
+    cached = TestClient(server.app)
+
+    print(f"{CLIENTS} clients, {LEVELS * 2} resting levels")
+    for label, client, conditional in (
+        ("rebuild per GET        ", rebuild, False),
+        ("cached bytes           ", cached, False),
+        ("cached bytes + ETag 304", cached, True),
+    ):
+        rate, avg_bytes = poll(client, engine, conditional)
+        print(f"{label}  {rate:8.0f} polls/s  {avg_bytes:7d} body bytes/poll")
+
+    start = time.perf_counter()
+    for _ in range(CLIENTS):
+        engine.snapshot()
+    rebuild_us = (time.perf_counter() - start) / CLIENTS * 1e6
+    start = time.perf_counter()
+    for _ in range(CLIENTS):
+        engine.encoded_snapshot()
+    cached_us = (time.perf_counter() - start) / CLIENTS * 1e6
+    print(f"handler cost: snapshot() {rebuild_us:.1f} us vs encoded_snapshot() {cached_us:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
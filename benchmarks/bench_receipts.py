@@ -0,0 +1,93 @@
+"""
+Settling a sweep through the engine: one wait_for_transaction_receipt per fill
+(the previous settlement path) vs. the block-driven ReceiptTracker.
+
+    python -m benchmarks.bench_receipts [--makers 1 10 50] [--block-ms 0 250]
+
+A market order sweeps --makers resting asks, and the real
+OrderBook.call_fill_limit_order builds, signs and sends one fill per maker
+through the PositionManager's TxScheduler to a fake node behind a real Web3
+(see benchmarks.stubs.BlockNode). --block-ms 0 mines each transaction as it
+arrives, like an auto-mining dev node; otherwise a block every --block-ms
+holds everything sent since the last one. Other settlement calls stay stubbed.
+
+"engine ms" is how long the market order holds the engine, "confirmed ms" runs
+from the order to the last fill's receipt, and "calls/tx" counts only the RPC
+calls spent waiting for receipts (eth_blockNumber, eth_getBlockReceipts,
+eth_getTransactionReceipt) per fill. Without a tracker each fill waits for its
+receipt on the engine thread; with one the engine only waits for the send.
+"""
+import argparse
+import statistics
+import time
+
+import boa
+from vyper.compiler.output import build_abi_output
+from web3 import Web3
+
+from benchmarks.stubs import BlockNode, build_engine
+from off_chain_systems import matching_engine
+from off_chain_systems.position_manager import Side
+from off_chain_systems.receipt_tracker import ReceiptTracker
+from off_chain_systems.tx_scheduler import TxScheduler
+
+KEY = "0x" + "11" * 32
+WAITING = ("eth_blockNumber", "eth_getBlockReceipts", "eth_getTransactionReceipt")
+
+
+def run(args, makers: int, block_ms: float, tracked: bool) -> dict:
+    engine, pm = build_engine()
+    node = BlockNode(block_ms / 1000).start()
+    engine.w3 = pm.w3 = Web3(node)
+    pm.receipts = ReceiptTracker(pm.w3) if tracked else None
+    pm.tx_scheduler = TxScheduler(pm.w3, KEY, pm.receipts)
+    # the real fill settlement, the rest stays stubbed
+    del engine.call_fill_limit_order
+
+    engine_times, confirm_times = [], []
+    pm.create_account("0xTaker")
+    for sweep in range(args.sweeps):
+        for i in range(makers):
+            # digits only, so already a checksum address
+            maker = f"0x{sweep * makers + i + 1:040d}"
+            pm.create_account(maker)
+            engine.add_limit_order(maker, Side.SELL, round(0.5 + i / 1000, 3), 1.0, 2)
+        start = time.perf_counter()
+        engine.market_order("0xTaker", Side.BUY, float(makers), 2)
+        engine_times.append(time.perf_counter() - start)
+        while pm.receipts is not None and len(pm.receipts):
+            time.sleep(0.0005)
+        confirm_times.append(time.perf_counter() - start)
+
+    if pm.receipts is not None:
+        pm.receipts.stop()
+    node.stop()
+    waiting = sum(node.calls[method] for method in WAITING)
+    return {"engine": statistics.median(engine_times), "confirmed": statistics.median(confirm_times),
+            "calls_per_tx": waiting / (makers * args.sweeps), "sent": node.sent}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--makers", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--block-ms", type=float, nargs="+", default=[0.0, 250.0])
+    parser.add_argument("--sweeps", type=int, default=5)
+    args = parser.parse_args()
+
+    matching_engine.PERPS_ABI = build_abi_output(boa.load_partial("src/perps_contract.vy").compiler_data)
+    matching_engine.PERPS_ADDRESS = "0x00000000000000000000000000000000000000b2"
+
+    print(f"median of {args.sweeps} sweeps, one fill transaction per maker")
+    print(f"{'block':>7} {'makers':>7} {'waiting on':>11} {'engine ms':>10} {'confirmed ms':>13} {'calls/tx':>9}")
+    for block_ms in args.block_ms:
+        block = f"{block_ms:g} ms" if block_ms else "auto"
+        for makers in args.makers:
+            for label, tracked in (("per-tx poll", False), ("tracker", True)):
+                r = run(args, makers, block_ms, tracked)
+                assert r["sent"] == makers * args.sweeps
+                print(f"{block:>7} {makers:>7,} {label:>11} {r['engine'] * 1000:>10.1f} "
+                      f"{r['confirmed'] * 1000:>13.1f} {r['calls_per_tx']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
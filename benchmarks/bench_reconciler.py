@@ -0,0 +1,130 @@
+"""
+Reconciling 10k accounts: one positions(addr) eth_call per account vs. the
+batch views read by off_chain_systems.reconciler, against the real contracts.
+
+    python -m benchmarks.bench_reconciler [--accounts 10000] [--chunks 100 500 1000] [--rpc-ms 1]
+
+The "node" is titanoboa behind a web3 provider: eth_call executes the call
+data on boa's EVM and every request pays --rpc-ms of round trip, roughly a
+local anvil. "evm s" is the time boa itself spends executing calls, which a
+real node does natively; "client s" is what is left once that and the round
+trips are taken out. Every account holds an open position. "per-account"
+reads positions(addr) only; the reconciler reads get_positions and
+get_equities for each chunk (no engine, so no limit orders) and diffs them
+against a PositionManager that already agrees with the chain. "max gas" is
+the costliest single eth_call, which has to stay under the node's call gas cap.
+"""
+import argparse
+import time
+
+from benchmarks import stubs
+
+stubs.patch_web3()
+
+import boa  # noqa: E402
+from eth_utils import to_checksum_address  # noqa: E402
+from vyper.compiler.output import build_abi_output  # noqa: E402
+from web3 import Web3  # noqa: E402
+from web3.providers.base import BaseProvider  # noqa: E402
+
+from off_chain_systems import reconciler  # noqa: E402
+from off_chain_systems.position_manager import PositionManager, Side  # noqa: E402
+
+PRICE_SCALE = 10**6
+
+
+class BoaNode(BaseProvider):
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+        self.requests = 0
+        self.max_gas = 0
+        self.evm_seconds = 0.0
+
+    def make_request(self, method, params):
+        self.requests += 1
+        time.sleep(self.latency)
+        if method == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(31337)}
+        if method == "eth_blockNumber":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(boa.env.evm.patch.block_number)}
+        if method == "eth_call":
+            self.calls += 1
+            start = time.perf_counter()
+            computation = boa.env.execute_code(
+                to_address=params[0]["to"], data=bytes.fromhex(params[0]["data"][2:]), is_modifying=False
+            )
+            self.evm_seconds += time.perf_counter() - start
+            if computation.is_error:
+                return {"jsonrpc": "2.0", "id": 1, "error": {"code": -32000, "message": repr(computation.error)}}
+            self.max_gas = max(self.max_gas, computation.get_gas_used())
+            return {"jsonrpc": "2.0", "id": 1, "result": "0x" + computation.output.hex()}
+        raise AssertionError(f"unexpected RPC {method}")
+
+
+def deploy(accounts: int):
+    owner = boa.env.generate_address()
+    with boa.env.prank(owner):
+        usdc = boa.load("src/mock_usdc.vy")
+        vault = boa.load("src/vault.vy", usdc.address, 0)
+        oracle = boa.load("src/oracle.vy", PRICE_SCALE // 2, owner, PRICE_SCALE // 2)
+        perps = boa.load("src/perps_contract.vy", vault.address, 0, "BENCH", owner, usdc.address, oracle.address, owner)
+    traders = []
+    for i in range(accounts):
+        trader = boa.env.generate_address()
+        with boa.env.prank(trader):
+            usdc.mint(trader, 100 * PRICE_SCALE)
+            usdc.approve(perps, 100 * PRICE_SCALE)
+            perps.open_position(100 * PRICE_SCALE, 2, i % 2 == 0, PRICE_SCALE // 2)
+        traders.append(to_checksum_address(trader))
+    return perps, traders
+
+
+def mirror(traders: list) -> PositionManager:
+    pm = PositionManager()
+    for i, trader in enumerate(traders):
+        pm.create_account(trader)
+        pm.create_position(trader, "BENCH", Side.BUY if i % 2 == 0 else Side.SELL, 0.5, 400, 2, 100).open_timestamp = 0
+    return pm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--rpc-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    boa.env.enable_fast_mode()
+    perps, traders = deploy(args.accounts)
+    print(f"{args.accounts:,} open positions deployed in {time.perf_counter() - start:.0f}s, {args.rpc_ms}ms per RPC")
+    abi = build_abi_output(perps.compiler_data)
+    reconciler.PERPS_ADDRESS, reconciler.PERPS_ABI = str(perps.address), abi
+    pm = mirror(traders)
+
+    print(f"{'mode':>12} {'chunk':>6} {'eth_calls':>10} {'requests':>9} {'seconds':>8} {'evm s':>7} "
+          f"{'client s':>9} {'max gas':>11} {'drift':>6}")
+
+    def row(mode, chunk, node, elapsed, drift):
+        client = elapsed - node.evm_seconds - node.requests * node.latency
+        print(f"{mode:>12} {chunk:>6} {node.calls:>10,} {node.requests:>9,} {elapsed:>8.2f} {node.evm_seconds:>7.2f} "
+              f"{client:>9.2f} {node.max_gas:>11,} {drift:>6}")
+
+    node = BoaNode(args.rpc_ms / 1000)
+    contract = Web3(node).eth.contract(address=perps.address, abi=abi)
+    start = time.perf_counter()
+    for trader in traders:
+        contract.functions.positions(trader).call()
+    row("per-account", "-", node, time.perf_counter() - start, "-")
+
+    for chunk in args.chunks:
+        node = BoaNode(args.rpc_ms / 1000)
+        start = time.perf_counter()
+        report = reconciler.Reconciler(Web3(node), pm, None, "BENCH", _chunk=chunk, _grace=0).run_cycle()
+        row("reconciler", chunk, node, time.perf_counter() - start, report.drift)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Cancel + add vs. in-place replace of a resting limit order.
+
+    python -m benchmarks.bench_replace_order
+
+Gas is measured under titanoboa against freshly deployed contracts, engine
+latency is measured with settlement stubbed out (see benchmarks.stubs).
+"""
+import time
+import statistics
+
+from benchmarks.stubs import build_engine
+from off_chain_systems.position_manager import Side
+
+SCALE = 10**6
+ROUNDS = 200
+# titanoboa meters execution gas only, every tx also pays the intrinsic cost
+TX_BASE_GAS = 21000
+
+
+def measure_gas(rounds: int = 20) -> dict:
+    import boa
+    from src import mock_usdc, oracle, perps_contract, vault
+
+    owner = boa.env.generate_address()
+    trader = boa.env.generate_address()
+
+    usdc = mock_usdc.deploy()
+    with boa.env.prank(owner):
+        vault_c = vault.deploy(usdc.address, 0)
+        oracle_c = oracle.deploy(SCALE // 2, owner, SCALE // 2)
+        perps = perps_contract.deploy(vault_c.address, 0, "bench", owner, usdc.address, oracle_c.address, owner)
+
+    cancel_add, replace = [], []
+    with boa.env.prank(trader):
+        usdc.mint(trader, 10**12)
+        usdc.approve(perps, 10**12)
+        perps.add_limit_order(2, 500 * SCALE, SCALE // 4, 4000, True)
+
+        for i in range(rounds):
+            margin = (500 + (i % 2) * 100) * SCALE
+
+            perps.close_limit_order()
+            gas = perps._computation.get_gas_used()
+            perps.add_limit_order(2, margin, SCALE // 4, 4000, True)
+            cancel_add.append(gas + perps._computation.get_gas_used() + 2 * TX_BASE_GAS)
+
+            perps.replace_limit_order(margin + 50 * SCALE, SCALE // 4 + 1000, 4400)
+            replace.append(perps._computation.get_gas_used() + TX_BASE_GAS)
+
+    return {
+        "cancel_add_gas": statistics.mean(cancel_add),
+        "replace_gas": statistics.mean(replace),
+    }
+
+
+def measure_latency(rounds: int = ROUNDS) -> dict:
+    engine, pm = build_engine()
+    engine.add_limit_order("0xQuoter", Side.BUY, 0.25, 10, 2)
+
+    cancel_add, replace = [], []
+    for i in range(rounds):
+        price = 0.25 + (i % 10) / 100
+
+        start = time.perf_counter_ns()
+        engine.remove_limit_order("0xQuoter")
+        engine.add_limit_order("0xQuoter", Side.BUY, price, 10, 2)
+        cancel_add.append(time.perf_counter_ns() - start)
+
+        start = time.perf_counter_ns()
+        engine.replace_limit_order("0xQuoter", price + 0.005, 12)
+        replace.append(time.perf_counter_ns() - start)
+
+    return {
+        "cancel_add_us": statistics.median(cancel_add) / 1000,
+        "replace_us": statistics.median(replace) / 1000,
+        # each engine call is one signed tx + one RPC round trip for the trader
+        "cancel_add_round_trips": 2,
+        "replace_round_trips": 1,
+    }
+
+
+def main():
+    latency = measure_latency()
+    print(f"engine cancel+add  median {latency['cancel_add_us']:.1f} us ({latency['cancel_add_round_trips']} txs)")
+    print(f"engine replace     median {latency['replace_us']:.1f} us ({latency['replace_round_trips']} tx)")
+
+    gas = measure_gas()
+    print(f"gas cancel+add     {gas['cancel_add_gas']:.0f}")
+    print(f"gas replace        {gas['replace_gas']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
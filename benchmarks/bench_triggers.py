@@ -0,0 +1,116 @@
+"""
+Stop / take-profit triggers with a large armed population: the TriggerIndex
+vs. scanning every armed position on each trade, then end-to-end latency of
+the closes a single trade sets off inside the engine.
+
+    python -m benchmarks.bench_triggers [--armed 100000] [--updates 20000]
+
+"update" is one trade price update that fires nothing, the common case: the
+index bisects its two lists, the scan compares every position's stop and
+take-profit. "cascade" arms --armed long positions (settlement stubbed, see
+benchmarks.stubs) with stops spread over 0.050-0.450, rests deep bids at 0.450
+and sells into them once. Every stop at 0.450 fires and closes at market in the
+same call; latency runs from the start of that sell to each close's fill.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.stubs import build_engine
+from off_chain_systems.position_manager import Side
+from off_chain_systems.triggers import TriggerIndex, TriggerKind
+
+
+def armed_book(count: int, rng: random.Random) -> list:
+    # long positions: stop below 0.45, take-profit above 0.55, prices on the 0.001 grid
+    return [
+        (f"0xTrader{i}", i, rng.randint(50, 450) / 1000, rng.randint(550, 950) / 1000)
+        for i in range(count)
+    ]
+
+
+def scan(positions: list, low: float, high: float) -> list:
+    return [trader for trader, _, stop, take_profit in positions if stop >= low or take_profit <= high]
+
+
+def update_latency(positions: list, updates: int, rng: random.Random) -> tuple[float, float, float]:
+    index = TriggerIndex()
+    start = time.perf_counter()
+    for trader, position_id, stop, take_profit in positions:
+        index.arm(trader, position_id, Side.BUY, TriggerKind.STOP, stop)
+        index.arm(trader, position_id, Side.BUY, TriggerKind.TAKE_PROFIT, take_profit)
+    arm = (time.perf_counter() - start) / (2 * len(positions))
+
+    # prices between every stop and every take-profit, so nothing fires
+    prices = [rng.randint(451, 549) / 1000 for _ in range(updates)]
+    start = time.perf_counter()
+    for price in prices:
+        index.fired(price, price)
+    indexed = (time.perf_counter() - start) / updates
+
+    sample = prices[:max(updates // 100, 10)]
+    start = time.perf_counter()
+    for price in sample:
+        scan(positions, price, price)
+    scanned = (time.perf_counter() - start) / len(sample)
+    return arm, indexed, scanned
+
+
+def cascade(positions: list) -> dict:
+    engine, pm = build_engine()
+    for trader, _, stop, take_profit in positions:
+        pm.create_account(trader)
+        pm.create_position(trader, engine.asset_name, Side.BUY, 0.5, 1.0, 2, 0.25)
+        engine.set_triggers(trader, stop, take_profit)
+    firing = sum(1 for _, _, stop, _ in positions if stop >= 0.45)
+
+    # enough bids at 0.45 that no close walks the price down into the next stops
+    for i in range(firing + 1):
+        pm.create_account(f"0xBid{i}")
+        engine.add_limit_order(f"0xBid{i}", Side.BUY, 0.45, 1.0, 2)
+    pm.create_account("0xSeller")
+
+    closed = []
+    engine.trade_listeners.append(lambda trade: closed.append(time.perf_counter()))
+    start = time.perf_counter()
+    engine.market_order("0xSeller", Side.SELL, 1.0, 2)
+    elapsed = time.perf_counter() - start
+
+    # the first fill is the seller's own trade
+    latencies = [(t - start) * 1e6 for t in closed[1:]]
+    return {
+        "fired": len(latencies),
+        "expected": firing,
+        "total_ms": elapsed * 1000,
+        "per_close_us": elapsed * 1e6 / max(len(latencies), 1),
+        "p50_us": statistics.median(latencies) if latencies else 0.0,
+        "max_us": max(latencies, default=0.0),
+        "armed_left": len(engine.triggers),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--armed", type=int, default=100000)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    positions = armed_book(args.armed, rng)
+
+    arm, indexed, scanned = update_latency(positions, args.updates, rng)
+    print(f"{args.armed:,} positions, stop + take-profit each ({2 * args.armed:,} triggers)")
+    print(f"  arm            {arm * 1e6:>9.2f} us per trigger")
+    print(f"  update, index  {indexed * 1e6:>9.2f} us")
+    print(f"  update, scan   {scanned * 1e6:>9.2f} us  ({scanned / indexed:,.0f}x)")
+
+    r = cascade(positions)
+    print(f"cascade: one sell at 0.450 fired {r['fired']:,} of {r['expected']:,} stops, "
+          f"{r['armed_left']:,} triggers left armed")
+    print(f"  total {r['total_ms']:.1f} ms, {r['per_close_us']:.1f} us per close, "
+          f"trade-to-close p50 {r['p50_us'] / 1000:.2f} ms, max {r['max_us'] / 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
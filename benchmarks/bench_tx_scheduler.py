@@ -0,0 +1,100 @@
+"""
+Liquidation submit latency under a heavy fill load: the TxScheduler's
+priority classes vs. the same single sender in arrival order.
+
+    python -m benchmarks.bench_tx_scheduler [--backlog 0 10 100 500] [--send-ms 1.0]
+
+A fake node takes --send-ms per eth_sendRawTransaction; signing is real. A
+producer thread keeps --backlog fills waiting for a nonce, like a sweep
+through a deep book settling maker by maker. A liquidation is submitted every
+--every seconds for --seconds, and its latency runs from submit to the node
+accepting it. "fifo" submits the liquidations at fill priority, so they queue
+behind every fill already waiting, as when each caller sent for itself.
+"""
+import argparse
+import statistics
+import threading
+import time
+from types import SimpleNamespace
+
+from eth_account import Account
+
+from benchmarks import stubs  # noqa: F401, sets the env the engine modules read
+from off_chain_systems.tx_scheduler import TxScheduler, TxPriority
+
+KEY = "0x" + "11" * 32
+
+
+class FakeNode:
+    def __init__(self, send_seconds: float):
+        self.send_seconds = send_seconds
+        self.sent = 0
+
+    def get_transaction_count(self, _address, _block):
+        return 0
+
+    def send_raw_transaction(self, _raw):
+        time.sleep(self.send_seconds)
+        self.sent += 1
+        return f"0x{self.sent:064x}"
+
+
+def tx() -> dict:
+    return {"to": "0x00000000000000000000000000000000000000b2", "data": "0x", "value": 0,
+            "gas": 300000, "gasPrice": 10**9, "chainId": 31337}
+
+
+def run(args, backlog: int, liquidation_priority: TxPriority) -> tuple[list, int]:
+    node = FakeNode(args.send_ms / 1000)
+    scheduler = TxScheduler(SimpleNamespace(eth=node), KEY)
+    stop = threading.Event()
+
+    def fills():
+        while not stop.is_set():
+            if len(scheduler) < backlog:
+                scheduler.submit(TxPriority.FILL, tx())
+            else:
+                time.sleep(0.0002)
+
+    producer = threading.Thread(target=fills)
+    producer.start()
+    time.sleep(0.2)
+    latencies = []
+    deadline = time.perf_counter() + args.seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        scheduler.submit(liquidation_priority, tx()).result()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(args.every)
+    stop.set()
+    producer.join()
+    return latencies, node.sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backlog", type=int, nargs="+", default=[0, 10, 100, 500])
+    parser.add_argument("--send-ms", type=float, default=1.0)
+    parser.add_argument("--every", type=float, default=0.05)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    account = Account.from_key(KEY)
+    start = time.perf_counter()
+    for nonce in range(20):
+        account.sign_transaction({**tx(), "nonce": nonce})
+    sign_ms = (time.perf_counter() - start) / 20 * 1000
+    print(f"{sign_ms:.2f} ms signing + {args.send_ms:g} ms sending per transaction, "
+          f"a liquidation every {args.every * 1000:g} ms, submit latency in ms")
+    print(f"{'backlog':>8} {'order':>9} {'p50':>8} {'p99':>8} {'max':>8} {'liqs':>5} {'sent/s':>7}")
+    for backlog in args.backlog:
+        for label, priority in (("fifo", TxPriority.FILL), ("priority", TxPriority.LIQUIDATION)):
+            latencies, sent = run(args, backlog, priority)
+            ordered = sorted(latencies)
+            p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+            print(f"{backlog:>8,} {label:>9} {statistics.median(latencies) * 1000:>8.2f} {p99 * 1000:>8.2f} "
+                  f"{max(latencies) * 1000:>8.2f} {len(latencies):>5} {sent / (args.seconds + 0.2):>7,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Side-by-side diff of two saved bench_flow results.
+
+    python -m benchmarks.compare benchmarks/results/steady-abc1234.json benchmarks/results/steady-def5678.json
+"""
+import argparse
+import json
+from pathlib import Path
+
+# (label, path into the result, higher is better)
+ROWS = (
+    ("orders/s", ("results", "orders_per_sec"), True),
+    ("p50 us", ("results", "latency", "p50_us"), False),
+    ("p99 us", ("results", "latency", "p99_us"), False),
+    ("p999 us", ("results", "latency", "p999_us"), False),
+    ("max us", ("results", "latency", "max_us"), False),
+    ("B/event", ("memory", "bytes_per_event"), False),
+    ("peak KiB", ("memory", "peak_bytes"), False),
+)
+KIND_ROWS = ("p50_us", "p99_us", "p999_us")
+
+
+def lookup(result: dict, path: tuple):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def row(label: str, old, new, higher_is_better: bool) -> str:
+    if old is None or new is None:
+        return f"{label:<18} {'-':>12} {'-':>12}"
+    change = (new - old) / old * 100 if old else 0.0
+    better = change > 0 if higher_is_better else change < 0
+    marker = "" if abs(change) < 5 else (" better" if better else " worse")
+    return f"{label:<18} {old:>12,.1f} {new:>12,.1f} {change:>+8.1f}%{marker}"
+
+
+def compare(old: dict, new: dict) -> list:
+    lines = [f"{'':<18} {old['commit']:>12} {new['commit']:>12}"]
+    if old["config"] != new["config"]:
+        changed = sorted(k for k in old["config"] if old["config"][k] != new["config"].get(k))
+        lines.append(f"warning: flow configs differ ({', '.join(changed)})")
+    for label, path, higher in ROWS:
+        old_value, new_value = lookup(old, path), lookup(new, path)
+        if label == "peak KiB":
+            old_value = old_value / 1024 if old_value is not None else None
+            new_value = new_value / 1024 if new_value is not None else None
+        lines.append(row(label, old_value, new_value, higher))
+    for kind in new["results"]["by_kind"]:
+        for key in KIND_ROWS:
+            path = ("results", "by_kind", kind, key)
+            lines.append(row(f"{kind} {key.replace('_us', '')} us", lookup(old, path), lookup(new, path), False))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    args = parser.parse_args()
+
+    old = json.loads(args.old.read_text())
+    new = json.loads(args.new.read_text())
+    print("\n".join(compare(old, new)))
+
+
+if __name__ == "__main__":
+    main()
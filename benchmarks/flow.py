@@ -0,0 +1,136 @@
+"""
+Synthetic order flow for driving OrderBook in benchmarks.
+
+A flow is a deterministic (seeded) stream of FlowEvents: Poisson arrivals,
+a limit / market / cancel / replace mix, and limit prices drawn around a
+mid from a configurable level distribution. The contract allows a single
+resting order per address and rejects new limits from addresses that
+hold a position, so every limit comes from a fresh maker address and
+every market order from a fresh taker address.
+"""
+import random
+from math import log
+from dataclasses import dataclass, asdict
+from typing import Iterator
+
+LIMIT = "limit"
+MARKET = "market"
+CANCEL = "cancel"
+REPLACE = "replace"
+
+
+@dataclass
+class FlowConfig:
+    orders: int = 10_000
+    seed: int = 1
+    # mean arrivals per second of simulated time (Poisson process)
+    arrival_rate: float = 2_000.0
+    # event mix, normalised at generation time
+    limit_weight: float = 0.6
+    market_weight: float = 0.1
+    cancel_weight: float = 0.25
+    replace_weight: float = 0.05
+    mid_price: float = 0.5
+    tick_size: float = 0.001
+    # levels on each side of the mid that limit prices may land on
+    depth_ticks: int = 100
+    # "geometric" piles liquidity up near the touch, "uniform" spreads it over depth_ticks
+    price_distribution: str = "geometric"
+    # mean level offset for the geometric distribution, in ticks
+    mean_offset_ticks: float = 5.0
+    max_quantity: int = 10
+    max_leverage: int = 5
+    # cancels and replaces target one of the last N makers still believed to be resting
+    cancel_window: int = 1_000
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class FlowEvent:
+    arrival: float
+    kind: str
+    trader: str
+    side: str
+    price: float
+    quantity: int
+    leverage: int
+
+
+class FlowGenerator:
+    def __init__(self, _config: FlowConfig):
+        self.config = _config
+        self.rng = random.Random(_config.seed)
+        self.resting: list = []
+        self.makers = 0
+        self.takers = 0
+        self.clock = 0.0
+
+    def _limit_price(self, _side: str) -> float:
+        config = self.config
+        if config.price_distribution == "geometric":
+            # inverse-CDF sample of a geometric distribution, capped at the book depth
+            p = 1.0 / max(config.mean_offset_ticks, 1.0)
+            offset = 1 if p >= 1 else int(log(1.0 - self.rng.random()) / log(1.0 - p)) + 1
+            offset = min(offset, config.depth_ticks)
+        elif config.price_distribution == "uniform":
+            offset = self.rng.randint(1, config.depth_ticks)
+        else:
+            raise ValueError(f"Unknown price distribution: {config.price_distribution}")
+
+        ticks = round(config.mid_price / config.tick_size)
+        ticks = ticks - offset if _side == "buy" else ticks + offset
+        ticks = min(max(ticks, 1), round(1 / config.tick_size) - 1)
+        return round(ticks * config.tick_size, 6)
+
+    def _pick_kind(self) -> str:
+        config = self.config
+        kind = self.rng.choices(
+            (LIMIT, MARKET, CANCEL, REPLACE),
+            weights=(config.limit_weight, config.market_weight, config.cancel_weight, config.replace_weight)
+        )[0]
+        if kind in (CANCEL, REPLACE) and not self.resting:
+            return LIMIT
+        return kind
+
+    def _take_resting(self, _remove: bool) -> tuple:
+        count = len(self.resting)
+        index = self.rng.randrange(max(count - self.config.cancel_window, 0), count)
+        if _remove:
+            # swap-remove keeps this O(1)
+            self.resting[index], self.resting[-1] = self.resting[-1], self.resting[index]
+            return self.resting.pop()
+        return self.resting[index]
+
+    def next_event(self) -> FlowEvent:
+        config = self.config
+        self.clock += self.rng.expovariate(config.arrival_rate)
+        kind = self._pick_kind()
+        side = "buy" if self.rng.random() < 0.5 else "sell"
+        quantity = self.rng.randint(1, config.max_quantity)
+        leverage = self.rng.randint(1, config.max_leverage)
+
+        if kind == LIMIT:
+            self.makers += 1
+            trader = f"0xMaker{self.makers}"
+            price = self._limit_price(side)
+            self.resting.append((trader, side))
+            return FlowEvent(self.clock, kind, trader, side, price, quantity, leverage)
+
+        if kind == MARKET:
+            self.takers += 1
+            return FlowEvent(self.clock, kind, f"0xTaker{self.takers}", side, 0.0, quantity, leverage)
+
+        trader, side = self._take_resting(kind == CANCEL)
+        price = self._limit_price(side) if kind == REPLACE else 0.0
+        return FlowEvent(self.clock, kind, trader, side, price, quantity, leverage)
+
+    def __iter__(self) -> Iterator[FlowEvent]:
+        for _ in range(self.config.orders):
+            yield self.next_event()
+
+
+def generate(_config: FlowConfig) -> list:
+    """Materialises the whole flow up front so generation cost stays out of the timings."""
+    return list(FlowGenerator(_config))
@@ -0,0 +1,229 @@
+"""
+Replays a synthetic flow (benchmarks.flow) through OrderBook + PositionManager
+with settlement stubbed, and collects throughput, latency percentiles and
+memory growth into a JSON-serialisable result.
+"""
+import contextlib
+import io
+import json
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.flow import FlowConfig, generate, LIMIT, MARKET, CANCEL, REPLACE
+from benchmarks.stubs import build_engine
+from off_chain_systems import log as tachyon_log
+from off_chain_systems.position_manager import Side, Status
+
+RESULTS_DIR = Path(__file__).parent / "results"
+KINDS = (LIMIT, MARKET, CANCEL, REPLACE)
+SPIN_NS = 200_000
+
+
+def percentile(_sorted: list, _q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not _sorted:
+        return 0.0
+    rank = max(math.ceil(_q / 100 * len(_sorted)), 1)
+    return _sorted[min(rank, len(_sorted)) - 1]
+
+
+def latency_summary(_latencies_ns: list) -> dict:
+    ordered = sorted(_latencies_ns)
+    return {
+        "count": len(ordered),
+        "mean_us": sum(ordered) / len(ordered) / 1e3 if ordered else 0.0,
+        "p50_us": percentile(ordered, 50) / 1e3,
+        "p99_us": percentile(ordered, 99) / 1e3,
+        "p999_us": percentile(ordered, 99.9) / 1e3,
+        "max_us": ordered[-1] / 1e3 if ordered else 0.0,
+    }
+
+
+@contextlib.contextmanager
+def muted_logs():
+    """
+    Engine logging off for a measured run. The log writer holds the stdout it
+    was configured with, so redirecting stdout would not silence it, and its
+    formatting and writes would still land in the measurement.
+    """
+    tachyon_log.configure("CRITICAL", _stream=io.StringIO())
+    try:
+        yield
+    finally:
+        tachyon_log.configure()
+
+
+def _dispatch(engine, event):
+    side = Side.BUY if event.side == "buy" else Side.SELL
+    if event.kind == LIMIT:
+        engine.add_limit_order(event.trader, side, event.price, event.quantity, event.leverage)
+    elif event.kind == MARKET:
+        engine.market_order(event.trader, side, event.quantity, event.leverage)
+    elif event.kind == CANCEL:
+        engine.remove_limit_order(event.trader)
+    else:
+        engine.replace_limit_order(event.trader, event.price, event.quantity)
+
+
+def _prepare(config: FlowConfig) -> tuple:
+    events = generate(config)
+    engine, pm = build_engine(oracle_price=config.mid_price)
+    for event in events:
+        if event.kind in (LIMIT, MARKET):
+            pm.create_account(event.trader)
+    return events, engine, pm
+
+
+def replay(config: FlowConfig, pace: bool = False, quiet: bool = True) -> dict:
+    """
+    Runs the flow once and returns throughput and latency per event kind.
+    With pace=True arrivals follow the generated Poisson schedule and latency is
+    measured from the scheduled arrival, so queueing behind a slow event counts.
+    quiet=False keeps whatever logging the caller configured.
+    """
+    latencies = {kind: [] for kind in KINDS}
+    rejected = {kind: 0 for kind in KINDS}
+
+    with muted_logs() if quiet else contextlib.nullcontext():
+        events, engine, pm = _prepare(config)
+
+        start = time.perf_counter_ns()
+        for event in events:
+            if pace:
+                scheduled = start + int(event.arrival * 1e9)
+                delay = scheduled - time.perf_counter_ns()
+                # sleep() overshoots by tens of microseconds, spin out the last stretch
+                if delay > SPIN_NS:
+                    time.sleep((delay - SPIN_NS) / 1e9)
+                while time.perf_counter_ns() < scheduled:
+                    pass
+                t0 = scheduled
+            else:
+                t0 = time.perf_counter_ns()
+            try:
+                _dispatch(engine, event)
+            except ValueError:
+                rejected[event.kind] += 1
+            latencies[event.kind].append(time.perf_counter_ns() - t0)
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+
+    everything = [ns for kind in KINDS for ns in latencies[kind]]
+    return {
+        "events": len(events),
+        "elapsed_s": elapsed,
+        "orders_per_sec": len(events) / elapsed,
+        "simulated_s": events[-1].arrival if events else 0.0,
+        "latency": latency_summary(everything),
+        "by_kind": {
+            kind: {**latency_summary(latencies[kind]), "rejected": rejected[kind]}
+            for kind in KINDS
+        },
+        "book": book_state(engine, pm),
+    }
+
+
+def book_state(engine, pm) -> dict:
+    return {
+        "bid_levels": len(engine.bids),
+        "ask_levels": len(engine.asks),
+        "resting_orders": sum(len(orders) for book in (engine.bids, engine.asks) for orders in book.values()),
+        "trades": len(engine.trade_events),
+        "accounts": len(pm.accounts),
+        "open_positions": sum(
+            1 for account in pm.accounts.values() for position in account.positions if position.status == Status.OPEN
+        ),
+    }
+
+
+def measure_memory(config: FlowConfig, samples: int = 10) -> dict:
+    """
+    Separate pass under tracemalloc (it slows execution several-fold, so it never
+    shares a run with the latency numbers). Accounts are created up front, so the
+    growth is what the engine itself retains: book, trade log, positions.
+    """
+    with muted_logs():
+        events, engine, pm = _prepare(config)
+        step = max(len(events) // samples, 1)
+
+        tracemalloc.start()
+        base, _ = tracemalloc.get_traced_memory()
+        curve = []
+        for index, event in enumerate(events, start=1):
+            try:
+                _dispatch(engine, event)
+            except ValueError:
+                pass
+            if index % step == 0:
+                current, _ = tracemalloc.get_traced_memory()
+                curve.append([index, current - base])
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    growth = current - base
+    return {
+        "growth_bytes": growth,
+        "peak_bytes": peak - base,
+        "bytes_per_event": growth / len(events) if events else 0.0,
+        "curve": curve,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(name: str, config: FlowConfig, pace: bool = False, memory: bool = True) -> dict:
+    result = {
+        "name": name,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "paced": pace,
+        "config": config.to_dict(),
+        "results": replay(config, pace),
+    }
+    if memory:
+        result["memory"] = measure_memory(config)
+    return result
+
+
+def save(result: dict, path: Path = None) -> Path:
+    if path is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{result['name']}-{result['commit']}.json"
+    path.write_text(json.dumps(result, indent=2) + "\n")
+    return path
+
+
+def summary_lines(result: dict) -> list:
+    results = result["results"]
+    latency = results["latency"]
+    lines = [
+        f"{result['name']} @ {result['commit']}: {results['events']} events, "
+        f"{results['orders_per_sec']:,.0f} orders/s",
+        f"  all      p50 {latency['p50_us']:8.1f} us  p99 {latency['p99_us']:8.1f} us  p999 {latency['p999_us']:8.1f} us",
+    ]
+    for kind, stats in results["by_kind"].items():
+        lines.append(
+            f"  {kind:<8} p50 {stats['p50_us']:8.1f} us  p99 {stats['p99_us']:8.1f} us  p999 {stats['p999_us']:8.1f} us"
+            f"  n={stats['count']} rejected={stats['rejected']}"
+        )
+    if "memory" in result:
+        memory = result["memory"]
+        lines.append(
+            f"  memory   +{memory['growth_bytes'] / 1024:,.0f} KiB retained, "
+            f"{memory['bytes_per_event']:.0f} B/event, peak +{memory['peak_bytes'] / 1024:,.0f} KiB"
+        )
+    return lines
@@ -0,0 +1,176 @@
+"""
+Offline stand-ins so the off-chain engine can be benchmarked without a node.
+Settlement calls become no-ops, matching and position bookkeeping stay real.
+"""
+import os
+import threading
+from collections import Counter
+from types import SimpleNamespace
+
+from eth_utils import keccak
+from web3.providers.base import BaseProvider
+
+# the engine modules read these at import time
+os.environ.setdefault("PRIVATE_KEY", "0x" + "11" * 32)
+os.environ.setdefault("RPC_URL", "http://127.0.0.1:8545")
+os.environ.setdefault("PERPS_ADDRESS", "0x0000000000000000000000000000000000000000")
+os.environ.setdefault("PERPS_ABI", "[]")
+os.environ.setdefault("ORACLE_ADDRESS", "0x0000000000000000000000000000000000000001")
+os.environ.setdefault("ORACLE_ABI", "[]")
+
+
+class FakeEth:
+    def __init__(self):
+        self.account = SimpleNamespace(from_key=lambda key: SimpleNamespace(address="0xBENCH"))
+        self.default_account = None
+
+    def get_transaction_count(self, addr):
+        return 0
+
+
+class FakeWeb3:
+    class HTTPProvider:
+        def __init__(self, url):
+            self.url = url
+
+    def __init__(self, provider=None):
+        self.provider = provider
+        self.eth = FakeEth()
+
+    def is_connected(self):
+        return True
+
+    def to_wei(self, amount, unit):
+        return int(amount * 1e9)
+
+
+class BlockNode(BaseProvider):
+    """
+    Just enough of a node behind a real Web3 to send transactions and wait for
+    their receipts. A block every block_seconds holds every transaction sent
+    since the last one; block_seconds=0 mines each one as it arrives, like an
+    auto-mining dev node. calls counts the RPC calls answered, by method.
+    """
+    def __init__(self, block_seconds: float, chain_id: int = 31337):
+        super().__init__()
+        self.block_seconds = block_seconds
+        self.chain_id = chain_id
+        self.calls = Counter()
+        self.head = 0
+        self.sent = 0
+        self.mempool = []
+        # tx hash -> receipt, block number -> receipts
+        self.receipts = {}
+        self.blocks = {0: []}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self.block_seconds > 0:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run(self):
+        while not self._stop.wait(self.block_seconds):
+            with self._lock:
+                self.mine()
+
+    def send(self, tx_hash: str):
+        with self._lock:
+            self.mempool.append(tx_hash)
+            self.sent += 1
+            if self.block_seconds <= 0:
+                self.mine()
+
+    def mine(self):
+        self.head += 1
+        receipts = [self.receipt(tx_hash, i) for i, tx_hash in enumerate(self.mempool)]
+        self.mempool = []
+        self.blocks[self.head] = receipts
+        self.receipts.update((receipt["transactionHash"], receipt) for receipt in receipts)
+
+    def receipt(self, tx_hash: str, index: int) -> dict:
+        return {
+            "transactionHash": tx_hash, "transactionIndex": hex(index),
+            "blockHash": f"0x{self.head:064x}", "blockNumber": hex(self.head),
+            "from": "0x" + "11" * 20, "to": "0x" + "22" * 20, "contractAddress": None,
+            "status": "0x1", "gasUsed": hex(50000), "cumulativeGasUsed": hex(50000 * (index + 1)),
+            "effectiveGasPrice": hex(10**9), "logs": [], "logsBloom": "0x" + "00" * 256, "type": "0x0",
+        }
+
+    def make_request(self, method, params):
+        self.calls[method] += 1
+        if method == "eth_sendRawTransaction":
+            tx_hash = "0x" + keccak(hexstr=params[0]).hex()
+            self.send(tx_hash)
+            return {"jsonrpc": "2.0", "id": 1, "result": tx_hash}
+        with self._lock:
+            if method == "eth_chainId":
+                result = hex(self.chain_id)
+            elif method == "eth_getTransactionCount":
+                result = hex(self.sent)
+            elif method == "eth_blockNumber":
+                result = hex(self.head)
+            elif method == "eth_getBlockReceipts":
+                result = self.blocks.get(int(params[0], 16))
+            elif method == "eth_getTransactionReceipt":
+                result = self.receipts.get(params[0])
+            else:
+                raise AssertionError(f"unexpected RPC {method}")
+        return {"jsonrpc": "2.0", "id": 1, "result": result}
+
+
+SETTLEMENT_METHODS = (
+    "send_limit_order",
+    "send_limit_order_removal",
+    "send_limit_order_replacement",
+    "call_fill_limit_order",
+    "send_limit_order_expiry",
+    "send_open_position",
+    "send_close_position",
+)
+
+
+def _noop(*args, **kwargs):
+    return None
+
+
+def patch_web3():
+    """Points the engine modules at FakeWeb3 so nothing dials out on construction."""
+    from off_chain_systems import matching_engine, position_manager
+
+    matching_engine.Web3 = FakeWeb3
+    position_manager.Web3 = FakeWeb3
+
+
+def import_server():
+    """Imports the FastAPI app module, which builds its engine at import time."""
+    patch_web3()
+    from off_chain_systems import server
+    return server
+
+
+def build_engine(market: str = "BENCH", oracle_price: float = 0.5):
+    """Returns an (OrderBook, PositionManager) pair with settlement stubbed out."""
+    from off_chain_systems import matching_engine, position_manager
+
+    patch_web3()
+
+    pm = position_manager.PositionManager()
+    engine = matching_engine.OrderBook(market, pm)
+    pm.orderbook = engine
+    pm.get_oracle_price = lambda: oracle_price
+    pm.liquidate_position = lambda _address, _submit=None: True
+
+    for name in SETTLEMENT_METHODS:
+        if hasattr(engine, name):
+            setattr(engine, name, _noop)
+
+    return engine, pm
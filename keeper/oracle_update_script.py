@@ -1,26 +1,162 @@
 import os
-import requests
 import ast
+import re
 import time
 import json
+import asyncio
+from dataclasses import dataclass
 
-from web3 import Web3
+import httpx
+from web3 import AsyncWeb3
+from eth_account import Account
 from dotenv import load_dotenv
+from off_chain_systems.log import get_logger
 
 load_dotenv()
 
 PRIVATE_KEY = os.environ.get('PRIVATE_KEY')
 RPC_URL = os.environ.get('RPC_URL')
 ORACLE_ADDRESS = os.environ.get('ORACLE_ADDRESS')
-ORACLE_ABI = json.loads(os.environ.get('ORACLE_ABI'))
-POLYMARKET_BASE_API = 'https://gamma-api.polymarket.com/events/slug/'
+# JSON text, parsed when a keeper starts so importing this module needs no env
+ORACLE_ABI = os.environ.get('ORACLE_ABI')
+POLYMARKET_BASE_API = os.environ.get('POLYMARKET_BASE_API', 'https://gamma-api.polymarket.com/events/slug/')
+POLYMARKET_CLOB_API = os.environ.get('POLYMARKET_CLOB_API', 'https://clob.polymarket.com')
 URL_SUFFIX = os.environ.get('URL_SUFFIX')
+# JSON list of {"slug": ..., "oracle_address": ..., "market_id": ...}, defaults to the single
+# URL_SUFFIX / ORACLE_ADDRESS market 0
+ORACLE_MARKETS = os.environ.get('ORACLE_MARKETS')
+POLL_INTERVAL = float(os.environ.get('ORACLE_POLL_INTERVAL', 10))
+HTTP_TIMEOUT = float(os.environ.get('ORACLE_HTTP_TIMEOUT', 5))
+MAX_CONNECTIONS = int(os.environ.get('ORACLE_MAX_CONNECTIONS', 20))
+MIDPOINT_BATCH_SIZE = int(os.environ.get('ORACLE_MIDPOINT_BATCH', 100))
+TOKEN_CACHE_PATH = os.environ.get('ORACLE_TOKEN_CACHE', '.cache/polymarket_tokens.json')
+TOKEN_CACHE_TTL = float(os.environ.get('ORACLE_TOKEN_CACHE_TTL', 24 * 3600))
+# push when the midpoint moves more than this from the on-chain value...
+DEVIATION_BPS = float(os.environ.get('ORACLE_DEVIATION_BPS', 50))
+# ...or when the on-chain value is this old, whichever comes first
+HEARTBEAT = float(os.environ.get('ORACLE_HEARTBEAT', 1800))
 PRICE_SCALE = 10**6
+# update_prices gas limit: a base plus a market's worst case (its first write), see benchmarks/bench_oracle_gas
+ORACLE_GAS = 60000
+ORACLE_GAS_PER_MARKET = 50000
+MAX_BATCH = 256  # oracle.vy MAX_BATCH
+UPDATE_ORACLE = 1  # oracle.vy PriceField.ORACLE
+STALE_TIME = 3600  # oracle.vy STALE_TIME, get_oracle_price reverts past it
 
-def get_yes_token_id() -> str:
-    url = f"{POLYMARKET_BASE_API}{URL_SUFFIX}"
+log = get_logger("oracle_keeper")
 
-    r = requests.get(url)
+@dataclass
+class Market:
+    slug: str
+    oracle_address: str
+    market_id: int = 0
+    token_id: str | None = None
+    # local copy of the on-chain oracle_price / last_update_time
+    last_price: int | None = None
+    last_update: float | None = None
+    resolved: bool = False
+
+@dataclass
+class UpdatePolicy:
+    """
+    Decides whether a fresh midpoint is worth a transaction: only when it deviates
+    from the on-chain value by more than deviation_bps, or when the on-chain value
+    is heartbeat seconds old. The heartbeat keeps get_oracle_price (and
+    get_perp_price, which shares last_update_time) from going stale on a quiet market.
+    """
+    deviation_bps: float
+    heartbeat: float
+
+    def __post_init__(self):
+        if self.deviation_bps < 0:
+            raise ValueError("deviation_bps must be >= 0")
+        if not 0 <= self.heartbeat < STALE_TIME:
+            raise ValueError(f"heartbeat must be in [0, {STALE_TIME}) seconds, the oracle's STALE_TIME")
+
+    def reason(self, _market: Market, _price: int, _now: float) -> str | None:
+        """Why _price should be pushed ("initial", "heartbeat", "deviation"), None to skip it."""
+        if _market.last_price is None or _market.last_update is None:
+            return "initial"
+        if _now - _market.last_update >= self.heartbeat:
+            return "heartbeat"
+        if abs(_price - _market.last_price) * 10_000 > self.deviation_bps * _market.last_price:
+            return "deviation"
+        return None
+
+@dataclass
+class KeeperStats:
+    sent: int = 0
+    # updates the policy decided weren't worth a transaction
+    skipped: int = 0
+    # oldest on-chain value seen when a cycle ran, in seconds
+    max_staleness: float = 0.0
+
+def load_markets() -> list:
+    if ORACLE_MARKETS:
+        return [
+            Market(entry["slug"], entry["oracle_address"], entry.get("market_id", 0))
+            for entry in json.loads(ORACLE_MARKETS)
+        ]
+    return [Market(URL_SUFFIX, ORACLE_ADDRESS)]
+
+def parse_midpoint(_mid_raw) -> int:
+    if _mid_raw is None:
+        raise ValueError("No 'mid' key found in Polymarket response")
+
+    # Convert safely: handle strings like '0.235'
+    try:
+        mid = float(_mid_raw)
+    except ValueError:
+        match = re.search(r"\d*\.\d+", str(_mid_raw))
+        if not match:
+            raise ValueError(f"Could not parse midpoint value from {_mid_raw}")
+        mid = float(match.group(0))
+
+    return int(mid * PRICE_SCALE)
+
+class TokenCache:
+    """
+    Slug -> YES token id, persisted as JSON so restarts don't re-resolve every
+    market against the gamma API. Entries older than the TTL are treated as missing.
+    """
+    def __init__(self, _path: str, _ttl: float):
+        self.path = _path
+        self.ttl = _ttl
+        self.entries: dict = {}
+        try:
+            with open(_path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, _slug: str) -> str | None:
+        entry = self.entries.get(_slug)
+        if entry is None or time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        return entry["token_id"]
+
+    def put(self, _slug: str, _token_id: str):
+        self.entries[_slug] = {"token_id": _token_id, "fetched_at": time.time()}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+def make_http_client(**kwargs) -> httpx.AsyncClient:
+    """One pooled keep-alive client for every gamma / CLOB request the keeper makes."""
+    return httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT,
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        **kwargs
+    )
+
+async def get_yes_token_id(client: httpx.AsyncClient, _slug: str) -> str:
+    r = await client.get(f"{POLYMARKET_BASE_API}{_slug}")
 
     if r.status_code != 200:
         raise ConnectionError("Could not connect to provided url")
@@ -33,72 +169,250 @@ def get_yes_token_id() -> str:
 
     return yes_token[0]
 
-def get_yes_token_price(_token_id: str) -> int:
-    url = "https://clob.polymarket.com/midpoint"
-    query = {"token_id": _token_id}
-    r = requests.get(url, params=query)
+async def get_yes_token_price(client: httpx.AsyncClient, _token_id: str) -> int:
+    r = await client.get(f"{POLYMARKET_CLOB_API}/midpoint", params={"token_id": _token_id})
+    r.raise_for_status()
 
     response = r.json()
-    print("DEBUG midpoint response:", response)
+    log.debug("Midpoint response %s", response, token_id=_token_id)
 
-    mid_raw = response.get("mid")
-    if mid_raw is None:
-        raise ValueError("No 'mid' key found in Polymarket response")
+    price = parse_midpoint(response.get("mid"))
+    log.debug("Parsed midpoint", token_id=_token_id, oracle_price=price)
+    return price
 
-    # Convert safely: handle strings like '0.235'
-    try:
-        mid = float(mid_raw)
-    except ValueError:
-        import re
-        match = re.search(r"\d*\.\d+", str(mid_raw))
-        if not match:
-            raise ValueError(f"Could not parse midpoint value from {mid_raw}")
-        mid = float(match.group(0))
+async def get_midpoints(client: httpx.AsyncClient, _token_ids: list) -> dict:
+    """One CLOB round trip for many tokens, returns token_id -> raw midpoint."""
+    r = await client.post(f"{POLYMARKET_CLOB_API}/midpoints", json=[{"token_id": token_id} for token_id in _token_ids])
+    r.raise_for_status()
 
-    price = int(mid * PRICE_SCALE)
-    print(f"Parsed midpoint: {mid} → scaled oracle price: {price}")
-    return price
+    response = r.json()
+    log.debug("Midpoints response for %s tokens", len(_token_ids))
+    return response
+
+class OracleKeeper:
+    """
+    Polls midpoints for every configured market in batched CLOB requests over one
+    pooled HTTP client and pushes the prices to each market's oracle. Slug lookups
+    are cached on disk; chain_id, the signer and contract objects are resolved once;
+    nonces are assigned locally so a cycle's updates are sent concurrently without
+    waiting on receipts.
+    """
+    def __init__(
+            self,
+            w3: AsyncWeb3,
+            client: httpx.AsyncClient,
+            _markets: list,
+            _private_key: str = PRIVATE_KEY,
+            _token_cache: TokenCache | None = None,
+            _policy: UpdatePolicy | None = None
+    ):
+        self.w3 = w3
+        self.client = client
+        self.markets: list = _markets
+        self.token_cache = _token_cache if _token_cache is not None else TokenCache(TOKEN_CACHE_PATH, TOKEN_CACHE_TTL)
+        self.policy = _policy if _policy is not None else UpdatePolicy(DEVIATION_BPS, HEARTBEAT)
+        self.stats = KeeperStats()
+        self.account = Account.from_key(_private_key)
+        self.contracts: dict = {}
+        self.chain_id: int | None = None
+        self.nonce: int | None = None
+
+    async def setup(self):
+        self.chain_id = await self.w3.eth.chain_id
+        await self.sync_nonce()
+        abi = json.loads(ORACLE_ABI)
+        for market in self.markets:
+            address = AsyncWeb3.to_checksum_address(market.oracle_address)
+            self.contracts[market.oracle_address] = self.w3.eth.contract(address=address, abi=abi)
+        await asyncio.gather(self.resolve_tokens(), self.load_onchain_prices())
+
+    async def sync_nonce(self):
+        self.nonce = await self.w3.eth.get_transaction_count(self.account.address, "pending")
+
+    async def load_onchain_prices(self):
+        """Seeds each market's cached on-chain value; a failed read just means the first price is pushed."""
+        async def load(_market: Market):
+            contract = self.contracts[_market.oracle_address]
+            try:
+                price, _perp_price, updated, _perp_updated = await contract.functions.markets(_market.market_id).call()
+            except Exception as e:
+                log.warning("Could not read on-chain price for %s: %s", _market.slug, e, market=_market.slug)
+                return
+            if updated:
+                _market.last_price, _market.last_update = price, float(updated)
+
+        await asyncio.gather(*(load(market) for market in self.markets))
+
+    async def resolve_tokens(self):
+        pending = []
+        for market in self.markets:
+            if market.token_id is None:
+                market.token_id = self.token_cache.get(market.slug)
+            if market.token_id is None:
+                pending.append(market)
+        if not pending:
+            return
+
+        token_ids = await asyncio.gather(*(get_yes_token_id(self.client, market.slug) for market in pending))
+        for market, token_id in zip(pending, token_ids):
+            market.token_id = token_id
+            self.token_cache.put(market.slug, token_id)
+        self.token_cache.save()
+        log.info("Resolved token ids", resolved=len(pending), cached=len(self.markets) - len(pending))
+
+    async def fetch_prices(self) -> list:
+        """Returns one price (or the exception raised fetching it) per active market."""
+        active = self.active_markets()
+        token_ids = list(dict.fromkeys(market.token_id for market in active))
+        chunks = [token_ids[i:i + MIDPOINT_BATCH_SIZE] for i in range(0, len(token_ids), MIDPOINT_BATCH_SIZE)]
+        responses = await asyncio.gather(*(get_midpoints(self.client, chunk) for chunk in chunks), return_exceptions=True)
+
+        midpoints = {}
+        for chunk, response in zip(chunks, responses):
+            for token_id in chunk:
+                midpoints[token_id] = response if isinstance(response, Exception) else response.get(token_id)
 
+        prices = []
+        for market in active:
+            mid = midpoints[market.token_id]
+            if isinstance(mid, Exception):
+                prices.append((market, mid))
+                continue
+            try:
+                prices.append((market, parse_midpoint(mid)))
+            except ValueError as e:
+                prices.append((market, e))
+        return prices
 
-def init_web3() -> Web3:
-    w3 = Web3(Web3.HTTPProvider(RPC_URL))
-    if not w3.is_connected():
+    def active_markets(self) -> list:
+        return [market for market in self.markets if not market.resolved]
+
+    def batch_updates(self, _updates: list) -> list:
+        """Groups (market, price) updates into one update_prices call per oracle, at most MAX_BATCH markets each."""
+        by_oracle: dict = {}
+        for market, price in _updates:
+            by_oracle.setdefault(market.oracle_address, []).append((market, price))
+        return [
+            updates[i:i + MAX_BATCH]
+            for updates in by_oracle.values()
+            for i in range(0, len(updates), MAX_BATCH)
+        ]
+
+    def sign_batch(self, _batch: list):
+        contract = self.contracts[_batch[0][0].oracle_address]
+        market_ids = [market.market_id for market, _ in _batch]
+        oracle_prices = [price for _, price in _batch]
+        # only the oracle side is written, the perp price belongs to the funding keeper
+        perp_prices = [0] * len(_batch)
+        fields = [UPDATE_ORACLE] * len(_batch)
+        tx = {
+            "to": contract.address,
+            "data": contract.encode_abi("update_prices", args=[market_ids, oracle_prices, perp_prices, fields]),
+            "value": 0,
+            "gas": ORACLE_GAS + ORACLE_GAS_PER_MARKET * len(_batch),
+            "gasPrice": self.w3.to_wei(1, "gwei"),
+            "nonce": self.nonce,
+            "chainId": self.chain_id
+        }
+        self.nonce += 1
+        return self.account.sign_transaction(tx)
+
+    async def send_batch(self, _batch: list, _signed_tx):
+        tx_hash = await self.w3.eth.send_raw_transaction(_signed_tx.raw_transaction)
+        now = time.time()
+        for market, price in _batch:
+            market.last_price = price
+            market.last_update = now
+        log.info(
+            "Sent oracle update", markets=len(_batch), tx_hash=tx_hash.hex(),
+            oracle=_batch[0][0].oracle_address, first_market=_batch[0][0].slug
+        )
+        return tx_hash
+
+    async def push_updates(self, _updates: list) -> list:
+        """
+        Packs (market, price) updates into update_prices batches, signs them on
+        consecutive nonces and sends them all at once; the node orders them by
+        nonce. Returns the batch's tx hash or exception for each update.
+        """
+        batches = self.batch_updates(_updates)
+        signed = [self.sign_batch(batch) for batch in batches]
+        results = await asyncio.gather(
+            *(self.send_batch(batch, tx) for batch, tx in zip(batches, signed)),
+            return_exceptions=True
+        )
+        if any(isinstance(result, Exception) for result in results):
+            # a rejected send leaves a nonce gap, re-read so the next cycle fills it
+            await self.sync_nonce()
+
+        by_market = {}
+        for batch, result in zip(batches, results):
+            for market, _ in batch:
+                by_market[id(market)] = result
+        return [by_market[id(market)] for market, _ in _updates]
+
+    async def update_oracle(self, _market: Market, _price: int):
+        result, = await self.push_updates([(_market, _price)])
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def run_cycle(self) -> int:
+        """One poll + push over all active markets, returns the number of updates sent."""
+        updates = []
+        skipped = 0
+        staleness = 0.0
+        now = time.time()
+        for market, price in await self.fetch_prices():
+            if market.last_update is not None:
+                staleness = max(staleness, now - market.last_update)
+            if isinstance(price, Exception):
+                log.error("Midpoint fetch failed for %s: %s", market.slug, price, market=market.slug)
+                continue
+            if price <= 0 or price >= PRICE_SCALE:
+                # a resolved Polymarket market pins at 0 or 1, stop feeding it
+                market.resolved = True
+                log.warning("Market resolved, no longer updating", market=market.slug, oracle_price=price)
+                continue
+            if self.policy.reason(market, price, now) is None:
+                skipped += 1
+                continue
+            updates.append((market, price))
+
+        sent = 0
+        for (market, _), result in zip(updates, await self.push_updates(updates)):
+            if isinstance(result, Exception):
+                log.error("Oracle update failed for %s: %s", market.slug, result, market=market.slug)
+            else:
+                sent += 1
+
+        self.stats.sent += sent
+        self.stats.skipped += skipped
+        self.stats.max_staleness = max(self.stats.max_staleness, staleness)
+        log.info(
+            "Oracle cycle", sent=sent, skipped=skipped, max_staleness_s=round(staleness, 1),
+            total_sent=self.stats.sent, total_skipped=self.stats.skipped
+        )
+        return sent
+
+    async def run(self, _interval: float = POLL_INTERVAL):
+        await self.setup()
+        while self.active_markets():
+            started = time.monotonic()
+            await self.run_cycle()
+            await asyncio.sleep(max(_interval - (time.monotonic() - started), 0))
+
+async def keeper_loop():
+    # web3 re-reads eth_chainId to validate every eth_call, the cache answers those locally
+    w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(RPC_URL, cache_allowed_requests=True))
+    if not await w3.is_connected():
         raise ValueError("Could not connect to specified RPC URL")
-    account = w3.eth.account.from_key(PRIVATE_KEY)
-    w3.eth.default_account = account.address
-    return w3
-
-def update_oracle(w3: Web3, _price: int):
-    contract = w3.eth.contract(address=ORACLE_ADDRESS, abi=ORACLE_ABI)
-    account = w3.eth.default_account
-
-    tx_params = {
-        'from': account,
-        'gas': 200000,
-        'gasPrice': w3.to_wei(1, "gwei"),
-        'nonce': w3.eth.get_transaction_count(account),
-        'chainId': w3.eth.chain_id
-    }
-
-    tx = contract.functions.update_oracle(_price).build_transaction(tx_params)
-    signed_tx = w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-    w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-
-def keeper_loop():
-    yes_token_id = get_yes_token_id()
-    w3 = init_web3()
-
-    while True:
-        price = get_yes_token_price(yes_token_id)
-        if price == 1 or price == 0:
-            return False
-        
-        update_oracle(w3, price)
-
-        time.sleep(10)
+
+    async with make_http_client() as client:
+        await OracleKeeper(w3, client, load_markets()).run()
 
 def main():
-    keeper_loop()
+    asyncio.run(keeper_loop())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
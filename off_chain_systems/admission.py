@@ -0,0 +1,159 @@
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from dotenv import load_dotenv
+
+from off_chain_systems import metrics
+from off_chain_systems.log import get_logger
+
+load_dotenv()
+
+# tokens per second and bucket size of every (trader, endpoint) pair; a batch costs one token per command
+ORDER_RATE_LIMIT = float(os.environ.get('ORDER_RATE_LIMIT', 20))
+ORDER_BURST = float(os.environ.get('ORDER_BURST', 100))
+# engine commands waiting to run before the API answers 503 instead of queueing more
+ENGINE_QUEUE_SIZE = int(os.environ.get('ENGINE_QUEUE_SIZE', 256))
+
+log = get_logger("admission")
+
+class RateLimited(Exception):
+    def __init__(self, _retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry in {_retry_after:.2f}s")
+        self.retry_after = _retry_after
+
+class Overloaded(Exception):
+    def __init__(self, _retry_after: float):
+        super().__init__("Engine queue is full")
+        self.retry_after = _retry_after
+
+def retry_after_header(_seconds: float) -> dict:
+    # Retry-After only takes whole seconds
+    return {"Retry-After": str(max(1, math.ceil(_seconds)))}
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, _tokens: float, _now: float):
+        self.tokens = _tokens
+        self.updated = _now
+
+class RateLimiter:
+    """
+    Token buckets per (trader, endpoint): each refills at _rate tokens per
+    second up to _burst, and a request spends _cost tokens or is refused with
+    the time until it could pass. Buckets are refilled lazily on use, so there
+    is no timer; buckets that have been idle long enough to be full again are
+    equivalent to new ones and are dropped every _prune_every requests.
+    """
+    def __init__(self, _rate: float = ORDER_RATE_LIMIT, _burst: float = ORDER_BURST, _prune_every: int = 10000):
+        self.rate = _rate
+        self.burst = _burst
+        self.buckets: dict = {}
+        self.prune_every = _prune_every
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def take(self, _trader: str, _endpoint: str, _cost: float = 1.0, _now: float | None = None):
+        """Spends _cost tokens of the pair's bucket, raises RateLimited when there are not enough."""
+        now = time.monotonic() if _now is None else _now
+        key = (_trader, _endpoint)
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.burst, now)
+            else:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            self.requests += 1
+            if self.requests % self.prune_every == 0:
+                self._prune(now)
+            if bucket.tokens >= _cost:
+                bucket.tokens -= _cost
+                return
+            # a cost above the burst can never pass, the hint is then the time to a full bucket
+            missing = min(_cost, self.burst) - bucket.tokens
+        raise RateLimited(missing / self.rate)
+
+    def _prune(self, _now: float):
+        full_after = self.burst / self.rate
+        for key in [key for key, bucket in self.buckets.items() if _now - bucket.updated >= full_after]:
+            del self.buckets[key]
+
+class EngineQueue:
+    """
+    Bounded command queue in front of the engine. A single worker thread runs
+    the commands in arrival order, so the book has one writer however many
+    requests there are. enqueue() returns a Future of the command's result,
+    which the async API handlers await without holding a thread; submit()
+    blocks on it. When _size commands are already waiting, both raise
+    Overloaded at once, with a retry hint from the queue length and an average
+    of recent command times. Internal callers (the expiry loop) pass
+    _bounded=False and are never turned away. _after, when given, runs on the
+    worker after every command and before its Future resolves, e.g. to publish
+    state that other threads may only read as a finished copy.
+    """
+    def __init__(self, _size: int = ENGINE_QUEUE_SIZE, _after=None):
+        self.size = _size
+        self.after = _after
+        self.commands: queue.Queue = queue.Queue()
+        self.waiting: int = 0
+        # moving average of command run time, seconds
+        self.service_time: float = 0.001
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.commands.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def enqueue(self, _fn, *_args, _bounded: bool = True, **_kwargs) -> Future:
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            if _bounded and self.waiting >= self.size:
+                raise Overloaded(self.waiting * self.service_time)
+            self.waiting += 1
+        future: Future = Future()
+        self.commands.put((future, time.perf_counter(), _fn, _args, _kwargs))
+        return future
+
+    def submit(self, _fn, *_args, _bounded: bool = True, **_kwargs):
+        return self.enqueue(_fn, *_args, _bounded=_bounded, **_kwargs).result()
+
+    def _run(self):
+        while True:
+            item = self.commands.get()
+            if item is None:
+                return
+            future, queued, fn, args, kwargs = item
+            start = time.perf_counter()
+            metrics.observe_queue_wait(start - queued)
+            try:
+                result, error = fn(*args, **kwargs), None
+            except BaseException as exc:
+                result, error = None, exc
+            if self.after is not None:
+                try:
+                    self.after()
+                except Exception:
+                    log.exception("Engine queue after-command hook failed")
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.waiting -= 1
+                self.service_time += (elapsed - self.service_time) * 0.05
@@ -0,0 +1,198 @@
+import os
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from eth_account import Account
+from eth_utils import to_checksum_address
+from dotenv import load_dotenv
+from off_chain_systems.log import get_logger
+from off_chain_systems.premium_index import PremiumIndex
+from off_chain_systems.position_manager import FundingIndex
+from off_chain_systems.tx_scheduler import TxScheduler, TxPriority
+
+load_dotenv()
+
+PRIVATE_KEY = os.environ.get('PRIVATE_KEY')
+ORACLE_ADDRESS = os.environ.get('ORACLE_ADDRESS')
+ORACLE_ABI = json.loads(os.environ.get('ORACLE_ABI'))
+PERPS_ADDRESS = os.environ.get('PERPS_ADDRESS')
+PERPS_ABI = json.loads(os.environ.get('PERPS_ABI'))
+# this market's id in the oracle, matches the perps contract's market_id
+MARKET_ID = int(os.environ.get('MARKET_ID', 0))
+# change to 4 hours for production
+FUNDING_INTERVAL = float(os.environ.get('FUNDING_INTERVAL', 10))
+PRICE_SCALE = 10**6
+FUNDING_SCALE = 10**18
+FUNDING_GAS = 300000
+UPDATE_PERP = 2  # oracle.vy PriceField.PERP
+
+log = get_logger("funding")
+
+@dataclass(frozen=True)
+class PriceSample:
+    oracle_price: float
+    perp_price: float
+    taken_at: float
+    # time-weighted premium over the funding window, when a PremiumIndex is running
+    premium: float | None = None
+
+    @property
+    def funding_rate(self) -> float:
+        if self.premium is not None:
+            return self.premium
+        return (self.perp_price - self.oracle_price) / self.oracle_price
+
+def sample_engine_prices(_pm, _premium_index: PremiumIndex | None = None, _submit=None) -> PriceSample:
+    """
+    Both prices from one oracle eth_call: the perp price comes from the in-memory
+    book and, on an empty book, falls back to that same oracle read. The sample
+    doubles as a premium index tick, which also covers a book with no trades yet.
+    _submit, when given, runs the book read and the tick on the engine's thread
+    (the server's queue), where trades feed the same index; the oracle call
+    stays on the caller's.
+    """
+    oracle_price = _pm.get_oracle_price()
+
+    def sample() -> PriceSample:
+        perp_price = _pm.get_perp_price(oracle_price)
+        taken_at = time.time()
+        premium = None
+        if _premium_index is not None:
+            _premium_index.update_oracle(oracle_price, taken_at)
+            _premium_index.update_perp(perp_price, taken_at)
+            premium = _premium_index.twap(taken_at)
+        return PriceSample(oracle_price, perp_price, taken_at, premium)
+
+    return sample() if _submit is None else _submit(sample)
+
+def peek_engine_prices(_pm, _premium_index: PremiumIndex | None = None, _submit=None) -> PriceSample:
+    """
+    sample_engine_prices for readers: the same prices, with the premium index's
+    current TWAP, but nothing is recorded into it. Only the funding loop's own
+    samples count as ticks, however often clients poll.
+    """
+    oracle_price = _pm.get_oracle_price()
+
+    def peek() -> PriceSample:
+        perp_price = _pm.get_perp_price(oracle_price)
+        taken_at = time.time()
+        premium = _premium_index.peek(taken_at) if _premium_index is not None else None
+        return PriceSample(oracle_price, perp_price, taken_at, premium)
+
+    return peek() if _submit is None else _submit(peek)
+
+def premium_sampler(
+        _pm,
+        _premium_index: PremiumIndex,
+        _stop: threading.Event,
+        _interval: float = FUNDING_INTERVAL,
+        _submit=None
+):
+    """
+    Ticks the premium index every _interval while the funding loop runs in the
+    standalone keeper, which only reads GET /prices and so records nothing.
+    """
+    while not _stop.wait(_interval):
+        try:
+            sample_engine_prices(_pm, _premium_index, _submit)
+        except Exception:
+            log.exception("Premium sample failed")
+
+class FundingService:
+    """
+    Pushes the perp price to the oracle and the funding rate to the perps
+    contract every interval. Prices come from `_sample`, called once per cycle:
+    sample_engine_prices inside the API process, or an HTTP fetch when run as the
+    standalone keeper. Contracts and chain id are resolved once; a cycle costs
+    one nonce read and the two sends. Two, because the perp price is written to
+    the oracle and the rate to the perps contract, and only the hot wallet
+    (not either contract) may write the oracle. The price update covers just
+    this process's market, the one its engine prices; the oracle keeper writes
+    every market's oracle price in one batch. Each pushed rate is also applied to
+    `_funding_index`, the position manager's mirror of the on-chain index.
+    With `_scheduler` (in-process, sharing the engine's hot wallet) the two
+    transactions go through it at oracle priority and it owns the nonce.
+    """
+    def __init__(
+            self,
+            w3,
+            _sample: Callable[[], PriceSample],
+            _private_key: str = PRIVATE_KEY,
+            _market_id: int = MARKET_ID,
+            _interval: float = FUNDING_INTERVAL,
+            _funding_index: FundingIndex | None = None,
+            _scheduler: TxScheduler | None = None
+    ):
+        self.w3 = w3
+        self.sample = _sample
+        self.account = Account.from_key(_private_key)
+        self.market_id = _market_id
+        self.interval = _interval
+        self.funding_index = _funding_index
+        self.scheduler = _scheduler
+        self.oracle = w3.eth.contract(address=to_checksum_address(ORACLE_ADDRESS), abi=ORACLE_ABI)
+        self.perps = w3.eth.contract(address=to_checksum_address(PERPS_ADDRESS), abi=PERPS_ABI)
+        self.chain_id: int | None = None
+        self.last_sample: PriceSample | None = None
+        self._stop = threading.Event()
+
+    def push(self, _sample: PriceSample) -> list:
+        if self.chain_id is None:
+            self.chain_id = self.w3.eth.chain_id
+        nonce = None if self.scheduler else self.w3.eth.get_transaction_count(self.account.address, "pending")
+
+        perp_price = int(_sample.perp_price * PRICE_SCALE)
+        funding_rate = int(_sample.funding_rate * FUNDING_SCALE)
+        calls = [
+            # only the perp side is written, the oracle price is the oracle keeper's
+            (self.oracle, self.oracle.encode_abi("update_prices", args=[[self.market_id], [0], [perp_price], [UPDATE_PERP]])),
+            (self.perps, self.perps.encode_abi("update_funding", args=[funding_rate])),
+        ]
+
+        tx_hashes = []
+        for offset, (contract, data) in enumerate(calls):
+            tx = {
+                "to": contract.address,
+                "data": data,
+                "value": 0,
+                "gas": FUNDING_GAS,
+                "gasPrice": self.w3.to_wei(1, "gwei"),
+                "chainId": self.chain_id
+            }
+            if self.scheduler is not None:
+                # queued back to back at one priority, so they still go out in this order
+                tx_hashes.append(self.scheduler.submit(TxPriority.ORACLE, tx))
+            else:
+                signed_tx = self.account.sign_transaction({**tx, "nonce": nonce + offset})
+                tx_hashes.append(self.w3.eth.send_raw_transaction(signed_tx.raw_transaction))
+        if self.scheduler is not None:
+            tx_hashes = [future.result() for future in tx_hashes]
+        if self.funding_index is not None:
+            self.funding_index.set_rate(funding_rate, _sample.taken_at)
+
+        log.info(
+            "Sent funding update", oracle_price=_sample.oracle_price, perp_price=_sample.perp_price,
+            funding_rate=_sample.funding_rate, tx_hashes=[tx_hash.hex() for tx_hash in tx_hashes]
+        )
+        return tx_hashes
+
+    def run_cycle(self) -> PriceSample:
+        sample = self.sample()
+        self.push(sample)
+        self.last_sample = sample
+        return sample
+
+    def run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.run_cycle()
+            except Exception:
+                log.exception("Funding cycle failed")
+            self._stop.wait(max(self.interval - (time.monotonic() - started), 0))
+
+    def stop(self):
+        self._stop.set()
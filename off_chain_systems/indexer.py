@@ -0,0 +1,270 @@
+import os
+import json
+import threading
+import time
+
+from eth_utils import event_abi_to_log_topic, to_checksum_address
+from dotenv import load_dotenv
+from off_chain_systems.log import get_logger
+from off_chain_systems.position_manager import Side, Status, PRICE_SCALE
+
+load_dotenv()
+
+PERPS_ADDRESS = os.environ.get('PERPS_ADDRESS')
+PERPS_ABI = json.loads(os.environ.get('PERPS_ABI'))
+MARKET_NAME = os.environ.get('MARKET_NAME')
+# last indexed block and the traders seen so far, so a restart resumes instead of rescanning
+INDEXER_CHECKPOINT = os.environ.get('INDEXER_CHECKPOINT', '.cache/indexer_checkpoint.json')
+# first block to scan without a checkpoint, the perps deploy block
+INDEXER_START_BLOCK = int(os.environ.get('INDEXER_START_BLOCK', 0))
+# blocks per eth_getLogs, halved on the fly when the node rejects a range
+INDEXER_BATCH_BLOCKS = int(os.environ.get('INDEXER_BATCH_BLOCKS', 2000))
+# blocks to stay behind head, 0 is fine on anvil, raise it on chains that reorg
+INDEXER_CONFIRMATIONS = int(os.environ.get('INDEXER_CONFIRMATIONS', 0))
+INDEXER_POLL_INTERVAL = float(os.environ.get('INDEXER_POLL_INTERVAL', 1.0))
+
+log = get_logger("indexer")
+
+class EventDecoder:
+    """
+    topic0 -> (event name, decoded args) for every event in an ABI, straight off
+    the node's JSON. Indexed addresses come back checksummed and are cached per
+    topic, traders repeat far more often than they appear.
+    """
+    def __init__(self, _codec, _abi: list):
+        self.codec = _codec
+        self.events = {}
+        self.addresses = {}
+        for entry in _abi:
+            if entry.get("type") != "event":
+                continue
+            indexed = [(i["name"], i["type"]) for i in entry["inputs"] if i["indexed"]]
+            data = [(i["name"], i["type"]) for i in entry["inputs"] if not i["indexed"]]
+            topic = "0x" + event_abi_to_log_topic(entry).hex()
+            self.events[topic] = (entry["name"], indexed, [name for name, _ in data], [arg_type for _, arg_type in data])
+
+    @property
+    def topics(self) -> list:
+        return list(self.events)
+
+    def decode_topic(self, _arg_type: str, _topic: str):
+        if _arg_type != "address":
+            return self.codec.decode([_arg_type], bytes.fromhex(_topic[2:]))[0]
+        address = self.addresses.get(_topic)
+        if address is None:
+            address = self.addresses[_topic] = to_checksum_address("0x" + _topic[-40:])
+        return address
+
+    def decode(self, _log: dict) -> tuple[str, dict] | None:
+        topics = _log["topics"]
+        event = self.events.get(topics[0].lower())
+        if event is None:
+            return None
+        name, indexed, data_names, data_types = event
+        args = dict(zip(data_names, self.codec.decode(data_types, bytes.fromhex(_log["data"][2:]))))
+        for (arg, arg_type), topic in zip(indexed, topics[1:]):
+            args[arg] = self.decode_topic(arg_type, topic.lower())
+        return name, args
+
+class ChainIndexer:
+    """
+    Follows the perps contract's events and applies them to PositionManager, so
+    changes made on chain by someone other than this server (a third-party
+    liquidation, a cancel sent straight to the contract) show up without
+    polling positions(addr) per account. Block ranges are read with one
+    eth_getLogs per INDEXER_BATCH_BLOCKS for every event at once, and the
+    checkpoint is written after each range. Applying an event makes local state
+    match it rather than replaying it blindly, so events for actions the engine
+    already applied (and ranges re-read after a crash) are no-ops.
+
+    Events are tied to the position they were emitted for, not to whatever the
+    trader has open when they are read: a PositionOpened is matched to a local
+    position on direction, leverage, margin and entry price and stamps it with
+    its block, and a close or liquidation applies to the position opened last
+    at or before its own block. Events that lag behind a newer local open land
+    on the older position they belong to and leave the newer one alone. With
+    _submit (the server's engine queue) each range's events are applied on the
+    engine's thread, the eth_getLogs calls stay on this one.
+    """
+    def __init__(
+            self,
+            w3,
+            _pm,
+            _market: str = MARKET_NAME,
+            _checkpoint_path: str | None = INDEXER_CHECKPOINT,
+            _start_block: int = INDEXER_START_BLOCK,
+            _batch_blocks: int = INDEXER_BATCH_BLOCKS,
+            _confirmations: int = INDEXER_CONFIRMATIONS,
+            _interval: float = INDEXER_POLL_INTERVAL,
+            _submit=None
+    ):
+        self.w3 = w3
+        self.pm = _pm
+        self.market = _market
+        self.address = to_checksum_address(PERPS_ADDRESS)
+        self.decoder = EventDecoder(w3.codec, PERPS_ABI)
+        self.checkpoint_path = _checkpoint_path
+        self.batch_blocks = _batch_blocks
+        self.confirmations = _confirmations
+        self.interval = _interval
+        self.submit = _submit
+        # last block fully applied
+        self.block = _start_block - 1
+        self.traders: set = set()
+        # order events only register the trader, resting orders are the engine's own
+        self.handlers = {
+            "PositionOpened": self.on_position_opened,
+            "PositionClosed": self.on_position_closed,
+            "PositionLiquidated": self.on_position_liquidated,
+            "FundingUpdated": self.on_funding_updated,
+        }
+        self._stop = threading.Event()
+        self.load_checkpoint()
+
+    def load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("address") != self.address:
+            log.warning("Ignoring checkpoint for another contract", address=checkpoint.get("address"))
+            return
+        self.block = checkpoint["block"]
+        self.traders = set(checkpoint["traders"])
+        for trader in self.traders:
+            self.pm.create_account(trader)
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"address": self.address, "block": self.block, "traders": sorted(self.traders)}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def get_logs(self, _from_block: int, _to_block: int) -> list:
+        # raw provider call, web3's log formatters cost more than decoding the events themselves
+        response = self.w3.provider.make_request("eth_getLogs", [{
+            "address": self.address,
+            "fromBlock": hex(_from_block),
+            "toBlock": hex(_to_block),
+            "topics": [self.decoder.topics],
+        }])
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def poll(self) -> int:
+        """Indexes everything up to head - confirmations, returns the number of events applied."""
+        head = self.w3.eth.block_number - self.confirmations
+        applied = 0
+        while self.block < head:
+            to_block = min(self.block + self.batch_blocks, head)
+            try:
+                logs = self.get_logs(self.block + 1, to_block)
+            except Exception:
+                # most nodes cap results per call, narrow the range and retry
+                if to_block == self.block + 1:
+                    raise
+                self.batch_blocks = max((to_block - self.block) // 2, 1)
+                log.warning("eth_getLogs range rejected, retrying narrower", batch_blocks=self.batch_blocks)
+                continue
+            if self.submit is None:
+                applied += self.apply_all(logs)
+            else:
+                applied += self.submit(self.apply_all, logs)
+            self.block = to_block
+            self.save_checkpoint()
+        if applied:
+            log.info("Indexed events", events=applied, block=self.block)
+        return applied
+
+    def apply_all(self, _logs: list) -> int:
+        return sum(self.apply(entry) for entry in _logs)
+
+    def apply(self, _log) -> int:
+        decoded = self.decoder.decode(_log)
+        if decoded is None:
+            return 0
+        name, args = decoded
+        if "trader" in args:
+            self.traders.add(args["trader"])
+            self.pm.create_account(args["trader"])
+        handler = self.handlers.get(name)
+        if handler is not None:
+            handler(args, int(_log["blockNumber"], 16))
+        return 1
+
+    def positions(self, _trader: str) -> list:
+        account = self.pm.accounts.get(_trader)
+        return [p for p in account.positions if p.market_id == self.market] if account else []
+
+    @staticmethod
+    def matches(_position, _args: dict) -> bool:
+        # the engine sends int(x * PRICE_SCALE), allow a unit of float rounding either way
+        return (
+            (_position.side == Side.BUY) == _args["direction"]
+            and _position.leverage == _args["leverage"]
+            and abs(_position.margin * PRICE_SCALE - _args["margin"]) <= 1
+            and abs(_position.entry_price * PRICE_SCALE - _args["entry_price"]) <= 1
+        )
+
+    def on_chain(self, _trader: str, _block: int):
+        """The local position the trader's on-chain position was at _block, the latest one opened by then."""
+        opened = [p for p in self.positions(_trader) if p.open_block is not None and p.open_block <= _block]
+        return max(opened, key=lambda p: p.open_block, default=None)
+
+    def on_position_opened(self, _args: dict, _block: int):
+        trader = _args["trader"]
+        positions = self.positions(trader)
+        if any(p.open_block is not None and p.open_block >= _block for p in positions):
+            # a range re-read, or a position already mirrored at a later block
+            return
+        # the oldest unconfirmed match, events arrive in the order the positions were opened
+        position = next((p for p in positions if p.open_block is None and self.matches(p, _args)), None)
+        if position is not None:
+            position.open_block = _block
+            # the chain's snapshot is authoritative, the local one is only an estimate
+            position.funding_index_snapshot = _args["funding_index_snapshot"]
+            return
+        open_position = self.pm.get_open_position(trader, self.market)
+        if open_position is not None:
+            # a different position is open here, the reconciler sorts out which side is right
+            log.warning("Skipping PositionOpened that matches no open position", trader=trader, block=_block,
+                        position_id=open_position.position_id)
+            return
+        # opened on chain without going through this engine
+        self.pm.create_position_from_chain(
+            trader, self.market, _args["margin"], _args["leverage"], _args["entry_price"],
+            _args["direction"], _args["funding_index_snapshot"], _block
+        )
+
+    def on_position_closed(self, _args: dict, _block: int):
+        position = self.on_chain(_args["trader"], _block)
+        if position is None or position.status != Status.OPEN:
+            return
+        position.realized_pnl += _args["pnl"] / PRICE_SCALE
+        position.quantity = 0
+        position.status = Status.CLOSED
+        position.close_timestamp = time.time()
+        log.info("Position %s closed on chain", position.position_id, trader=_args["trader"])
+
+    def on_position_liquidated(self, _args: dict, _block: int):
+        position = self.on_chain(_args["trader"], _block)
+        if position is not None:
+            self.pm.mark_liquidated(_args["trader"], position)
+
+    def on_funding_updated(self, _args: dict, _block: int):
+        self.pm.funding.reset(_args["funding_index"], _args["funding_rate_per_second"], _args["timestamp"])
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                log.exception("Indexer poll failed")
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,157 @@
+import atexit
+import json
+from enum import Enum
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "text" for humans, "json" for one object per line
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+ROOT_NAME = "tachyon"
+
+def _plain(value):
+    return value.value if isinstance(value, Enum) else value
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={_plain(value)}" for key, value in fields.items())
+        return line
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update((key, _plain(value)) for key, value in fields.items())
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# one queue for the life of the process, configure() only swaps the writer behind it
+_queue = queue.SimpleQueue()
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    The stock QueueHandler formats the record on the calling thread before
+    enqueueing it, so it can be pickled across processes. This queue never leaves
+    the process, so records go in as-is and the listener formats them. Covers
+    plain logging.getLogger("tachyon...") callers; StructuredLogger skips the
+    record entirely.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class BackgroundWriter(logging.handlers.QueueListener):
+    """Turns StructuredLogger entries into LogRecords on the writer thread."""
+    def prepare(self, entry):
+        if isinstance(entry, logging.LogRecord):
+            return entry
+        created, level, name, msg, args, fields, exc_info = entry
+        record = logging.LogRecord(name, level, "", 0, msg, args, exc_info)
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        record.fields = fields
+        return record
+
+class StructuredLogger:
+    """
+    Logger whose keyword arguments become structured fields:
+
+        log.info("Removed limit order %s", order_id, trader=address)
+
+    A call below the configured level costs one cached level check. Above it, the
+    calling thread only enqueues (timestamp, level, name, msg, args, fields);
+    building the LogRecord, merging %-args and writing all happen on the
+    background writer. Pass plain values, not objects that are mutated afterwards.
+    """
+    __slots__ = ("logger", "name")
+
+    def __init__(self, _logger: logging.Logger):
+        self.logger = _logger
+        self.name = _logger.name
+
+    def _emit(self, _level: int, _msg: str, _args: tuple, _fields: dict, _exc_info=None):
+        _queue.put((time.time(), _level, self.name, _msg, _args, _fields, _exc_info))
+
+    def debug(self, _msg: str, *args, **fields):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._emit(logging.DEBUG, _msg, args, fields)
+
+    def info(self, _msg: str, *args, **fields):
+        if self.logger.isEnabledFor(logging.INFO):
+            self._emit(logging.INFO, _msg, args, fields)
+
+    def warning(self, _msg: str, *args, **fields):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self._emit(logging.WARNING, _msg, args, fields)
+
+    def error(self, _msg: str, *args, **fields):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self._emit(logging.ERROR, _msg, args, fields)
+
+    def exception(self, _msg: str, *args, **fields):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self._emit(logging.ERROR, _msg, args, fields, sys.exc_info())
+
+_listener: BackgroundWriter | None = None
+_lock = threading.Lock()
+
+def configure(_level: str = LOG_LEVEL, _format: str = LOG_FORMAT, _stream=None) -> BackgroundWriter:
+    """
+    Routes the tachyon logger tree through an unbounded in-process queue to a
+    single background writer. Safe to call more than once; later calls replace
+    the writer (tests use this to point it at a buffer).
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+
+        writer = logging.StreamHandler(_stream or sys.stdout)
+        writer.setFormatter(JSONFormatter() if _format == "json" else TextFormatter())
+
+        root = logging.getLogger(ROOT_NAME)
+        root.handlers = [DeferredQueueHandler(_queue)]
+        root.setLevel(_level)
+        root.propagate = False
+
+        _listener = BackgroundWriter(_queue, writer, respect_handler_level=True)
+        _listener.start()
+        return _listener
+
+def flush():
+    """Blocks until everything logged so far has been written."""
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
+
+def shutdown():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+atexit.register(shutdown)
+
+def get_logger(_name: str) -> StructuredLogger:
+    if _listener is None:
+        configure()
+    return StructuredLogger(logging.getLogger(f"{ROOT_NAME}.{_name}"))
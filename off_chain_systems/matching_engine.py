@@ -1,12 +1,21 @@
+from collections import deque
 from dataclasses import dataclass
 from enum import Enum
-from sortedcontainers import SortedDict
+from itertools import islice
+import threading
 import time
 from web3 import Web3
 from dotenv import load_dotenv
 import os
 import json
+import orjson
 from off_chain_systems.position_manager import PositionManager, Status, Side
+from off_chain_systems import metrics
+from off_chain_systems.price_ladder import TickLadder, DepthIndex, TICK_SIZE
+from off_chain_systems.triggers import TriggerIndex, TriggerKind
+from off_chain_systems.timing_wheel import TimingWheel, EXPIRY_TICK
+from off_chain_systems.tx_scheduler import TxPriority
+from off_chain_systems.log import get_logger
 
 load_dotenv()
 
@@ -15,6 +24,10 @@ RPC_URL = os.environ.get('RPC_URL')
 PERPS_ADDRESS = os.environ.get('PERPS_ADDRESS')
 PERPS_ABI = json.loads(os.environ.get("PERPS_ABI"))
 PRICE_SCALE = 10**6
+# traders per expire_limit_orders transaction, at most the contract's MAX_EXPIRE_BATCH
+EXPIRE_BATCH = int(os.environ.get('EXPIRE_BATCH', 50))
+
+log = get_logger("matching_engine")
 
 # class Side(Enum):
 #     BUY = "buy"
@@ -24,6 +37,16 @@ class OrderType(Enum):
     LIMIT = "limit"
     MARKET = "market"
 
+class TimeInForce(Enum):
+    # rest whatever does not fill, limit orders only
+    GTC = "gtc"
+    # fill what the book has right now, drop the rest
+    IOC = "ioc"
+    # fill in full right now or not at all
+    FOK = "fok"
+    # rest like GTC until expires_at, then leave the book as if cancelled
+    GTT = "gtt"
+
 # class Status(Enum):
 #     FILLED = "filled"
 #     CANCELLED = "cancelled"
@@ -55,15 +78,90 @@ class Order:
     timestamp: float
     order_type: OrderType
     status: Status
+    # unix seconds a GTT order leaves the book, None rests until filled or cancelled
+    expires_at: float | None = None
+
+class PriceLevel:
+    """
+    FIFO queue of the orders resting at one price. Orders sit in one-slot lists
+    so a cancel can blank its slot through the book's order index instead of
+    searching the queue; blanked slots are dropped once they reach the head, or
+    all at once when they outnumber the live orders. Iteration, indexing and
+    len() only ever see live orders, in time priority.
+    """
+    __slots__ = ("slots", "live")
+
+    def __init__(self):
+        self.slots: deque = deque()
+        self.live: int = 0
+
+    def append(self, _order: Order) -> list:
+        slot = [_order]
+        self.slots.append(slot)
+        self.live += 1
+        return slot
+
+    def discard(self, _slot: list):
+        _slot[0] = None
+        self.live -= 1
+        if len(self.slots) > 2 * self.live + 8:
+            self.slots = deque(slot for slot in self.slots if slot[0] is not None)
+
+    def _skip_tombstones(self):
+        slots = self.slots
+        while slots and slots[0][0] is None:
+            slots.popleft()
+
+    def peek(self) -> Order:
+        self._skip_tombstones()
+        return self.slots[0][0]
+
+    def popleft(self) -> Order:
+        self._skip_tombstones()
+        self.live -= 1
+        return self.slots.popleft()[0]
+
+    def __len__(self) -> int:
+        return self.live
+
+    def __iter__(self):
+        for slot in self.slots:
+            if slot[0] is not None:
+                yield slot[0]
+
+    def __getitem__(self, _index: int) -> Order:
+        if _index < 0:
+            _index += self.live
+        if not 0 <= _index < self.live:
+            raise IndexError("price level index out of range")
+        return next(islice(iter(self), _index, None))
 
 class OrderBook:
     def __init__(self, _asset_name, _pm):
         self.asset_name: str = _asset_name
         self.order_id: int = 0
         self.trade_id: int = 0
-        self.bids: SortedDict = SortedDict()
-        self.asks: SortedDict = SortedDict()
+        self.bids: TickLadder = TickLadder(TICK_SIZE)
+        self.asks: TickLadder = TickLadder(TICK_SIZE)
+        # cumulative resting size per side, best price first, for quotes and pre-trade checks
+        self.bid_depth: DepthIndex = DepthIndex(self.bids, True)
+        self.ask_depth: DepthIndex = DepthIndex(self.asks, False)
+        # trader -> (resting order, its PriceLevel slot), one open limit order per trader
+        self.open_orders: dict = {}
+        # stop / take-profit triggers of open positions, fired from take() after every sweep
+        self.triggers: TriggerIndex = TriggerIndex()
+        self.triggers_due: deque = deque()
+        self.firing_triggers: bool = False
+        # resting GTT orders by trader, expire_orders() pops what is due
+        self.expiries: TimingWheel = TimingWheel(EXPIRY_TICK, time.time())
         self.trade_events = []
+        # called with every Trade as it is logged, e.g. PremiumIndex.record_trade
+        self.trade_listeners: list = []
+        # bumped on every book or trade mutation, read endpoints cache encoded bytes per version
+        self.version: int = 0
+        self._encoded_cache: dict = {}
+        # (version, JSON bytes) of the book at the last publish_snapshot(), what other threads read
+        self._published: tuple = self.encoded_snapshot()
         self.MAKER_FEE: float = 0.0002
         self.TAKER_FEE: float = 0.0006
         self.w3 = Web3(Web3.HTTPProvider(RPC_URL))
@@ -91,30 +189,49 @@ class OrderBook:
         quantity = int(_quantity)
         direction: bool = True if _direction == Side.BUY else False
 
-        tx = contract.functions.add_limit_order(
-            _leverage,
-            margin,
-            price,
-            quantity,
-            direction
-        ).build_transaction({
-            "from": trader_address,
-            "nonce": w3.eth.get_transaction_count(trader_address),
-            "gas": 300000,
-            "gasPrice": w3.to_wei(1, "gwei")
-        })
+        with metrics.stage("build_transaction"):
+            tx = contract.functions.add_limit_order(
+                _leverage,
+                margin,
+                price,
+                quantity,
+                direction
+            ).build_transaction({
+                "from": trader_address,
+                "nonce": w3.eth.get_transaction_count(trader_address),
+                "gas": 300000,
+                "gasPrice": w3.to_wei(1, "gwei")
+            })
 
         return tx
     
     def send_limit_order_removal(self, w3: Web3, trader_address: str):
         contract = w3.eth.contract(address=PERPS_ADDRESS, abi=PERPS_ABI)
 
-        tx = contract.functions.close_limit_order().build_transaction({
-            "from": trader_address,
-            "nonce": w3.eth.get_transaction_count(trader_address),
-            "gas": 300000,
-            "gasPrice": w3.to_wei(1, "gwei")
-        })
+        with metrics.stage("build_transaction"):
+            tx = contract.functions.close_limit_order().build_transaction({
+                "from": trader_address,
+                "nonce": w3.eth.get_transaction_count(trader_address),
+                "gas": 300000,
+                "gasPrice": w3.to_wei(1, "gwei")
+            })
+
+        return tx
+
+    def send_limit_order_replacement(self, w3: Web3, _margin: float, _price: float, _quantity: float, trader_address: str):
+        contract = w3.eth.contract(address=PERPS_ADDRESS, abi=PERPS_ABI)
+
+        margin = int(_margin * PRICE_SCALE)
+        price = int(_price * PRICE_SCALE)
+        quantity = int(_quantity)
+
+        with metrics.stage("build_transaction"):
+            tx = contract.functions.replace_limit_order(margin, price, quantity).build_transaction({
+                "from": trader_address,
+                "nonce": w3.eth.get_transaction_count(trader_address),
+                "gas": 300000,
+                "gasPrice": w3.to_wei(1, "gwei")
+            })
 
         return tx
     
@@ -127,20 +244,32 @@ class OrderBook:
 
         quantity_to_fill = int(_quantity_to_fill)
 
-        tx_params = {
-            "from": sender.address,
-            "nonce": w3.eth.get_transaction_count(sender.address),
-            "gas": 300000,
-            "gasPrice": w3.to_wei(1, "gwei")
-        }
+        with metrics.stage("build_transaction"):
+            tx_params = {
+                "from": sender.address,
+                "gas": 300000,
+                "gasPrice": w3.to_wei(1, "gwei")
+            }
 
-        tx = contract.functions.fill_limit_order(_address, quantity_to_fill).build_transaction(tx_params)
-        signed_tx = w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+            tx = contract.functions.fill_limit_order(_address, quantity_to_fill).build_transaction(tx_params)
 
-        return receipt
+        # the hot wallet's scheduler assigns the nonce, liquidations and closes go first;
+        # the receipt is checked off this thread so the engine never waits for a block
+        return self.pm.tx_scheduler.settle(TxPriority.FILL, tx)
     
+    def send_limit_order_expiry(self, w3: Web3, _addresses: list):
+        contract = w3.eth.contract(address=PERPS_ADDRESS, abi=PERPS_ABI)
+        sender = w3.eth.account.from_key(PRIVATE_KEY)
+
+        with metrics.stage("build_transaction"):
+            tx = contract.functions.expire_limit_orders(_addresses).build_transaction({
+                "from": sender.address,
+                "gas": 100000 + 60000 * len(_addresses),
+                "gasPrice": w3.to_wei(1, "gwei")
+            })
+
+        return self.pm.tx_scheduler.settle(TxPriority.OTHER, tx)
+
     def send_open_position(self, w3: Web3, _margin: float, _leverage: int, _direction: Side, trader_address: str, _price: float):
         # print(f"Simulating open position for {trader_address} at {_price} (no Web3 tx).")
         # return True
@@ -151,12 +280,13 @@ class OrderBook:
         direction: bool = True if _direction == Side.BUY else False
         price: int = int(_price * PRICE_SCALE)
 
-        tx = contract.functions.open_position(margin, _leverage, direction, price).build_transaction({
-            "from": trader_address,
-            "nonce": w3.eth.get_transaction_count(trader_address),
-            "gas": 300000,
-            "gasPrice": w3.to_wei(1, "gwei")
-        })
+        with metrics.stage("build_transaction"):
+            tx = contract.functions.open_position(margin, _leverage, direction, price).build_transaction({
+                "from": trader_address,
+                "nonce": w3.eth.get_transaction_count(trader_address),
+                "gas": 300000,
+                "gasPrice": w3.to_wei(1, "gwei")
+            })
 
         return tx
     
@@ -170,18 +300,14 @@ class OrderBook:
 
         price: int = int(_price * PRICE_SCALE)
 
-        tx = contract.functions.close_position(trader_address, price).build_transaction({
-            "from": sender.address,
-            "nonce": w3.eth.get_transaction_count(sender.address),
-            "gas": 300000,
-            "gasPrice": w3.to_wei(1, "gwei")
-        })
+        with metrics.stage("build_transaction"):
+            tx = contract.functions.close_position(trader_address, price).build_transaction({
+                "from": sender.address,
+                "gas": 300000,
+                "gasPrice": w3.to_wei(1, "gwei")
+            })
 
-        signed_tx = w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-
-        return receipt
+        return self.pm.tx_scheduler.settle(TxPriority.CLOSE, tx)
 
     def log_trade(self, order: Order, _fill_quantity, _taker_id, _maker_id, _taker_side, taker_order: Order) -> Trade:
         trade: Trade = Trade(
@@ -196,6 +322,8 @@ class OrderBook:
             maker_fee = (order.margin * order.leverage) * self.MAKER_FEE
         )
         self.trade_events.append(trade)
+        for listener in self.trade_listeners:
+            listener(trade)
         return trade
 
     def increment_order_id(self) -> int:
@@ -207,11 +335,66 @@ class OrderBook:
         return self.trade_id
     
     def get_best_bid(self) -> float:
-        return max(self.bids) if self.bids else None
+        return self.bids.peekitem(-1)[0] if self.bids else None
     
     def get_best_ask(self) -> float:
-        return min(self.asks) if self.asks else None
+        return self.asks.peekitem(0)[0] if self.asks else None
     
+    def rest_order(self, _order: Order):
+        book, depth = (self.bids, self.bid_depth) if _order.side == Side.BUY else (self.asks, self.ask_depth)
+        level = book.get(_order.price)
+        if level is None:
+            level = book[_order.price] = PriceLevel()
+        self.open_orders[_order.trader_id] = (_order, level.append(_order))
+        depth.add(_order.price, _order.quantity)
+        if _order.expires_at is not None:
+            self.expiries.schedule(_order.trader_id, _order.expires_at)
+
+    def unrest_order(self, _trader_id: str) -> Order:
+        """Takes the trader's order out of its level, dropping the level once nothing live is left."""
+        order, slot = self.open_orders.pop(_trader_id)
+        book, depth = (self.bids, self.bid_depth) if order.side == Side.BUY else (self.asks, self.ask_depth)
+        depth.add(order.price, -order.quantity)
+        if order.expires_at is not None:
+            self.expiries.cancel(_trader_id)
+        level = book[order.price]
+        level.discard(slot)
+        if not level:
+            del book[order.price]
+        return order
+
+    def bump_version(self):
+        self.version += 1
+
+    def _encoded(self, _key: str, _build) -> tuple:
+        version = self.version
+        cached = self._encoded_cache.get(_key)
+        if cached is None or cached[0] != version:
+            cached = (version, orjson.dumps(_build()))
+            self._encoded_cache[_key] = cached
+        return cached
+
+    def encoded_snapshot(self) -> tuple:
+        """
+        Returns (version, JSON bytes) of the book snapshot, re-encoded only after a mutation.
+        """
+        return self._encoded("orderbook", self.snapshot)
+
+    def publish_snapshot(self):
+        """
+        Encodes the book for readers on other threads. Call it from the thread
+        that runs the engine (the server's queue does after every command): the
+        levels are only walked there, never while a command is changing them.
+        """
+        self._published = self.encoded_snapshot()
+
+    def published_snapshot(self) -> tuple:
+        """(version, JSON bytes) of the last published snapshot, safe to call from any thread."""
+        return self._published
+
+    def encoded_trades(self) -> tuple:
+        return self._encoded("trades", lambda: {"trades": self.trade_events[-20:]})
+
     def snapshot(self) -> dict:
         def levels(book, reverse=False):
             items = reversed(book.items()) if reverse else book.items()
@@ -224,29 +407,143 @@ class OrderBook:
             "asks": levels(self.asks)
         }
 
+    def crosses(self, _side: Side, _price: float) -> bool:
+        """True if a limit at _price would trade against the opposite side's best level."""
+        if _side == Side.BUY:
+            return bool(self.asks) and self.asks.peekitem(0)[0] <= _price
+        return bool(self.bids) and self.bids.peekitem(-1)[0] >= _price
+
+    def fillable(self, _side: Side, _limit_price: float | None, _quantity: float) -> bool:
+        """True if the opposite side holds _quantity at prices no worse than _limit_price (None: any price)."""
+        depth = self.ask_depth if _side == Side.BUY else self.bid_depth
+        available = depth.total() if _limit_price is None else depth.within(_limit_price)[0]
+        return available >= _quantity - 1e-9
+
+    def quote(self, _side: Side, _quantity: float | None = None, _bps: float | None = None) -> dict:
+        """
+        What a taker on _side would get right now, read from the depth index in
+        O(log ticks): the VWAP and worst price of taking _quantity, and the size
+        resting within _bps of the best price. The book is not touched.
+        """
+        if _quantity is None and _bps is None:
+            raise ValueError("Quote needs a quantity, a bps range or both")
+        if _quantity is not None and _quantity <= 0:
+            raise ValueError("Cannot quote 0 or negative quantity")
+        if _bps is not None and _bps < 0:
+            raise ValueError("Cannot quote a negative bps range")
+        depth, best = (self.ask_depth, self.get_best_ask()) if _side == Side.BUY else (self.bid_depth, self.get_best_bid())
+        result = {"side": _side.value, "best_price": best}
+        if _quantity is not None:
+            filled, notional, worst = depth.cost(_quantity)
+            vwap = notional / filled if filled else None
+            result.update(
+                quantity=_quantity,
+                filled=filled,
+                vwap=vwap,
+                worst_price=worst,
+                # cost against the taker, positive for a buy above the best ask and a sell below the best bid
+                impact_bps=((vwap - best) / best if _side == Side.BUY else (best - vwap) / best) * 10_000 if filled else None,
+            )
+        if _bps is not None:
+            limit = None if best is None else best * (1 + _bps / 10_000 if _side == Side.BUY else 1 - _bps / 10_000)
+            available, notional = depth.within(limit) if limit is not None else (0.0, 0.0)
+            result.update(bps=_bps, limit_price=limit, available=available, available_vwap=notional / available if available else None)
+        return result
+
+    def match(self, _taker: Order, _limit_price: float | None) -> tuple[list, float, float]:
+        """
+        Matching kernel for every taker, market orders and crossing limits alike.
+        Walks the opposite side from the best level and stops at the first level
+        worse than _limit_price (None: no bound) or as soon as the taker is filled.
+        Returns (fills, filled quantity, VWAP), accumulated in the same pass.
+        """
+        book, depth = (self.asks, self.ask_depth) if _taker.side == Side.BUY else (self.bids, self.bid_depth)
+        # best level first: lowest ask for a buy, highest bid for a sell
+        best = 0 if _taker.side == Side.BUY else -1
+        fills = []
+        remaining: float = _taker.quantity
+        notional: float = 0.0
+
+        while remaining > 0 and book:
+            price_level, order_list = book.peekitem(best)
+            if _limit_price is not None and (price_level > _limit_price if best == 0 else price_level < _limit_price):
+                break
+            while remaining > 0 and order_list:
+                current_order = order_list.popleft()
+                del self.open_orders[current_order.trader_id]
+                depth.add(price_level, -current_order.quantity)
+                if current_order.expires_at is not None:
+                    self.expiries.cancel(current_order.trader_id)
+
+                # right now for mvp, a partially filled resting order is refunded the margin that
+                # doesn't get filled and leaves the book, so every order touched is popped
+                resting_filled_quantity = min(remaining, current_order.quantity)
+                fills.append(self.log_trade(current_order, resting_filled_quantity, _taker.trader_id, current_order.trader_id, _taker.side, _taker))
+                remaining -= resting_filled_quantity
+                notional += current_order.price * resting_filled_quantity
+
+                self.call_fill_limit_order(self.w3, current_order.trader_id, resting_filled_quantity)
+
+                with metrics.stage("position_update"):
+                    has_position = self.find_open_positions(current_order.trader_id, current_order.side)
+
+                    if has_position:
+                        self.pm.close_position(current_order.trader_id, self.asset_name, resting_filled_quantity, current_order.price)
+                    else:
+                        self.pm.create_position(current_order.trader_id, self.asset_name, current_order.side, current_order.price, resting_filled_quantity, current_order.leverage, current_order.margin)
+            if not order_list:
+                del book[price_level]
+
+        filled = _taker.quantity - remaining
+        return fills, filled, notional / filled if filled else 0.0
+
+    @metrics.timed_order("limit")
     def add_limit_order(
             self,
             _trader_id: str,
             _side: Side,
             _price: float,
             _quantity: float,
-            _leverage: int
-    ):
-        if _price >= 1:
-            raise ValueError("Cannot set limit at 1")
-        if _price <= 0:
-            raise ValueError("Cannot set limit at 0")
-        if _leverage <= 0:
-            raise ValueError("Cannot enter 0 leverage")
-        
-        account = self.pm.accounts.get(_trader_id)
-        if account and any(pos.is_open for pos in account.positions):
-            raise ValueError("Cannot place limit order with an existing open position")
-
-        for price_level, orders in {**self.bids, **self.asks}.items():
-            if any(o.trader_id == _trader_id and o.status == Status.OPEN for o in orders):
+            _leverage: int,
+            _time_in_force: TimeInForce = TimeInForce.GTC,
+            _expires_at: float | None = None
+    ) -> list:
+        """
+        A limit priced through the opposite side's best level trades immediately
+        as a taker, up to its price. The contract allows no resting order next
+        to an open position, so whatever a crossing limit does not fill is
+        dropped, as with IOC; a non-crossing GTC limit rests, a GTT one until
+        _expires_at (unix seconds). IOC that would not fill and FOK that would
+        not fill in full are rejected before anything is sent. Returns the fills.
+        """
+        with metrics.stage("validation"):
+            if _price >= 1:
+                raise ValueError("Cannot set limit at 1")
+            if _price <= 0:
+                raise ValueError("Cannot set limit at 0")
+            # both sides share one grid, raises for a price between ticks
+            self.bids.tick(_price)
+            if _leverage <= 0:
+                raise ValueError("Cannot enter 0 leverage")
+            if _quantity <= 0:
+                raise ValueError("Cannot send 0 or negative quantity orders")
+            if (_time_in_force == TimeInForce.GTT) != (_expires_at is not None):
+                raise ValueError("Good-till-time orders need an expiry, and only they take one")
+            if _expires_at is not None and _expires_at <= time.time():
+                raise ValueError("Order expiry is in the past")
+            
+            account = self.pm.accounts.get(_trader_id)
+            if account and any(pos.is_open for pos in account.positions):
+                raise ValueError("Cannot place limit order with an existing open position")
+
+            if _trader_id in self.open_orders:
                 raise ValueError("Trader already has an open limit order")
 
+            crossing = self.crosses(_side, _price)
+            if _time_in_force == TimeInForce.IOC and not crossing:
+                raise ValueError("Immediate-or-cancel limit would not fill")
+            if _time_in_force == TimeInForce.FOK and not self.fillable(_side, _price, _quantity):
+                raise ValueError("Fill-or-kill order cannot be filled in full")
         
         _margin: float = (_price * _quantity) / float(_leverage)
 
@@ -261,112 +558,193 @@ class OrderBook:
             margin = _margin,
             timestamp = time.time(),
             order_type = OrderType.LIMIT,
-            status = Status.OPEN
+            status = Status.OPEN,
+            expires_at = _expires_at
         )
 
-        book = self.bids if order.side == Side.BUY else self.asks
+        if crossing:
+            return self.take(order, _price)
 
         self.send_limit_order(self.w3, order.leverage, order.margin, order.price, order.quantity, order.side, order.trader_id)
 
-        if order.price not in book:
-            order_list = [order]
-            book[order.price] = order_list
-        else:
-            book[order.price].append(order)
+        self.rest_order(order)
+        self.bump_version()
+        return []
 
+    @metrics.timed_order("cancel")
     def remove_limit_order(self, _trader_id: str):
         """
         Removes the trader's single open limit order, if one exists.
         Automatically detects whether it's on the bid or ask side.
         """
-        found_order = None
-        found_side = None
-        found_price = None
-
-        # Search both sides of the book for the trader's open limit order
-        for side, book in [("buy", self.bids), ("sell", self.asks)]:
-            for price_level, order_list in list(book.items()):
-                for order in order_list:
-                    if order.trader_id == _trader_id and order.status == Status.OPEN:
-                        found_order = order
-                        found_side = side
-                        found_price = price_level
-                        break
-                if found_order:
-                    break
-            if found_order:
-                break
-
-        if not found_order:
+        if _trader_id not in self.open_orders:
             raise ValueError(f"No open limit order found for trader {_trader_id}")
 
-        # Remove the order from the book
-        book = self.bids if found_side == "buy" else self.asks
-        order_list = book[found_price]
-        order_list.remove(found_order)
-
-        if not order_list:
-            del book[found_price]
+        # Tombstone the order in its level, the slot is reclaimed lazily
+        found_order = self.unrest_order(_trader_id)
 
         # Mark the order as cancelled
         found_order.status = Status.CLOSED
-        print(f"Removed limit order {found_order.order_id} for trader {_trader_id}")
+        self.bump_version()
+        log.info("Removed limit order %s", found_order.order_id, trader=_trader_id)
 
         # Mirror on-chain cancel (simulated or real)
         self.send_limit_order_removal(self.w3, _trader_id)
 
+    def expire_orders(self, _now: float | None = None) -> list:
+        """
+        Takes every GTT order due by _now off the book through the cancel path and
+        removes them on chain in EXPIRE_BATCH-sized expire_limit_orders calls.
+        The wheel hands over only what is due, so this is O(expired), not a
+        scan of the book. Returns the expired traders.
+        """
+        now = time.time() if _now is None else _now
+        expired = []
+        for trader_id in self.expiries.advance(now):
+            found = self.open_orders.get(trader_id)
+            if found is None or found[0].expires_at is None or found[0].expires_at > now:
+                continue
+            order = self.unrest_order(trader_id)
+            order.status = Status.CLOSED
+            expired.append(trader_id)
+        if not expired:
+            return expired
+
+        self.bump_version()
+        log.info("Expired %s limit orders", len(expired))
+        for start in range(0, len(expired), EXPIRE_BATCH):
+            self.send_limit_order_expiry(self.w3, expired[start:start + EXPIRE_BATCH])
+        return expired
+
+    def expiry_loop(self, _stop: threading.Event, _submit=None):
+        """
+        Runs expire_orders() on the wheel ticks that have something due, until
+        _stop is set. _submit, when given, runs each pass (the server's engine
+        queue, so expiry never races an order command); idle ticks cost it
+        nothing, due_by() only reads the wheel's next firing tick.
+        """
+        while not _stop.is_set():
+            try:
+                if not self.expiries.due_by(time.time()):
+                    pass
+                elif _submit is None:
+                    self.expire_orders()
+                else:
+                    _submit(self.expire_orders)
+            except Exception:
+                log.exception("Order expiry pass failed")
+            _stop.wait(self.expiries.tick)
+
+    @metrics.timed_order("replace")
+    def replace_limit_order(self, _trader_id: str, _price: float, _quantity: float) -> Order:
+        """
+        Amends the trader's open limit order in place instead of a cancel + add round trip.
+        A price change or a size increase sends the order to the back of its level,
+        a pure size decrease keeps time priority. Only the margin delta moves on-chain.
+        """
+        with metrics.stage("validation"):
+            if _price >= 1:
+                raise ValueError("Cannot set limit at 1")
+            if _price <= 0:
+                raise ValueError("Cannot set limit at 0")
+            # both sides share one grid, raises for a price between ticks
+            self.bids.tick(_price)
+            if _quantity <= 0:
+                raise ValueError("Cannot send 0 or negative quantity orders")
+
+        if _trader_id not in self.open_orders:
+            raise ValueError(f"No open limit order found for trader {_trader_id}")
+
+        found_order, _ = self.open_orders[_trader_id]
+        # an amend only moves margin on chain, it cannot turn into a fill
+        if self.crosses(found_order.side, _price):
+            raise ValueError("Replacement price would cross the book")
+        _margin: float = (_price * _quantity) / float(found_order.leverage)
+
+        self.send_limit_order_replacement(self.w3, _margin, _price, _quantity, _trader_id)
+
+        loses_priority = _price != found_order.price or _quantity > found_order.quantity
+
+        if loses_priority:
+            self.unrest_order(_trader_id)
+            found_order.price = _price
+            found_order.quantity = _quantity
+            self.rest_order(found_order)
+            found_order.timestamp = time.time()
+        else:
+            depth = self.bid_depth if found_order.side == Side.BUY else self.ask_depth
+            depth.add(_price, _quantity - found_order.quantity)
+            found_order.quantity = _quantity
+        found_order.margin = _margin
+        self.bump_version()
+
+        return found_order
     
+    @metrics.timed_order("market")
     def market_order(
             self,
             _trader_id: str,
             _side: Side,
             _quantity: float,
-            _leverage: int
-    ):
-        if _quantity <= 0:
-            raise ValueError("Cannot send 0 or negative quantity orders")
-        if _leverage <= 0:
-            raise ValueError("Cannot enter 0 leverage")
-        
-        account = self.pm.accounts.get(_trader_id)
-        open_pos = None
-
-        if account:
-            for pos in account.positions:
-                if pos.status == Status.OPEN and pos.market_id == self.asset_name:
-                    open_pos = pos
-                    break
-
-        if open_pos:
-            same_side = (
-                (open_pos.side == "buy" and _side == Side.BUY)
-                or (open_pos.side == "sell" and _side == Side.SELL)
-            )
-            if same_side:
-                raise ValueError("Cannot open additional position in same direction — close first")
-            print(f"Trader {_trader_id} has open position on opposite side, treating order as close.")
-        
-        if open_pos and hasattr(open_pos, "quantity"):
-            if _quantity > open_pos.quantity:
-                print(f"Reducing close order from {_quantity} → {open_pos.quantity} to match open position size.")
-                _quantity = open_pos.quantity
-
-        for side, book in [("buy", self.bids), ("sell", self.asks)]:
-            for price_level, order_list in list(book.items()):
-                for order in list(order_list):
-                    if order.trader_id == _trader_id and order.status == Status.OPEN:
-                        print(f"Trader {_trader_id} has an active limit order. Cancelling before market execution.")
-                        self.remove_limit_order(_trader_id)
+            _leverage: int,
+            _worst_price: float | None = None,
+            _time_in_force: TimeInForce = TimeInForce.IOC
+    ) -> list:
+        """
+        Takes liquidity at any price down (or up) to _worst_price, if given, so a
+        thin book is never swept end to end. Market orders never rest: IOC keeps
+        whatever fills, FOK fills in full or is rejected untouched. Returns the fills.
+        """
+        with metrics.stage("validation"):
+            if _quantity <= 0:
+                raise ValueError("Cannot send 0 or negative quantity orders")
+            if _leverage <= 0:
+                raise ValueError("Cannot enter 0 leverage")
+            if _time_in_force in (TimeInForce.GTC, TimeInForce.GTT):
+                raise ValueError("Market orders cannot rest, use IOC or FOK")
+            
+            account = self.pm.accounts.get(_trader_id)
+            open_pos = None
+
+            if account:
+                for pos in account.positions:
+                    if pos.status == Status.OPEN and pos.market_id == self.asset_name:
+                        open_pos = pos
                         break
-                else:
-                    continue
-                break
+
+            if open_pos:
+                same_side = (
+                    (open_pos.side == "buy" and _side == Side.BUY)
+                    or (open_pos.side == "sell" and _side == Side.SELL)
+                )
+                if same_side:
+                    raise ValueError("Cannot open additional position in same direction — close first")
+                log.info("Opposite side position open, treating market order as close", trader=_trader_id)
+            
+            if open_pos and hasattr(open_pos, "quantity"):
+                if _quantity > open_pos.quantity:
+                    log.info("Reducing close order from %s to %s to match open position size", _quantity, open_pos.quantity, trader=_trader_id)
+                    _quantity = open_pos.quantity
+
+        if _trader_id in self.open_orders:
+            log.info("Cancelling resting limit order before market execution", trader=_trader_id)
+            self.remove_limit_order(_trader_id)
         
         _price: float = self.pm.get_perp_price()
         if not isinstance(_price, (float, int)) or _price <= 0:
             raise ValueError("Invalid perp price from helper")
         
-        _margin: float = (_price * _quantity) / float(_leverage)
+        with metrics.stage("quote"):
+            # size the margin from what the book will actually fill, not from the last trade
+            depth = self.ask_depth if _side == Side.BUY else self.bid_depth
+            takeable = _quantity if _worst_price is None else min(_quantity, depth.within(_worst_price)[0])
+            filled, notional, _ = depth.cost(takeable)
+            if filled <= 0:
+                raise ValueError("No book depth to execute market order" if _worst_price is None else "No book depth within worst price")
+            if _time_in_force == TimeInForce.FOK and filled < _quantity - 1e-9:
+                raise ValueError("Fill-or-kill order cannot be filled in full")
+
+        _margin: float = notional / float(_leverage)
         
         order: Order = Order(
             trader_id = _trader_id,
@@ -382,132 +760,157 @@ class OrderBook:
             status = Status.OPEN
         )
 
-        book = self.asks if order.side == Side.BUY else self.bids
-        fills = []
+        return self.take(order, _worst_price)
 
-        if not book:
-            raise ValueError("No book depth to execute market order")
+    def take(self, _order: Order, _limit_price: float | None) -> list:
+        """Runs a taker through the kernel and settles its side of the fills as one position change at the VWAP."""
+        # bump before and after the sweep so a snapshot cached mid-sweep is never reused
+        self.bump_version()
+        with metrics.stage("match"):
+            fills, total_quantity, avg_price = self.match(_order, _limit_price)
+        self.bump_version()
 
-        current_quantity: float = _quantity
-        
-        if order.side == Side.BUY:
-            to_delete_levels = []
-            for price_level in list(book.keys()):
-                order_list = book[price_level]
-                order_removal_list = []
-                for resting_order in list(order_list):
-                    current_order = resting_order
-                    if current_quantity >= current_order.quantity:
-                        fills.append(self.log_trade(current_order, current_order.quantity, order.trader_id, current_order.trader_id, order.side, order))
-                        current_quantity = current_quantity - current_order.quantity
-                        order_removal_list.append(resting_order)
-
-                        self.call_fill_limit_order(self.w3, current_order.trader_id, current_order.quantity)
-
-                        has_position = self.find_open_positions(current_order.trader_id, current_order.side)
-
-                        if has_position:
-                            self.pm.close_position(current_order.trader_id, self.asset_name, current_order.quantity, current_order.price)
-                        else:
-                            self.pm.create_position(current_order.trader_id, self.asset_name, current_order.side, current_order.price, current_order.quantity, current_order.leverage, current_order.margin)
-                    else:
-                        resting_filled_quantity = current_quantity
-                        fills.append(self.log_trade(current_order, resting_filled_quantity, order.trader_id, current_order.trader_id, order.side, order))
+        if total_quantity < _order.quantity:
+            log.info("Taker filled %s of %s, rest dropped", total_quantity, _order.quantity, trader=_order.trader_id)
+            if _order.order_type == OrderType.LIMIT:
+                # margin follows the part that traded, at the limit price; market margins already come from the quote
+                _order.margin = (_order.price * total_quantity) / float(_order.leverage)
+        _order.filled_quantity = total_quantity
 
-                        # right now for mvp, we are refunsing margin that doesn't get filled and closing out the ramining limit
-                        # current_order.quantity = current_order.quantity - current_quantity
-                        # current_order.status = Status.PARTIALLY_FILLED
+        has_opposite_position: bool = self.find_open_positions(_order.trader_id, _order.side)
 
-                        current_quantity = 0
-
-                        self.call_fill_limit_order(self.w3, current_order.trader_id, resting_filled_quantity)
-
-                        has_position = self.find_open_positions(current_order.trader_id, current_order.side)
-
-                        if has_position:
-                            self.pm.close_position(current_order.trader_id, self.asset_name, resting_filled_quantity, current_order.price)
-                        else:
-                            self.pm.create_position(current_order.trader_id, self.asset_name, current_order.side, current_order.price, resting_filled_quantity, current_order.leverage, current_order.margin)
-
-                        # used for mvp refund system
-                        order_removal_list.append(resting_order)
+        if has_opposite_position:
+            self.send_close_position(self.w3, _order.trader_id, avg_price)
 
-                    if current_quantity == 0:
-                        break
-                for removed_order in order_removal_list:
-                    order_list.remove(removed_order)
-                if not order_list:
-                    to_delete_levels.append(price_level)
-                if current_quantity == 0:
-                    break
-            for level in to_delete_levels:
-                del book[level]
+            with metrics.stage("position_update"):
+                self.pm.close_position(_order.trader_id, self.asset_name, total_quantity, avg_price)
         else:
-            to_delete_levels = []
-            for price_level in reversed(list(book.keys())):
-                order_list = book[price_level]
-                order_removal_list = []
-                for resting_order in list(order_list):
-                    current_order = resting_order
-                    if current_quantity >= current_order.quantity:
-                        fills.append(self.log_trade(current_order, current_order.quantity, order.trader_id, current_order.trader_id, order.side, order))
-                        current_quantity = current_quantity - current_order.quantity
-                        order_removal_list.append(resting_order)
-
-                        self.call_fill_limit_order(self.w3, current_order.trader_id, current_order.quantity)
-
-                        has_position = self.find_open_positions(current_order.trader_id, current_order.side)
-
-                        if has_position:
-                            self.pm.close_position(current_order.trader_id, self.asset_name, current_order.quantity, current_order.price)
-                        else:
-                            self.pm.create_position(current_order.trader_id, self.asset_name, current_order.side, current_order.price, current_order.quantity, current_order.leverage, current_order.margin)
-                    else:
-                        resting_filled_quantity = current_quantity
-                        fills.append(self.log_trade(current_order, resting_filled_quantity, order.trader_id, current_order.trader_id, order.side, order))
+            self.send_open_position(self.w3, _order.margin, _order.leverage, _order.side, _order.trader_id, avg_price)
 
-                        # right now for mvp, we are refunding margin that doesn't get filled and closing out the ramining limit
-                        # current_order.quantity = current_order.quantity - current_quantity
-                        # current_order.status = Status.PARTIALLY_FILLED
+            with metrics.stage("position_update"):
+                self.pm.create_position(_order.trader_id, self.asset_name, _order.side, avg_price, total_quantity, _order.leverage, _order.margin)
 
-                        current_quantity = 0
-
-                        self.call_fill_limit_order(self.w3, current_order.trader_id, resting_filled_quantity)
-
-                        has_position = self.find_open_positions(current_order.trader_id, current_order.side)
-
-                        if has_position:
-                            self.pm.close_position(current_order.trader_id, self.asset_name, resting_filled_quantity, current_order.price)
-                        else:
-                            self.pm.create_position(current_order.trader_id, self.asset_name, current_order.side, current_order.price, resting_filled_quantity, current_order.leverage, current_order.margin)
-
-                        # used for mvp refund system
-                        order_removal_list.append(resting_order)
-
-                    if current_quantity == 0:
-                        break
-                for removed_order in order_removal_list:
-                    order_list.remove(removed_order)
-                if not order_list:
-                    to_delete_levels.append(price_level)
-                if current_quantity == 0:
-                    break
-            for level in to_delete_levels:
-                del book[level]
-        avg_price = sum(trade.price * trade.quantity for trade in fills) / sum(trade.quantity for trade in fills)
-        total_quantity = sum(trade.quantity for trade in fills)
-
-        has_opposite_position: bool = self.find_open_positions(order.trader_id, order.side)
+        if fills:
+            # fills walk the book monotonically, so the first and last bound every price traded
+            self.run_triggers(fills[0].price, fills[-1].price)
+        return fills
 
-        if has_opposite_position:
-            self.send_close_position(self.w3, order.trader_id, avg_price)
+    def set_triggers(self, _trader_id: str, _stop_price: float | None = None, _take_profit_price: float | None = None):
+        """
+        Attaches a stop-loss and / or take-profit to the trader's open position,
+        replacing any armed before; None for both disarms. Once the book trades
+        at or through one, the engine closes the position with an IOC market order.
+        """
+        with metrics.stage("validation"):
+            position = self.pm.get_open_position(_trader_id, self.asset_name)
+            if position is None:
+                raise ValueError("No open position to attach triggers to")
+            for price in (_stop_price, _take_profit_price):
+                if price is not None and not 0 < price < 1:
+                    raise ValueError("Trigger price must be between 0 and 1")
+            if _stop_price is not None and _take_profit_price is not None:
+                if position.side == Side.BUY and _stop_price >= _take_profit_price:
+                    raise ValueError("A long's stop must be below its take-profit")
+                if position.side == Side.SELL and _stop_price <= _take_profit_price:
+                    raise ValueError("A short's stop must be above its take-profit")
+
+        self.triggers.disarm(_trader_id)
+        for kind, price in ((TriggerKind.STOP, _stop_price), (TriggerKind.TAKE_PROFIT, _take_profit_price)):
+            if price is not None:
+                self.triggers.arm(_trader_id, position.position_id, position.side, kind, price)
+        position.stop_price = _stop_price
+        position.take_profit_price = _take_profit_price
+        log.info("Triggers set on position %s", position.position_id, trader=_trader_id, stop=_stop_price, take_profit=_take_profit_price)
+        return position
+
+    def run_triggers(self, _first_price: float, _last_price: float):
+        """
+        Fires the triggers crossed by trades between the two prices. Their market
+        closes trade too and can cross more triggers; those are queued and run by
+        the outermost call, so a cascade is a loop, not a recursion.
+        """
+        with metrics.stage("triggers"):
+            self.triggers_due.extend(self.triggers.fired(min(_first_price, _last_price), max(_first_price, _last_price)))
+        if self.firing_triggers:
+            return
+        self.firing_triggers = True
+        try:
+            while self.triggers_due:
+                trader_id, kind, position_id, price = self.triggers_due.popleft()
+                position = self.pm.get_open_position(trader_id, self.asset_name)
+                if position is None or position.position_id != position_id:
+                    # closed some other way since it was armed
+                    continue
+                log.info("%s trigger at %s fired", kind.value, price, trader=trader_id, position=position_id)
+                close_side = Side.SELL if position.side == Side.BUY else Side.BUY
+                try:
+                    self.market_order(trader_id, close_side, position.quantity, position.leverage)
+                except ValueError as exc:
+                    log.warning("Triggered close failed: %s", exc, trader=trader_id, position=position_id)
+
+                if position.status == Status.OPEN:
+                    # not (fully) closed, stay armed for the next trade through the price
+                    self.triggers.arm(trader_id, position_id, position.side, kind, price)
+                else:
+                    self.triggers.disarm(trader_id)
+                    position.stop_price = position.take_profit_price = None
+        finally:
+            self.firing_triggers = False
 
-            self.pm.close_position(order.trader_id, self.asset_name, total_quantity, avg_price)
-        else:
-            self.send_open_position(self.w3, order.margin, order.leverage, order.side, order.trader_id, avg_price)
+    def apply_batch(self, _commands: list) -> list:
+        """
+        Applies a list of limit / market / replace / cancel commands in order and
+        returns one result per command. A failing command does not stop the batch.
+        """
+        results = []
+        for index, command in enumerate(_commands):
+            try:
+                command_type = command["type"]
+                trader_id = command["trader_address"]
+                self.pm.create_account(trader_id)
+
+                if command_type == "limit":
+                    fills = self.add_limit_order(
+                        _trader_id=trader_id,
+                        _side=Side.BUY if command["direction"].lower() == "buy" else Side.SELL,
+                        _price=command["price"],
+                        _quantity=command["quantity"],
+                        _leverage=command["leverage"],
+                        _time_in_force=TimeInForce(command.get("time_in_force", "gtc")),
+                        _expires_at=command.get("expires_at")
+                    )
+                    result = {"index": index, "status": "ok", "order_id": self.order_id}
+                    if fills:
+                        result["trade_ids"] = [t.trade_id for t in fills]
+                    results.append(result)
+                elif command_type == "market":
+                    fills = self.market_order(
+                        _trader_id=trader_id,
+                        _side=Side.BUY if command["direction"].lower() == "buy" else Side.SELL,
+                        _quantity=command["quantity"],
+                        _leverage=command["leverage"],
+                        _worst_price=command.get("worst_price"),
+                        _time_in_force=TimeInForce(command.get("time_in_force", "ioc"))
+                    )
+                    results.append({"index": index, "status": "ok", "trade_ids": [t.trade_id for t in fills]})
+                elif command_type == "replace":
+                    order = self.replace_limit_order(
+                        _trader_id=trader_id,
+                        _price=command["price"],
+                        _quantity=command["quantity"]
+                    )
+                    results.append({"index": index, "status": "ok", "order_id": order.order_id})
+                elif command_type == "cancel":
+                    self.remove_limit_order(_trader_id=trader_id)
+                    results.append({"index": index, "status": "ok"})
+                else:
+                    raise ValueError(f"Unknown command type: {command_type}")
+            except KeyError as exc:
+                results.append({"index": index, "status": "error", "error": f"Missing field: {exc.args[0]}"})
+            except ValueError as exc:
+                results.append({"index": index, "status": "error", "error": str(exc)})
+        return results
 
-            self.pm.create_position(order.trader_id, self.asset_name, order.side, avg_price, total_quantity, order.leverage, order.margin)
-    
     def find_open_positions(self, _address: str, _order_side: Side) -> bool:
         account = self.pm.accounts.get(_address)
         if account is None:
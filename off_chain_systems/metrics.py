@@ -0,0 +1,262 @@
+import functools
+import os
+import threading
+from bisect import bisect_left
+from time import perf_counter_ns
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+
+# seconds, from 50us (pure matching) up to 10s (receipt waits on a slow chain)
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _HistogramChild:
+    __slots__ = ("_bounds_ns", "_counts", "_sum_ns", "_lock")
+
+    def __init__(self, bounds_ns: list):
+        self._bounds_ns = bounds_ns
+        self._counts = [0] * (len(bounds_ns) + 1)
+        self._sum_ns = 0
+        self._lock = threading.Lock()
+
+    def observe_ns(self, _elapsed_ns: int):
+        index = bisect_left(self._bounds_ns, _elapsed_ns)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum_ns += _elapsed_ns
+
+    def observe(self, _seconds: float):
+        self.observe_ns(int(_seconds * 1e9))
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return list(self._counts), self._sum_ns
+
+class Histogram:
+    def __init__(self, _name: str, _help: str, _labelnames: tuple = (), _buckets: tuple = DEFAULT_BUCKETS):
+        self.name = _name
+        self.help = _help
+        self.labelnames = _labelnames
+        self.buckets = _buckets
+        self._bounds_ns = [int(b * 1e9) for b in _buckets]
+        self._children: dict = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *_values) -> _HistogramChild:
+        child = self._children.get(_values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(_values, _HistogramChild(self._bounds_ns))
+        return child
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, child in sorted(self._children.items()):
+            counts, sum_ns = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + str(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {sum_ns / 1e9}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, _amount: int = 1):
+        with self._lock:
+            self.value += _amount
+
+class Counter:
+    def __init__(self, _name: str, _help: str, _labelnames: tuple = ()):
+        self.name = _name
+        self.help = _help
+        self.labelnames = _labelnames
+        self._children: dict = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *_values) -> _CounterChild:
+        child = self._children.get(_values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(_values, _CounterChild())
+        return child
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, child in sorted(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, _metric):
+        self.metrics.append(_metric)
+        return _metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+ORDER_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "tachyon_order_stage_seconds",
+    "Exclusive time spent in each stage of the order path.",
+    ("stage",)
+))
+ORDER_SECONDS = REGISTRY.register(Histogram(
+    "tachyon_order_seconds",
+    "End-to-end engine latency per order type.",
+    ("type",)
+))
+ORDERS_TOTAL = REGISTRY.register(Counter(
+    "tachyon_orders_total",
+    "Orders processed by the engine, by type and outcome.",
+    ("type", "outcome")
+))
+REQUESTS_REJECTED = REGISTRY.register(Counter(
+    "tachyon_requests_rejected_total",
+    "Order API requests turned away before reaching the engine, by endpoint and reason.",
+    ("endpoint", "reason")
+))
+ENGINE_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "tachyon_engine_queue_seconds",
+    "Time an API command waits in the engine queue before it runs."
+))
+TX_SUBMIT_SECONDS = REGISTRY.register(Histogram(
+    "tachyon_tx_submit_seconds",
+    "Time from scheduling a hot-wallet transaction to the node accepting it, by priority class.",
+    ("priority",)
+))
+
+# ------------------------------------------------------------------
+#                            TIMERS
+# ------------------------------------------------------------------
+class _Local(threading.local):
+    def __init__(self):
+        # one [start_ns, nested_ns] frame per open stage on this thread
+        self.stack = []
+        # orders nest too (market_order cancels the taker's resting limit first)
+        self.order_starts = []
+
+_local = _Local()
+
+class StageTimer:
+    """
+    Context manager recording exclusive time: time spent in a nested stage
+    (e.g. a fill's send/receipt inside the match loop) is not counted twice.
+    """
+    __slots__ = ("_child",)
+
+    def __init__(self, _child: _HistogramChild):
+        self._child = _child
+
+    def __enter__(self):
+        _local.stack.append([perf_counter_ns(), 0])
+        return self
+
+    def __exit__(self, *_exc):
+        stack = _local.stack
+        start, nested_ns = stack.pop()
+        elapsed_ns = perf_counter_ns() - start
+        if stack:
+            stack[-1][1] += elapsed_ns
+        self._child.observe_ns(elapsed_ns - nested_ns)
+        return False
+
+class OrderTimer:
+    """Context manager for end-to-end order latency plus an outcome counter."""
+    __slots__ = ("_child", "_ok", "_rejected", "_error")
+
+    def __init__(self, _order_type: str):
+        self._child = ORDER_SECONDS.labels(_order_type)
+        self._ok = ORDERS_TOTAL.labels(_order_type, "ok")
+        self._rejected = ORDERS_TOTAL.labels(_order_type, "rejected")
+        self._error = ORDERS_TOTAL.labels(_order_type, "error")
+
+    def __enter__(self):
+        _local.order_starts.append(perf_counter_ns())
+        return self
+
+    def __exit__(self, exc_type, *_exc):
+        self._child.observe_ns(perf_counter_ns() - _local.order_starts.pop())
+        if exc_type is None:
+            self._ok.inc()
+        elif issubclass(exc_type, ValueError):
+            self._rejected.inc()
+        else:
+            self._error.inc()
+        return False
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+_NOOP = _NoopTimer()
+_stage_timers: dict = {}
+_order_timers: dict = {}
+
+def stage(_name: str):
+    if not METRICS_ENABLED:
+        return _NOOP
+    timer = _stage_timers.get(_name)
+    if timer is None:
+        timer = _stage_timers[_name] = StageTimer(ORDER_STAGE_SECONDS.labels(_name))
+    return timer
+
+def order(_order_type: str):
+    if not METRICS_ENABLED:
+        return _NOOP
+    timer = _order_timers.get(_order_type)
+    if timer is None:
+        timer = _order_timers[_order_type] = OrderTimer(_order_type)
+    return timer
+
+def rejected(_endpoint: str, _reason: str):
+    if METRICS_ENABLED:
+        REQUESTS_REJECTED.labels(_endpoint, _reason).inc()
+
+def observe_queue_wait(_seconds: float):
+    if METRICS_ENABLED:
+        ENGINE_QUEUE_SECONDS.labels().observe(_seconds)
+
+def observe_tx_submit(_priority: str, _seconds: float):
+    if METRICS_ENABLED:
+        TX_SUBMIT_SECONDS.labels(_priority).observe(_seconds)
+
+def timed_order(_order_type: str):
+    """Decorator form of order(), so engine entry points don't need re-indenting."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with order(_order_type):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,13 +1,19 @@
 import os
+import threading
 import time
 from web3 import Web3
 from dataclasses import dataclass
 from dotenv import load_dotenv
 from enum import Enum
 import json
+from off_chain_systems.log import get_logger
+from off_chain_systems.tx_scheduler import TxScheduler, TxPriority
+from off_chain_systems.receipt_tracker import ReceiptTracker
 
 load_dotenv()
 
+log = get_logger("position_manager")
+
 PRIVATE_KEY = os.environ.get('PRIVATE_KEY')
 RPC_URL = os.environ.get('RPC_URL')
 ORACLE_ADDRESS = os.environ.get('ORACLE_ADDRESS')
@@ -16,6 +22,8 @@ PERPS_ADDRESS = os.environ.get('PERPS_ADDRESS')
 PERPS_ABI = json.loads(os.environ.get('PERPS_ABI'))
 PRICE_SCALE = 10**6
 FUNDING_SCALE = 10**18
+# perps_contract.vy caps a single funding integration at one day
+MAX_ELAPSED = 86400
 
 class Side(Enum):
     BUY = "buy"
@@ -52,6 +60,14 @@ class Position:
     status: Status
     open_timestamp: float
     close_timestamp: float
+    # funding index when the position opened, same units as the contract's
+    funding_index_snapshot: int = 0
+    # block of the PositionOpened this position was matched to (or the block it was
+    # mirrored from), None until the chain has confirmed it
+    open_block: int | None = None
+    # armed trigger prices, the engine closes the position at market once the book trades through one
+    stop_price: float | None = None
+    take_profit_price: float | None = None
 
 @dataclass
 class Order:
@@ -79,16 +95,81 @@ class Trade:
     taker_fee: float
     maker_fee: float
 
+class FundingIndex:
+    """
+    Off-chain mirror of the perps contract's funding accumulator. The index only
+    moves by rate * elapsed, so with the rate known it is integrated locally
+    exactly as _integrate_funding does (whole seconds, capped at MAX_ELAPSED),
+    and a position's funding impact is O(1) from its snapshot with no RPC.
+    The rate comes from the funding service as it pushes it, and load_funding()
+    reseeds everything from chain.
+    """
+    def __init__(self, _index: int = 0, _rate_per_second: int = 0, _last_timestamp: int | None = None):
+        self.index = _index
+        self.rate_per_second = _rate_per_second
+        self.last_timestamp = int(time.time()) if _last_timestamp is None else _last_timestamp
+        self._lock = threading.Lock()
+
+    def _accrued(self, _now: int) -> int:
+        elapsed = min(max(_now - self.last_timestamp, 0), MAX_ELAPSED)
+        return self.index + self.rate_per_second * elapsed
+
+    def value(self, _now: float | None = None) -> int:
+        """Index as the contract would have it after integrating at _now."""
+        with self._lock:
+            return self._accrued(int(time.time() if _now is None else _now))
+
+    def integrate(self, _now: float | None = None) -> int:
+        """Mirrors _integrate_funding, for the calls that run it on chain (open, close, update_funding)."""
+        now = int(time.time() if _now is None else _now)
+        with self._lock:
+            if now > self.last_timestamp:
+                self.index = self._accrued(now)
+                self.last_timestamp = now
+            return self.index
+
+    def set_rate(self, _rate_per_second: int, _now: float | None = None):
+        """Mirrors update_funding."""
+        now = int(time.time() if _now is None else _now)
+        with self._lock:
+            if now > self.last_timestamp:
+                self.index = self._accrued(now)
+                self.last_timestamp = now
+            self.rate_per_second = _rate_per_second
+
+    def reset(self, _index: int, _rate_per_second: int, _last_timestamp: int):
+        with self._lock:
+            self.index = _index
+            self.rate_per_second = _rate_per_second
+            self.last_timestamp = _last_timestamp
+
 class PositionManager:
     def __init__(self, orderbook=None):
         self.accounts = {}
         self.position_id: int = 0
         self.orderbook = orderbook
+        self.funding = FundingIndex()
         self.w3 = Web3(Web3.HTTPProvider(RPC_URL))
         if not self.w3.is_connected():
             raise ValueError("Could not connect to specified RPC URL")
         account = self.w3.eth.account.from_key(PRIVATE_KEY)
         self.w3.eth.default_account = account.address
+        # every hot-wallet transaction of this process goes through here, see TxScheduler
+        self.receipts = ReceiptTracker(self.w3)
+        self.tx_scheduler = TxScheduler(self.w3, PRIVATE_KEY, self.receipts)
+
+    def load_funding(self):
+        """Seeds the funding mirror from chain, three eth_calls at startup."""
+        contract = self.w3.eth.contract(address=PERPS_ADDRESS, abi=PERPS_ABI)
+        self.funding.reset(
+            contract.functions.funding_index().call(),
+            contract.functions.funding_rate_per_second().call(),
+            contract.functions.last_funding_timestamp().call()
+        )
+        log.info(
+            "Funding index loaded", funding_index=self.funding.index,
+            rate_per_second=self.funding.rate_per_second, last_timestamp=self.funding.last_timestamp
+        )
 
     def increment_position_id(self) -> int:
         self.position_id += 1
@@ -102,7 +183,8 @@ class PositionManager:
 
         return converted_price
     
-    def get_perp_price(self) -> float:
+    def get_perp_price(self, _oracle_price: float | None = None) -> float:
+        """Last trade, else book mid, else the oracle (`_oracle_price` if the caller already read it)."""
         if self.orderbook:
             if len(self.orderbook.trade_events) > 0:
                 return self. orderbook.trade_events[-1].price
@@ -113,6 +195,8 @@ class PositionManager:
         if best_bid and best_ask:
             return (best_bid + best_ask) / 2
         
+        if _oracle_price is not None:
+            return _oracle_price
         return self.get_oracle_price()
     
     def create_account(self, _address):
@@ -121,7 +205,7 @@ class PositionManager:
                 account_id = _address,
                 positions = []
             )
-            print(f"Account created for {_address}")
+            log.debug("Account created for %s", _address, trader=_address)
     
     def create_position(self, _trader_id: str, _asset_name: str, _side: Side, _entry_price: float, _quantity: float, _leverage: int, _margin: float):
 
@@ -143,11 +227,44 @@ class PositionManager:
             funding_paid = 0,
             status = Status.OPEN,
             open_timestamp = time.time(),
-            close_timestamp = 0
+            close_timestamp = 0,
+            funding_index_snapshot = self.funding.integrate()
         )
 
         self.accounts[_trader_id].positions.append(taker_position)
-        print(f"Position created for {_trader_id}: {taker_position.market_id}, {_side}, qty={_quantity}, avg_price={_entry_price}")
+        log.info(
+            "Position %s opened for %s", taker_position.position_id, _trader_id,
+            market=taker_position.market_id, side=_side, quantity=_quantity, entry_price=_entry_price
+        )
+        return taker_position
+
+    def create_position_from_chain(
+            self,
+            _trader_id: str,
+            _market_id: str,
+            _margin: int,
+            _leverage: int,
+            _entry_price: int,
+            _direction: bool,
+            _funding_index_snapshot: int,
+            _block: int | None = None
+    ) -> Position:
+        """Mirrors a position that exists on chain but not here, from its contract-unit fields."""
+        margin = _margin / PRICE_SCALE
+        entry_price = _entry_price / PRICE_SCALE
+        side = Side.BUY if _direction else Side.SELL
+        # the contract only keeps size = margin * leverage, quantity is notional / entry
+        quantity = margin * _leverage / entry_price
+        position = self.create_position(_trader_id, _market_id, side, entry_price, quantity, _leverage, margin)
+        position.funding_index_snapshot = _funding_index_snapshot
+        position.open_block = _block
+        return position
+
+    def get_open_position(self, _trader_id: str, _market_id: str) -> Position | None:
+        account = self.accounts.get(_trader_id)
+        if account is None:
+            return None
+        return next((p for p in account.positions if p.market_id == _market_id and p.status == Status.OPEN), None)
 
     def update_pnl(self, _position: Position):
         if _position.status != Status.OPEN:
@@ -164,8 +281,18 @@ class PositionManager:
         notional = _position.leverage * _position.margin
         pnl = notional * price_change_percentage
 
-        _position.unrealized_pnl = pnl
+        # equity is margin + pnl - funding on chain, so unrealized pnl is net of funding
+        _position.funding_paid = self.funding_impact(_position)
+        _position.unrealized_pnl = pnl - _position.funding_paid
         return pnl
+
+    def funding_impact(self, _position: Position, _now: float | None = None) -> float:
+        """_get_funding_impact: funding owed by the position since it opened, negative when it is owed funding."""
+        delta_index = self.funding.value(_now) - _position.funding_index_snapshot
+        impact = _position.margin * _position.leverage * delta_index / FUNDING_SCALE
+        if _position.side == Side.BUY:
+            impact = -impact
+        return impact
     
     def close_position(self, _trader_id: str, _market_id: str, _quantity: float, _close_price: float):
         if _trader_id not in self.accounts:
@@ -183,6 +310,13 @@ class PositionManager:
         else:
             pnl = (position.entry_price - _close_price) * position.margin * position.leverage
 
+        # realise funding on the closed share and move the snapshot so the rest keeps accruing
+        closed_share = min(_quantity / position.quantity, 1) if position.quantity else 1
+        funding_index = self.funding.integrate()
+        funding = self.funding_impact(position) * closed_share
+        position.funding_index_snapshot += int((funding_index - position.funding_index_snapshot) * closed_share)
+        pnl -= funding
+
         position.realized_pnl += pnl
 
         if _quantity < position.quantity:
@@ -196,51 +330,68 @@ class PositionManager:
         
         return pnl
     
-    def liquidate_position(self, _address: str) -> bool:
+    def liquidate_position(self, _address: str, _submit=None) -> bool:
         contract = self.w3.eth.contract(address=PERPS_ADDRESS, abi=PERPS_ABI)
 
         try:
             account = self.w3.eth.account.from_key(PRIVATE_KEY)
 
             tx = contract.functions.liquidate(_address).build_transaction({
-                "from": account,
-                "nonce": self.w3.eth.get_transaction_count(account),
+                "from": account.address,
                 "gas": 300000,
                 "gasPrice": self.w3.to_wei(1, "gwei")
             })
 
-            signed_tx = self.w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+            receipt = self.tx_scheduler.send(TxPriority.LIQUIDATION, tx)
 
-            if _address in self.accounts:
-                for p in self.accounts[_address].positions:
-                    if p.status == Status.OPEN:
-                        p.status = Status.LIQUIDATED
-                        p.close_timestamp = time.time()
-                        print(f"Position {p.position_id} liquidated at {p.close_timestamp}")
+            if _submit is None:
+                self.mark_liquidated(_address)
+            else:
+                _submit(self.mark_liquidated, _address)
 
             return receipt.status == 1
 
         except Exception as e:
-            print(f"Liquidation failed for {_address}: {e}")
+            log.error("Liquidation failed for %s: %s", _address, e, trader=_address)
             return False
         
+    def mark_liquidated(self, _address: str, _position: Position | None = None):
+        """Marks _position liquidated, or every open position of _address when it is None."""
+        if _address in self.accounts:
+            for p in self.accounts[_address].positions:
+                if p.status == Status.OPEN and (_position is None or p is _position):
+                    p.status = Status.LIQUIDATED
+                    p.close_timestamp = time.time()
+                    log.warning("Position %s liquidated", p.position_id, trader=_address, close_timestamp=p.close_timestamp)
+
     def get_funding_rate(self) -> float:
         contract = self.w3.eth.contract(address=PERPS_ADDRESS, abi=PERPS_ABI)
         raw = contract.functions.funding_rate_per_second().call()
         return raw / FUNDING_SCALE
 
         
-    def management_loop(self):
+    def liquidation_candidates(self) -> list:
+        """Refreshes the PnL of every open position, returns the traders past the liquidation threshold."""
+        due = []
+        for account in self.accounts.values():
+            for position in account.positions:
+                if position.status == Status.OPEN:
+                    try:
+                        self.update_pnl(position)
+                        if position.unrealized_pnl / position.margin < -0.8:
+                            due.append(position.account_id)
+                    except Exception as e:
+                        log.exception("Error processing %s", position.account_id, trader=position.account_id)
+        return due
+
+    def management_loop(self, _submit=None):
+        """
+        Liquidates positions past the threshold every 5 s. _submit, when given,
+        runs the scan and the bookkeeping on the engine's thread (the server's
+        queue), the liquidation transactions are sent from this one.
+        """
         while True:
-            for account in self.accounts.values():
-                for position in account.positions:
-                    if position.status == Status.OPEN:
-                        try:
-                            self.update_pnl(position)
-                            if position.unrealized_pnl / position.margin < -0.8:
-                                self.liquidate_position(position.account_id)
-                        except Exception as e:
-                            print(f"Error processing {position.account_id}: {e}")
-            time.sleep(5)
\ No newline at end of file
+            due = self.liquidation_candidates() if _submit is None else _submit(self.liquidation_candidates)
+            for address in due:
+                self.liquidate_position(address, _submit)
+            time.sleep(5)
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from collections import deque
+from itertools import chain
+
+# seconds of history the funding premium is averaged over
+PREMIUM_WINDOW = float(os.environ.get('PREMIUM_WINDOW', 3600))
+# ticks closer together than this share one segment, bounding memory at window / resolution
+PREMIUM_RESOLUTION = float(os.environ.get('PREMIUM_RESOLUTION', 1.0))
+
+class PremiumIndex:
+    """
+    Time-weighted average of the premium (perp - oracle) / oracle over a sliding
+    window. The premium is piecewise constant between ticks, so every trade or
+    oracle tick closes one (start, end, premium) segment and adds its area to a
+    running sum; segments that slide out of the window are subtracted from the
+    left. Both are O(1) amortised, and twap() never walks history: only the
+    oldest segment can straddle the window edge and it is trimmed arithmetically.
+    Ticks within `resolution` of a segment's start are folded into it as a
+    time-weighted average, so a busy book doesn't grow the deque per trade.
+    Thread-safe, trades and the funding loop feed it from different threads.
+    """
+    def __init__(self, _window: float = PREMIUM_WINDOW, _resolution: float = PREMIUM_RESOLUTION):
+        self.window = _window
+        self.resolution = _resolution
+        self.perp_price: float | None = None
+        self.oracle_price: float | None = None
+        # premium in force since last_time, None until both prices are known
+        self.premium: float | None = None
+        self.last_time: float | None = None
+        # closed (start, end, premium) segments, oldest first
+        self.segments: deque = deque()
+        self.area: float = 0.0
+        self.covered: float = 0.0
+        self._lock = threading.Lock()
+
+    def _advance(self, _now: float) -> float:
+        """Closes the running segment at _now (clamped to never go back) and evicts expired segments."""
+        if self.last_time is not None and _now < self.last_time:
+            _now = self.last_time
+        if self.premium is not None and self.last_time is not None and _now > self.last_time:
+            elapsed = _now - self.last_time
+            tail = self.segments[-1] if self.segments else None
+            if tail is not None and tail[1] == self.last_time and (
+                    tail[2] == self.premium or _now - tail[0] <= self.resolution):
+                # same premium, or still inside the tail's bucket: extend it instead of appending
+                premium = self.premium
+                if tail[2] != premium:
+                    premium = (tail[2] * (tail[1] - tail[0]) + premium * elapsed) / (_now - tail[0])
+                self.segments[-1] = (tail[0], _now, premium)
+            else:
+                self.segments.append((self.last_time, _now, self.premium))
+            self.area += self.premium * elapsed
+            self.covered += elapsed
+        self.last_time = _now
+
+        cutoff = _now - self.window
+        while self.segments and self.segments[0][1] <= cutoff:
+            start, end, premium = self.segments.popleft()
+            self.area -= premium * (end - start)
+            self.covered -= end - start
+        if not self.segments:
+            # nothing left to drift against, start the sums clean
+            self.area = self.covered = 0.0
+        return _now
+
+    def _reprice(self):
+        if self.perp_price is not None and self.oracle_price:
+            self.premium = (self.perp_price - self.oracle_price) / self.oracle_price
+        else:
+            self.premium = None
+
+    def update_perp(self, _price: float, _timestamp: float | None = None):
+        with self._lock:
+            self._advance(time.time() if _timestamp is None else _timestamp)
+            self.perp_price = _price
+            self._reprice()
+
+    def update_oracle(self, _price: float, _timestamp: float | None = None):
+        with self._lock:
+            self._advance(time.time() if _timestamp is None else _timestamp)
+            self.oracle_price = _price
+            self._reprice()
+
+    def record_trade(self, _trade):
+        """OrderBook trade listener."""
+        self.update_perp(_trade.price, _trade.timestamp)
+
+    def twap(self, _now: float | None = None) -> float | None:
+        """Average premium over the last `window` seconds, the current one if no time has passed yet."""
+        with self._lock:
+            now = self._advance(time.time() if _now is None else _now)
+            if not self.segments:
+                return self.premium
+
+            start, _, premium = self.segments[0]
+            overhang = max(now - self.window - start, 0.0)
+            covered = self.covered - overhang
+            if covered <= 0:
+                return self.premium
+            return (self.area - premium * overhang) / covered
+
+    def peek(self, _now: float | None = None) -> float | None:
+        """
+        twap() without moving the index: the running segment and expired ones
+        are accounted for on the side, so readers (GET /prices) can look as
+        often as they like without closing segments or advancing the clock.
+        """
+        with self._lock:
+            now = time.time() if _now is None else _now
+            if self.last_time is not None and now < self.last_time:
+                now = self.last_time
+            area, covered = self.area, self.covered
+            running = []
+            if self.premium is not None and self.last_time is not None and now > self.last_time:
+                running = [(self.last_time, now, self.premium)]
+                area += self.premium * (now - self.last_time)
+                covered += now - self.last_time
+
+            cutoff = now - self.window
+            for start, end, premium in chain(self.segments, running):
+                if end > cutoff:
+                    break
+                area -= premium * (end - start)
+                covered -= end - start
+            else:
+                return self.premium
+
+            overhang = max(cutoff - start, 0.0)
+            covered -= overhang
+            if covered <= 0:
+                return self.premium
+            return (area - premium * overhang) / covered
@@ -0,0 +1,255 @@
+import math
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# price grid of the book, every tick has to land on the contract's 1e-6 PRICE_SCALE grid
+TICK_SIZE = float(os.environ.get('TICK_SIZE', 0.001))
+PRICE_SCALE = 10**6
+
+class TickLadder:
+    """
+    One side of the book as a preallocated array of price levels indexed by tick,
+    for prices in the open interval (0, 1). Level access is a list index, prices
+    map to ticks through a small cache so the float arithmetic runs once per
+    price. The lowest and highest non-empty ticks (best ask, best bid) are kept
+    as ints; when one of them empties, the next non-empty tick comes from an int
+    bitmap with one bit per non-empty tick (bit_length() of the masked bitmap)
+    instead of walking the array. Bits only flip when a level appears or
+    empties, orders joining or leaving a live level never touch the bitmap.
+
+    Speaks the subset of the SortedDict interface the book uses (get, in, [],
+    del, len, peekitem, keys / values / items in ascending price). Prices off
+    the tick grid raise ValueError.
+    """
+    __slots__ = ("tick_size", "ticks", "levels", "prices", "tick_cache", "bitmap", "count", "low", "high")
+
+    def __init__(self, _tick_size: float = TICK_SIZE):
+        ticks = round(1 / _tick_size)
+        if ticks < 2 or PRICE_SCALE % ticks or abs(ticks * _tick_size - 1) > 1e-9:
+            raise ValueError(f"Tick size {_tick_size} must divide 1 into a divisor of {PRICE_SCALE} ticks")
+        self.tick_size = _tick_size
+        self.ticks = ticks
+        self.levels: list = [None] * ticks
+        # every tick is a whole number of PRICE_SCALE units, rounding only strips float noise
+        self.prices: list = [round(tick / ticks, 6) for tick in range(ticks)]
+        # price as given -> tick, only ever holds prices that passed the grid check
+        self.tick_cache: dict = {}
+        self.bitmap: int = 0
+        self.count: int = 0
+        # lowest / highest non-empty tick, meaningless while count == 0
+        self.low: int = 0
+        self.high: int = 0
+
+    def tick(self, _price: float) -> int:
+        tick = self.tick_cache.get(_price)
+        if tick is not None:
+            return tick
+        tick = round(_price * self.ticks)
+        if abs(_price * self.ticks - tick) > 1e-6:
+            raise ValueError(f"Price {_price} is not on the {self.tick_size} tick grid")
+        if not 0 < tick < self.ticks:
+            raise ValueError(f"Price {_price} is outside (0, 1)")
+        self.tick_cache[_price] = tick
+        return tick
+
+    def price(self, _tick: int) -> float:
+        return self.prices[_tick]
+
+    def get(self, _price: float, _default=None):
+        tick = self.tick_cache.get(_price)
+        level = self.levels[self.tick(_price) if tick is None else tick]
+        return _default if level is None else level
+
+    def __getitem__(self, _price: float):
+        level = self.levels[self.tick(_price)]
+        if level is None:
+            raise KeyError(_price)
+        return level
+
+    def __setitem__(self, _price: float, _level):
+        tick = self.tick(_price)
+        if self.levels[tick] is None:
+            self.bitmap |= 1 << tick
+            if not self.count:
+                self.low = self.high = tick
+            elif tick < self.low:
+                self.low = tick
+            elif tick > self.high:
+                self.high = tick
+            self.count += 1
+        self.levels[tick] = _level
+
+    def __delitem__(self, _price: float):
+        tick = self.tick(_price)
+        if self.levels[tick] is None:
+            raise KeyError(_price)
+        self.levels[tick] = None
+        self.bitmap ^= 1 << tick
+        self.count -= 1
+        if not self.count:
+            return
+        if tick == self.high:
+            self.high = self.bitmap.bit_length() - 1
+        elif tick == self.low:
+            # lowest set bit above the old low
+            above = self.bitmap >> tick
+            self.low = tick + (above & -above).bit_length() - 1
+
+    def __contains__(self, _price: float) -> bool:
+        try:
+            return self.levels[self.tick(_price)] is not None
+        except ValueError:
+            return False
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def _ticks(self) -> list:
+        ticks, bitmap = [], self.bitmap
+        while bitmap:
+            low = bitmap & -bitmap
+            ticks.append(low.bit_length() - 1)
+            bitmap ^= low
+        return ticks
+
+    def peekitem(self, _index: int = -1) -> tuple:
+        """(price, level) of the lowest (0) or highest (-1) non-empty tick."""
+        if not self.count:
+            raise IndexError("peekitem on an empty ladder")
+        if _index == 0:
+            tick = self.low
+        elif _index == -1:
+            tick = self.high
+        else:
+            tick = self._ticks()[_index]
+        return self.prices[tick], self.levels[tick]
+
+    def keys(self) -> list:
+        return [self.prices[tick] for tick in self._ticks()]
+
+    def values(self) -> list:
+        return [self.levels[tick] for tick in self._ticks()]
+
+    def items(self) -> list:
+        return [(self.prices[tick], self.levels[tick]) for tick in self._ticks()]
+
+class DepthIndex:
+    """
+    Resting quantity and notional per tick of one side of the book, as two
+    Fenwick trees ordered best price first: ascending ticks for asks, descending
+    for bids. Every prefix is then "the best k ticks", so the size resting up to
+    a price and the cost of taking a quantity off the top (one binary-lifting
+    descent) are both O(log ticks), however many levels are live.
+
+    The book feeds it every quantity change of a resting order; it never looks
+    at the orders. Changes are netted per tick in a dict and folded into the
+    trees on the next query, so flow that rests and cancels between quotes
+    costs a dict update, not two tree walks. Sums are floats, so an emptied
+    side can carry a residue around 1e-12, far below any order size.
+    Queries write too (the flush), so only the thread that runs the engine
+    may read it; the server sends quotes through its engine queue.
+    """
+    __slots__ = ("ladder", "descending", "size", "quantity_tree", "notional_tree", "top_step", "pending")
+
+    def __init__(self, _ladder: TickLadder, _descending: bool):
+        self.ladder = _ladder
+        self.descending = _descending
+        # Fenwick index i in 1..size is tick i for asks, tick (ticks - i) for bids
+        self.size = _ladder.ticks - 1
+        self.quantity_tree: list = [0.0] * (self.size + 1)
+        self.notional_tree: list = [0.0] * (self.size + 1)
+        self.top_step = 1 << (self.size.bit_length() - 1)
+        # tick -> net quantity change not yet in the trees
+        self.pending: dict = {}
+
+    def _index(self, _tick: int) -> int:
+        return self.ladder.ticks - _tick if self.descending else _tick
+
+    def _price(self, _index: int) -> float:
+        return self.ladder.prices[self.ladder.ticks - _index if self.descending else _index]
+
+    def add(self, _price: float, _quantity: float):
+        """Adds (or with a negative _quantity removes) resting size at _price."""
+        tick = self.ladder.tick(_price)
+        pending = self.pending
+        pending[tick] = pending.get(tick, 0.0) + _quantity
+
+    def _flush(self):
+        quantity_tree, notional_tree, size, prices = self.quantity_tree, self.notional_tree, self.size, self.ladder.prices
+        for tick, quantity in self.pending.items():
+            if not quantity:
+                continue
+            index = self._index(tick)
+            notional = quantity * prices[tick]
+            while index <= size:
+                quantity_tree[index] += quantity
+                notional_tree[index] += notional
+                index += index & -index
+        self.pending.clear()
+
+    def _prefix(self, _index: int) -> tuple[float, float]:
+        if self.pending:
+            self._flush()
+        quantity = notional = 0.0
+        while _index > 0:
+            quantity += self.quantity_tree[_index]
+            notional += self.notional_tree[_index]
+            _index -= _index & -_index
+        return quantity, notional
+
+    def total(self) -> float:
+        return self._prefix(self.size)[0]
+
+    def within(self, _limit_price: float) -> tuple[float, float]:
+        """(quantity, notional) resting at prices no worse than _limit_price, which need not be on the grid."""
+        ticks = self.ladder.ticks
+        # snap inward to the last tick the taker still accepts, the epsilon keeps 0.3 * 1000 on tick 300
+        if self.descending:
+            index = ticks - max(math.ceil(_limit_price * ticks - 1e-9), 1)
+        else:
+            index = math.floor(_limit_price * ticks + 1e-9)
+        return self._prefix(min(max(index, 0), self.size))
+
+    def cost(self, _quantity: float) -> tuple[float, float, float]:
+        """
+        (filled, notional, worst price) of taking _quantity from the best level
+        down. filled falls short of _quantity only when the side is too thin;
+        worst price is None on an empty side.
+        """
+        if self.pending:
+            self._flush()
+        index = 0
+        remaining = _quantity
+        notional = 0.0
+        quantity_tree, notional_tree, size = self.quantity_tree, self.notional_tree, self.size
+        step = self.top_step
+        # largest prefix that still leaves something to fill
+        while step:
+            candidate = index + step
+            if candidate <= size and quantity_tree[candidate] < remaining:
+                index = candidate
+                remaining -= quantity_tree[candidate]
+                notional += notional_tree[candidate]
+            step >>= 1
+        if index < size:
+            price = self._price(index + 1)
+            return _quantity, notional + remaining * price, price
+        # the whole side is not enough, take all of it
+        filled = _quantity - remaining
+        if filled <= 1e-9:
+            return 0.0, 0.0, None
+        # the deepest live tick is the first one whose prefix reaches everything
+        index, remaining, step = 0, filled - 1e-9, self.top_step
+        while step:
+            candidate = index + step
+            if candidate <= size and quantity_tree[candidate] < remaining:
+                index = candidate
+                remaining -= quantity_tree[candidate]
+            step >>= 1
+        return filled, notional, self._price(index + 1)
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from dotenv import load_dotenv
+from web3.exceptions import MethodUnavailable, TransactionNotFound
+
+from off_chain_systems.log import get_logger
+
+load_dotenv()
+
+# seconds between head checks while receipts are awaited, nothing is polled while none are
+RECEIPT_POLL_INTERVAL = float(os.environ.get('RECEIPT_POLL_INTERVAL', 0.2))
+# seconds a sender waits for its receipt, web3's wait_for_transaction_receipt default
+RECEIPT_TIMEOUT = float(os.environ.get('RECEIPT_TIMEOUT', 120))
+
+log = get_logger("receipts")
+
+class ReceiptTracker:
+    """
+    One confirmation watcher for every transaction this process sends, instead
+    of a wait_for_transaction_receipt loop per transaction. While anything is
+    pending it checks the head every _interval and reads each new block's
+    receipts with one eth_getBlockReceipts, resolving the future of every
+    pending hash found there. A block costs the same two calls whether it
+    confirms one of our transactions or a hundred.
+
+    Hashes are watched before they are sent, so the first block searched is
+    the head at that moment and no block can confirm one unseen, and sent()
+    wakes the watcher once the node has taken them: an auto-mining node has
+    already confirmed the transaction by then, so it is found at once rather
+    than an interval later. Nodes without
+    eth_getBlockReceipts get one eth_getTransactionReceipt per pending hash per
+    new block, still far fewer calls than polling each hash on a timer.
+    A hash still unconfirmed after _timeout fails its future with TimeoutError,
+    so callbacks on it always run.
+    """
+    def __init__(self, w3, _interval: float = RECEIPT_POLL_INTERVAL, _timeout: float = RECEIPT_TIMEOUT):
+        self.w3 = w3
+        self.interval = _interval
+        self.timeout = _timeout
+        # tx hash bytes -> Future of its receipt
+        self.pending: dict = {}
+        # tx hash bytes -> monotonic time it was watched
+        self.watched_at: dict = {}
+        # last block searched, None while nothing is pending
+        self.block: int | None = None
+        # False once the node turned eth_getBlockReceipts down
+        self.bulk = True
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def watch(self, _tx_hash) -> Future:
+        """Future of the receipt of _tx_hash, the same one for every call until it resolves."""
+        key = bytes(_tx_hash)
+        with self._lock:
+            future = self.pending.get(key)
+            if future is not None:
+                return future
+            if self.block is None:
+                # an unsent transaction cannot be in any block up to the head
+                self.block = self.w3.eth.block_number
+            future = self.pending[key] = Future()
+            self.watched_at[key] = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, daemon=True)
+                self._thread.start()
+        return future
+
+    def sent(self):
+        """Polls now, a watched transaction has just been sent."""
+        self._wake.set()
+
+    def forget(self, _tx_hash):
+        """Drops a hash that will never confirm (its send failed, or its sender gave up)."""
+        with self._lock:
+            self.pending.pop(bytes(_tx_hash), None)
+            self.watched_at.pop(bytes(_tx_hash), None)
+            if not self.pending:
+                self.block = None
+
+    def wait(self, _tx_hash, _timeout: float = RECEIPT_TIMEOUT):
+        future = self.watch(_tx_hash)
+        self.sent()
+        try:
+            return future.result(timeout=_timeout)
+        except TimeoutError:
+            self.forget(_tx_hash)
+            raise
+
+    def resolve(self, _receipts) -> int:
+        resolved = 0
+        with self._lock:
+            for receipt in _receipts:
+                future = self.pending.pop(bytes(receipt["transactionHash"]), None)
+                if future is not None:
+                    del self.watched_at[bytes(receipt["transactionHash"])]
+                    future.set_result(receipt)
+                    resolved += 1
+        return resolved
+
+    def expire(self, _now: float | None = None):
+        now = time.monotonic() if _now is None else _now
+        with self._lock:
+            for key in [key for key, watched in self.watched_at.items() if now - watched > self.timeout]:
+                del self.watched_at[key]
+                self.pending.pop(key).set_exception(
+                    TimeoutError(f"No receipt for 0x{key.hex()} after {self.timeout:g}s")
+                )
+            if not self.pending:
+                self.block = None
+
+    def poll(self) -> int:
+        """Searches every block since the last poll, returns the number of receipts resolved."""
+        self.expire()
+        if self.block is None:
+            return 0
+        head = self.w3.eth.block_number
+        resolved = 0
+        while self.bulk and self.block is not None and self.block < head:
+            number = self.block + 1
+            try:
+                receipts = self.w3.eth.get_block_receipts(number)
+            except MethodUnavailable:
+                log.warning("Node has no eth_getBlockReceipts, falling back to one receipt call per hash")
+                self.bulk = False
+                break
+            resolved += self.resolve(receipts)
+            with self._lock:
+                self.block = number if self.pending else None
+        if not self.bulk and self.block is not None and self.block < head:
+            receipts = []
+            for key in list(self.pending):
+                try:
+                    receipts.append(self.w3.eth.get_transaction_receipt(key))
+                except TransactionNotFound:
+                    pass
+            resolved += self.resolve(receipts)
+            with self._lock:
+                self.block = head if self.pending else None
+        return resolved
+
+    def run(self):
+        while not self._stop.is_set():
+            # idle until the next send, no RPC at all
+            self._wake.wait(self.interval if self.pending else None)
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception:
+                log.exception("Receipt poll failed")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
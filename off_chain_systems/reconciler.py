@@ -0,0 +1,222 @@
+import os
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+
+from eth_utils import function_abi_to_4byte_selector, to_checksum_address
+from eth_utils.abi import collapse_if_tuple
+from dotenv import load_dotenv
+from off_chain_systems.log import get_logger
+from off_chain_systems.position_manager import Side, Status, PRICE_SCALE
+
+load_dotenv()
+
+PERPS_ADDRESS = os.environ.get('PERPS_ADDRESS')
+PERPS_ABI = json.loads(os.environ.get('PERPS_ABI'))
+MARKET_NAME = os.environ.get('MARKET_NAME')
+# seconds between full passes, 0 turns the in-process reconciler off
+RECONCILE_INTERVAL = float(os.environ.get('RECONCILE_INTERVAL', 60))
+# accounts per batch view call, at most the contract's MAX_VIEW_BATCH
+RECONCILE_CHUNK = int(os.environ.get('RECONCILE_CHUNK', 500))
+# local changes younger than this may still be waiting on their transaction, leave them alone
+RECONCILE_GRACE = float(os.environ.get('RECONCILE_GRACE', 30))
+
+log = get_logger("reconciler")
+
+@dataclass
+class ReconcileReport:
+    block: int
+    accounts: int = 0
+    calls: int = 0
+    # open on chain, missing here
+    missing: list = field(default_factory=list)
+    # open here, closed on chain
+    stale: list = field(default_factory=list)
+    # open on both with different terms, the chain's are taken
+    mismatched: list = field(default_factory=list)
+    # resting in the book with no open limit order on chain, reported only
+    stale_orders: list = field(default_factory=list)
+    # trader -> equity as liquidate() would see it, open positions only
+    equities: dict = field(default_factory=dict)
+    # get_equities came back empty, the oracle price was stale at this block
+    stale_oracle: bool = False
+
+    @property
+    def drift(self) -> int:
+        return len(self.missing) + len(self.stale) + len(self.mismatched) + len(self.stale_orders)
+
+class Reconciler:
+    """
+    Periodic full comparison of PositionManager (and the book's resting orders)
+    against the perps contract, read through its batch views: every known
+    account in ceil(n / RECONCILE_CHUNK) calls per view, all pinned to one block
+    so the chunks agree with each other. The chain wins for positions; resting
+    orders are only reported, since an order can sit in the book before its
+    add_limit_order transaction is mined. The indexer keeps state current
+    between passes, this catches whatever it missed. Only the reads run on
+    this thread; with _submit (the server's engine queue) the diff, which
+    walks the book's levels, and the corrections run on the engine's.
+    """
+    def __init__(
+            self,
+            w3,
+            _pm,
+            _engine=None,
+            _market: str = MARKET_NAME,
+            _chunk: int = RECONCILE_CHUNK,
+            _grace: float = RECONCILE_GRACE,
+            _interval: float = RECONCILE_INTERVAL,
+            _submit=None
+    ):
+        self.w3 = w3
+        self.pm = _pm
+        self.engine = _engine
+        self.market = _market
+        self.chunk = _chunk
+        self.grace = _grace
+        self.interval = _interval
+        self.submit = _submit
+        self.address = to_checksum_address(PERPS_ADDRESS)
+        # view -> (selector, output types), calldata and results are handled here rather than through web3
+        self.views = {
+            entry["name"]: (
+                function_abi_to_4byte_selector(entry),
+                [collapse_if_tuple(output) for output in entry["outputs"]]
+            )
+            for entry in PERPS_ABI if entry.get("type") == "function"
+        }
+        self.last_report: ReconcileReport | None = None
+        # the engine keys accounts by whatever address the API was given, the views need checksums
+        self.checksums: dict = {}
+        self._stop = threading.Event()
+
+    def checksum(self, _trader: str) -> str:
+        address = self.checksums.get(_trader)
+        if address is None:
+            address = self.checksums[_trader] = to_checksum_address(_trader)
+        return address
+
+    def call(self, _view: str, _addresses: list, _block: int) -> list:
+        # raw provider call, web3's argument and result normalizers cost more than the views themselves at 1000 accounts a call
+        selector, output_types = self.views[_view]
+        response = self.w3.provider.make_request("eth_call", [{
+            "to": self.address,
+            "data": "0x" + (selector + self.w3.codec.encode(["address[]"], [_addresses])).hex(),
+        }, hex(_block)])
+        if "error" in response:
+            raise ValueError(response["error"])
+        return self.w3.codec.decode(output_types, bytes.fromhex(response["result"][2:]))[0]
+
+    def read(self, _traders: list, _block: int, _report: ReconcileReport) -> tuple[list, list, list]:
+        addresses = [self.checksum(trader) for trader in _traders]
+        positions, orders, equities = [], [], []
+        for start in range(0, len(addresses), self.chunk):
+            chunk = addresses[start:start + self.chunk]
+            positions += self.call("get_positions", chunk, _block)
+            chunk_equities = self.call("get_equities", chunk, _block)
+            # empty while the oracle is stale, every chunk reads the same block so they all are
+            if not chunk_equities:
+                _report.stale_oracle = True
+            equities += chunk_equities
+            _report.calls += 2
+            if self.engine is not None:
+                orders += self.call("get_limit_orders", chunk, _block)
+                _report.calls += 1
+        return positions, orders, equities
+
+    def resting_traders(self) -> set:
+        return {
+            order.trader_id
+            for book in (self.engine.bids, self.engine.asks)
+            for orders in book.values()
+            for order in orders
+            if order.status == Status.OPEN and time.time() - order.timestamp > self.grace
+        }
+
+    def diff(self, _traders: list, _positions: list, _orders: list, _equities: list, _report: ReconcileReport):
+        now = time.time()
+        for i, trader in enumerate(_traders):
+            margin, leverage, entry_price, _, snapshot, direction, is_open = _positions[i]
+            local = self.pm.get_open_position(trader, self.market)
+            if is_open:
+                if not _report.stale_oracle:
+                    _report.equities[trader] = _equities[i] / PRICE_SCALE
+                chain = (margin, leverage, entry_price, direction, snapshot)
+                if local is None:
+                    recently_closed = any(
+                        p.market_id == self.market and now - p.close_timestamp < self.grace
+                        for p in self.pm.accounts[trader].positions if p.status != Status.OPEN
+                    )
+                    if not recently_closed:
+                        _report.missing.append((trader, chain))
+                elif (
+                    abs(local.margin - margin / PRICE_SCALE) > 1 / PRICE_SCALE
+                    or abs(local.entry_price - entry_price / PRICE_SCALE) > 1 / PRICE_SCALE
+                    or local.leverage != leverage
+                    or (local.side == Side.BUY) != direction
+                ):
+                    _report.mismatched.append((trader, chain))
+                else:
+                    local.funding_index_snapshot = snapshot
+            elif local is not None and now - local.open_timestamp > self.grace:
+                _report.stale.append(trader)
+
+        if self.engine is not None:
+            open_on_chain = {trader for trader, order in zip(_traders, _orders) if order[6]}
+            _report.stale_orders = sorted(self.resting_traders() - open_on_chain)
+
+    def apply(self, _report: ReconcileReport):
+        # positions can close between read() and here, only ones still open are corrected
+        for trader in _report.stale:
+            position = self.pm.get_open_position(trader, self.market)
+            if position is None:
+                continue
+            position.status = Status.CLOSED
+            position.close_timestamp = time.time()
+        for trader, (margin, leverage, entry_price, direction, snapshot) in _report.mismatched:
+            position = self.pm.get_open_position(trader, self.market)
+            if position is None:
+                continue
+            position.margin = margin / PRICE_SCALE
+            position.leverage = leverage
+            position.entry_price = entry_price / PRICE_SCALE
+            position.side = Side.BUY if direction else Side.SELL
+            position.quantity = position.margin * leverage / position.entry_price
+            position.funding_index_snapshot = snapshot
+        for trader, (margin, leverage, entry_price, direction, snapshot) in _report.missing:
+            self.pm.create_position_from_chain(
+                trader, self.market, margin, leverage, entry_price, direction, snapshot, _report.block
+            )
+
+    def settle(self, _traders: list, _positions: list, _orders: list, _equities: list, _report: ReconcileReport):
+        self.diff(_traders, _positions, _orders, _equities, _report)
+        self.apply(_report)
+
+    def run_cycle(self) -> ReconcileReport:
+        traders = list(self.pm.accounts)
+        report = ReconcileReport(block=self.w3.eth.block_number, accounts=len(traders))
+        positions, orders, equities = self.read(traders, report.block, report)
+        if self.submit is None:
+            self.settle(traders, positions, orders, equities, report)
+        else:
+            self.submit(self.settle, traders, positions, orders, equities, report)
+        self.last_report = report
+        log_fn = log.warning if report.drift else log.info
+        log_fn(
+            "Reconciled accounts", block=report.block, accounts=report.accounts, calls=report.calls,
+            missing=len(report.missing), stale=len(report.stale), mismatched=len(report.mismatched),
+            stale_orders=len(report.stale_orders), stale_oracle=report.stale_oracle
+        )
+        return report
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_cycle()
+            except Exception:
+                log.exception("Reconcile pass failed")
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,138 @@
+from typing import Annotated, Literal, Union
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, field_validator
+import orjson
+from off_chain_systems.position_manager import Side
+from off_chain_systems.matching_engine import TimeInForce
+
+class ORJSONResponse(JSONResponse):
+    """
+    Encodes straight to bytes with orjson. Dataclasses and enums are handled natively,
+    so engine objects (Trade, Side) can be returned without an intermediate dict pass.
+    """
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+# ------------------------------------------------------------------
+#                            REQUESTS
+# ------------------------------------------------------------------
+class TraderRequest(BaseModel):
+    trader_address: str
+
+class DirectedOrderRequest(TraderRequest):
+    direction: Side
+    quantity: float
+    leverage: int
+
+    @field_validator("direction", mode="before")
+    @classmethod
+    def lowercase_direction(cls, value):
+        return value.lower() if isinstance(value, str) else value
+
+class LimitOrderRequest(DirectedOrderRequest):
+    price: float
+    time_in_force: TimeInForce = TimeInForce.GTC
+    # unix seconds, required with time_in_force "gtt"
+    expires_at: float | None = None
+
+class MarketOrderRequest(DirectedOrderRequest):
+    # stop taking liquidity past this price, None sweeps as deep as needed
+    worst_price: float | None = None
+    time_in_force: TimeInForce = TimeInForce.IOC
+
+class ReplaceOrderRequest(TraderRequest):
+    price: float
+    quantity: float
+
+class CancelOrderRequest(TraderRequest):
+    pass
+
+class TriggerRequest(TraderRequest):
+    # None disarms, a request replaces whatever was armed before
+    stop_price: float | None = None
+    take_profit_price: float | None = None
+
+class LimitCommand(LimitOrderRequest):
+    type: Literal["limit"]
+
+class MarketCommand(MarketOrderRequest):
+    type: Literal["market"]
+
+class ReplaceCommand(ReplaceOrderRequest):
+    type: Literal["replace"]
+
+class CancelCommand(CancelOrderRequest):
+    type: Literal["cancel"]
+
+BatchCommand = Annotated[
+    Union[LimitCommand, MarketCommand, ReplaceCommand, CancelCommand],
+    Field(discriminator="type")
+]
+
+class BatchRequest(BaseModel):
+    commands: list[BatchCommand]
+    compact: bool = False
+
+# ------------------------------------------------------------------
+#                            RESPONSES
+# ------------------------------------------------------------------
+class OrderBookModel(BaseModel):
+    bids: list[tuple[float, float]]
+    asks: list[tuple[float, float]]
+
+class TradeModel(BaseModel):
+    timestamp: float
+    trade_id: int
+    price: float
+    quantity: float
+    taker_id: str
+    maker_id: str
+    taker_side: Side
+    taker_fee: float
+    maker_fee: float
+
+class OrderResponse(BaseModel):
+    status: str
+    order_id: int | None = None
+    # fills of a limit that crossed the book
+    trades: list[TradeModel] | None = None
+    orderbook: OrderBookModel | None = None
+
+class MarketOrderResponse(BaseModel):
+    status: str
+    trades: list[TradeModel]
+    orderbook: OrderBookModel | None = None
+
+class BatchResult(BaseModel):
+    index: int
+    status: str
+    order_id: int | None = None
+    trade_ids: list[int] | None = None
+    error: str | None = None
+
+class BatchResponse(BaseModel):
+    status: str
+    results: list[BatchResult]
+    orderbook: OrderBookModel | None = None
+
+class TradesResponse(BaseModel):
+    trades: list[TradeModel]
+
+class TriggerResponse(BaseModel):
+    status: str
+    position_id: int
+    stop_price: float | None = None
+    take_profit_price: float | None = None
+
+class QuoteResponse(BaseModel):
+    side: Side
+    best_price: float | None = None
+    quantity: float | None = None
+    filled: float | None = None
+    vwap: float | None = None
+    worst_price: float | None = None
+    impact_bps: float | None = None
+    bps: float | None = None
+    limit_price: float | None = None
+    available: float | None = None
+    available_vwap: float | None = None
@@ -1,11 +1,37 @@
-from fastapi import FastAPI, Body, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Response
 from off_chain_systems.matching_engine import OrderBook, Side
 from off_chain_systems.position_manager import PositionManager, Status
+from off_chain_systems import metrics
+from off_chain_systems.funding_service import FundingService, sample_engine_prices, peek_engine_prices, premium_sampler
+from off_chain_systems.premium_index import PremiumIndex
+from off_chain_systems.indexer import ChainIndexer
+from off_chain_systems.reconciler import Reconciler, RECONCILE_INTERVAL
+from off_chain_systems.admission import RateLimiter, EngineQueue, RateLimited, Overloaded, retry_after_header
+from off_chain_systems.schemas import (
+    ORJSONResponse,
+    LimitOrderRequest,
+    MarketOrderRequest,
+    ReplaceOrderRequest,
+    CancelOrderRequest,
+    TriggerRequest,
+    BatchRequest,
+    OrderBookModel,
+    OrderResponse,
+    MarketOrderResponse,
+    BatchResponse,
+    TradesResponse,
+    QuoteResponse,
+    TriggerResponse,
+)
+import asyncio
 import os
 from dotenv import load_dotenv
 import json
 import threading
+import uuid
+from collections import Counter
 from contextlib import asynccontextmanager
+from functools import partial
 
 load_dotenv()
 
@@ -13,28 +39,109 @@ PERPS_ADDRESS = os.getenv("PERPS_ADDRESS")
 PERPS_ABI = json.loads(os.getenv("PERPS_ABI"))
 RPC_URL = os.getenv("RPC_URL")
 MARKET_NAME = os.getenv("MARKET_NAME")
+MAX_BATCH_COMMANDS = 100
+# run funding in this process; set to 0 when keeper/funding_update_script.py runs it instead
+FUNDING_IN_PROCESS = os.getenv("FUNDING_IN_PROCESS", "1") == "1"
+# follow the perps contract's events so on-chain-only changes reach the position manager
+INDEXER_ENABLED = os.getenv("INDEXER_ENABLED", "1") == "1"
+# book versions restart at 0 with the process, so ETags carry a per-boot prefix
+BOOT_ID = uuid.uuid4().hex[:8]
 
 pm: PositionManager = PositionManager()
 engine: OrderBook = OrderBook(MARKET_NAME, pm)
 pm.orderbook = engine
+premium_index: PremiumIndex = PremiumIndex()
+engine.trade_listeners.append(premium_index.record_trade)
+limiter: RateLimiter = RateLimiter()
+# /tx/* commands and order expiry run one at a time on the queue's worker, which
+# publishes the book snapshot GET /orderbook serves after each of them
+engine_queue: EngineQueue = EngineQueue(_after=engine.publish_snapshot)
+
+def on_engine(_fn, *_args, **_kwargs):
+    """
+    Runs _fn on the engine queue's worker and waits for it. The book, the
+    positions and the premium index are only touched there: background loops
+    and sync read handlers hand their engine-side work over through this,
+    RPC calls stay on their own threads. Internal callers are never refused.
+    """
+    return engine_queue.submit(_fn, *_args, _bounded=False, **_kwargs)
 
 @asynccontextmanager
 async def app_lifespan(app: FastAPI):
-    thread = threading.Thread(target=pm.management_loop, daemon=True)
+    pm.load_funding()
+    thread = threading.Thread(target=pm.management_loop, args=(on_engine,), daemon=True)
     thread.start()
+    indexer = None
+    if INDEXER_ENABLED:
+        indexer = ChainIndexer(pm.w3, pm, MARKET_NAME, _submit=on_engine)
+        threading.Thread(target=indexer.run, daemon=True).start()
+    reconciler = None
+    if RECONCILE_INTERVAL > 0:
+        reconciler = Reconciler(pm.w3, pm, engine, MARKET_NAME, _submit=on_engine)
+        threading.Thread(target=reconciler.run, daemon=True).start()
+    engine_queue.start()
+    # stops the expiry loop and the premium sampler
+    stop_loops = threading.Event()
+    threading.Thread(target=engine.expiry_loop, args=(stop_loops, on_engine), daemon=True).start()
+    funding = None
+    if FUNDING_IN_PROCESS:
+        funding = FundingService(
+            pm.w3, partial(sample_engine_prices, pm, premium_index, on_engine), _funding_index=pm.funding,
+            _scheduler=pm.tx_scheduler
+        )
+        threading.Thread(target=funding.run, daemon=True).start()
+    else:
+        threading.Thread(
+            target=premium_sampler, args=(pm, premium_index, stop_loops), kwargs={"_submit": on_engine}, daemon=True
+        ).start()
     try:
         yield
     finally:
-        pass
-
-app = FastAPI(title="Tachyon Backend API", lifespan=app_lifespan)
+        stop_loops.set()
+        engine_queue.stop()
+        if funding is not None:
+            funding.stop()
+        if indexer is not None:
+            indexer.stop()
+        if reconciler is not None:
+            reconciler.stop()
+
+app = FastAPI(title="Tachyon Backend API", lifespan=app_lifespan, default_response_class=ORJSONResponse)
+
+def cached_json(key: str, encoded: tuple, if_none_match: str | None) -> Response:
+    version, body = encoded
+    etag = f'"{BOOT_ID}-{key}-{version}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+async def admit(_endpoint: str, _costs: dict, _run):
+    """
+    Runs an order API command (or a quote, with no _costs) on the engine queue
+    after charging each trader's rate limit for _endpoint. Over the limit answers 429 and a full queue 503,
+    both with Retry-After, before the engine is touched. The /tx/* handlers are
+    async and await the command here, so waiting requests hold no threadpool
+    thread and the queue bound is what limits them.
+    """
+    try:
+        for trader, cost in _costs.items():
+            limiter.take(trader, _endpoint, cost)
+        return await asyncio.wrap_future(engine_queue.enqueue(_run))
+    except RateLimited as exc:
+        metrics.rejected(_endpoint, "rate_limited")
+        raise HTTPException(status_code=429, detail=str(exc), headers=retry_after_header(exc.retry_after)) from exc
+    except Overloaded as exc:
+        metrics.rejected(_endpoint, "overloaded")
+        raise HTTPException(status_code=503, detail=str(exc), headers=retry_after_header(exc.retry_after)) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-@app.get("/orderbook")
-def get_orderbook():
-    return engine.snapshot()
+@app.get("/orderbook", response_model=OrderBookModel)
+def get_orderbook(if_none_match: str | None = Header(default=None)):
+    # the worker's last published copy, the live levels are only walked on the engine's thread
+    return cached_json("orderbook", engine.published_snapshot(), if_none_match)
 
-@app.get("/positions/{address}")
-def get_open_positions(address: str):
+def open_positions(address: str) -> dict:
     account = pm.accounts.get(address)
     if not account:
         return {"positions": []}
@@ -54,91 +161,163 @@ def get_open_positions(address: str):
             "leverage": pos.leverage,
             "margin": pos.margin,
             "pnl": pos.unrealized_pnl,
+            "funding": pos.funding_paid,
+            "stop_price": pos.stop_price,
+            "take_profit_price": pos.take_profit_price,
             "status": pos.status.value,
         })
 
     return {"positions": positions_data}
 
+@app.get("/positions/{address}")
+def get_open_positions(address: str):
+    # update_pnl reads the book and writes the positions
+    return on_engine(open_positions, address)
+
 @app.get("/oracle_price")
 def get_oracle_pricing():
     return pm.get_oracle_price()
 
 @app.get("/perp_price")
 def get_perp_pricing():
-    return pm.get_perp_price()
+    return on_engine(pm.get_perp_price)
+
+@app.get("/prices")
+def get_prices():
+    # read-only, polling this must not add ticks to the funding premium
+    sample = peek_engine_prices(pm, premium_index, on_engine)
+    return {
+        "oracle_price": sample.oracle_price,
+        "perp_price": sample.perp_price,
+        "funding_rate": sample.funding_rate,
+    }
+
+@app.get("/quote", response_model=QuoteResponse)
+async def get_quote(side: Side, quantity: float | None = None, bps: float | None = None):
+    # the depth index folds pending deltas in on read, so quotes run on the engine's thread too
+    return await admit("quote", {}, partial(engine.quote, _side=side, _quantity=quantity, _bps=bps))
 
 @app.get("/funding_rate")
 def get_funding_rate():
     return pm.get_funding_rate()
 
-@app.post("/tx/limit_order")
-def place_limit_order(order: dict = Body(...)):
-    try:
-        pm.create_account(order["trader_address"])
-        direction_enum = Side.BUY if order["direction"].lower() == "buy" else Side.SELL
-        engine.add_limit_order(
-            _trader_id=order["trader_address"],
-            _side=direction_enum,
-            _price=order["price"],
-            _quantity=order["quantity"],
-            _leverage=order["leverage"]
+@app.post("/tx/limit_order", response_model=OrderResponse)
+async def place_limit_order(order: LimitOrderRequest, include_book: bool = True):
+    def run():
+        pm.create_account(order.trader_address)
+        fills = engine.add_limit_order(
+            _trader_id=order.trader_address,
+            _side=order.direction,
+            _price=order.price,
+            _quantity=order.quantity,
+            _leverage=order.leverage,
+            _time_in_force=order.time_in_force,
+            _expires_at=order.expires_at
         )
-    except KeyError as exc:
-        raise HTTPException(status_code=422, detail=f"Missing field: {exc.args[0]}") from exc
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
-
-    return {
-        "status": "ok",
-        "order_id": engine.order_id,
-        "orderbook": engine.snapshot(),
-    }
-
-@app.post("/tx/market_order")
-def place_market_order(order: dict = Body(...)):
-    try:
-        pm.create_account(order["trader_address"])
-        direction_enum = Side.BUY if order["direction"].lower() == "buy" else Side.SELL
+        return {
+            "status": "ok",
+            "order_id": engine.order_id,
+            "trades": fills or None,
+            "orderbook": engine.snapshot() if include_book else None,
+        }
+
+    return ORJSONResponse(await admit("limit_order", {order.trader_address: 1}, run))
+
+@app.post("/tx/market_order", response_model=MarketOrderResponse)
+async def place_market_order(order: MarketOrderRequest, include_book: bool = True):
+    def run():
+        pm.create_account(order.trader_address)
         engine.market_order(
-            _trader_id=order["trader_address"],
-            _side=direction_enum,
-            _quantity=order["quantity"],
-            _leverage=order["leverage"]
+            _trader_id=order.trader_address,
+            _side=order.direction,
+            _quantity=order.quantity,
+            _leverage=order.leverage,
+            _worst_price=order.worst_price,
+            _time_in_force=order.time_in_force
         )
-    except KeyError as exc:
-        raise HTTPException(status_code=422, detail=f"Missing field: {exc.args[0]}") from exc
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
-
-    recent_trades = [t.__dict__ for t in engine.trade_events[-20:]]
-    return {
-        "status": "ok",
-        "orderbook": engine.snapshot(),
-        "trades": recent_trades,
-    }
-
-@app.post("/tx/remove_limit_order")
-def cancel_limit_order(order: dict = Body(...)):
-    try:
-        pm.create_account(order["trader_address"])
-        trader_address = order["trader_address"]
+        return {
+            "status": "ok",
+            "orderbook": engine.snapshot() if include_book else None,
+            "trades": engine.trade_events[-20:],
+        }
+
+    return ORJSONResponse(await admit("market_order", {order.trader_address: 1}, run))
+
+@app.post("/tx/remove_limit_order", response_model=OrderResponse)
+async def cancel_limit_order(order: CancelOrderRequest, include_book: bool = True):
+    def run():
+        pm.create_account(order.trader_address)
         engine.remove_limit_order(
-            _trader_id=trader_address,
+            _trader_id=order.trader_address,
         )
-    except KeyError as exc:
-        raise HTTPException(status_code=422, detail=f"Missing field: {exc.args[0]}") from exc
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
-
-    return {
-        "status": "ok",
-        "orderbook": engine.snapshot(),
-    }
-
-@app.get("/trades")
-def get_trades():
-    trades = [t.__dict__ for t in engine.trade_events[-20:]]
-    return {"trades": trades}
+        return {
+            "status": "ok",
+            "orderbook": engine.snapshot() if include_book else None,
+        }
+
+    return ORJSONResponse(await admit("remove_limit_order", {order.trader_address: 1}, run))
+
+@app.post("/tx/replace_limit_order", response_model=OrderResponse)
+async def amend_limit_order(order: ReplaceOrderRequest, include_book: bool = True):
+    def run():
+        pm.create_account(order.trader_address)
+        amended = engine.replace_limit_order(
+            _trader_id=order.trader_address,
+            _price=order.price,
+            _quantity=order.quantity
+        )
+        return {
+            "status": "ok",
+            "order_id": amended.order_id,
+            "orderbook": engine.snapshot() if include_book else None,
+        }
+
+    return ORJSONResponse(await admit("replace_limit_order", {order.trader_address: 1}, run))
+
+@app.post("/tx/triggers", response_model=TriggerResponse)
+async def set_position_triggers(order: TriggerRequest):
+    def run():
+        position = engine.set_triggers(
+            _trader_id=order.trader_address,
+            _stop_price=order.stop_price,
+            _take_profit_price=order.take_profit_price
+        )
+        return {
+            "status": "ok",
+            "position_id": position.position_id,
+            "stop_price": position.stop_price,
+            "take_profit_price": position.take_profit_price,
+        }
+
+    return ORJSONResponse(await admit("triggers", {order.trader_address: 1}, run))
+
+@app.post("/tx/batch", response_model=BatchResponse)
+async def place_batch(batch: BatchRequest):
+    if len(batch.commands) > MAX_BATCH_COMMANDS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {MAX_BATCH_COMMANDS} commands")
+
+    def run():
+        results = engine.apply_batch([command.model_dump(mode="json") for command in batch.commands])
+
+        response = {
+            "status": "ok",
+            "results": results,
+        }
+        # compact responses skip the book snapshot, clients quoting ladders rarely need it
+        if not batch.compact:
+            response["orderbook"] = engine.snapshot()
+        return response
+
+    # every command spends a token of its own trader's bucket
+    return ORJSONResponse(await admit("batch", Counter(command.trader_address for command in batch.commands), run))
+
+@app.get("/trades", response_model=TradesResponse)
+def get_trades(if_none_match: str | None = Header(default=None)):
+    return cached_json("trades", engine.encoded_trades(), if_none_match)
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def root():
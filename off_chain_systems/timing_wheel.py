@@ -0,0 +1,137 @@
+import math
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# seconds per wheel tick, expiring orders leave the book at most this late
+EXPIRY_TICK = float(os.environ.get('EXPIRY_TICK', 0.1))
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel (Varghese & Lauck, the layout of the Linux timer
+    wheel): _levels rings of 2**_bits slots, level k holding deadlines up to
+    2**(_bits * (k + 1)) ticks out. Every tick fires one level-0 slot; each time
+    a level's index wraps, the next level's current slot is cascaded down and
+    re-placed by its remaining distance. Scheduling and cancelling are dict
+    operations, and advancing fires N due keys in O(N) plus one slot visit per
+    elapsed tick, never a scan of everything scheduled.
+
+    Deadlines fire on an advance at or after them, never early and at most one
+    tick late. Keys are unique, scheduling a key again moves it.
+
+    next_tick is a lower bound on the next tick that fires anything (None
+    when empty), kept up to date by scheduling and advancing, so a caller on
+    another thread can ask due_by() whether an advance is worth a trip to the
+    thread that owns the wheel. It reads that one attribute and nothing else.
+    """
+    def __init__(self, _tick: float = EXPIRY_TICK, _now: float = 0.0, _bits: int = 6, _levels: int = 4):
+        self.tick = _tick
+        self.bits = _bits
+        self.mask = (1 << _bits) - 1
+        self.wheels: list = [[{} for _ in range(1 << _bits)] for _ in range(_levels)]
+        # next tick to fire, everything before it has been processed
+        self.current: int = math.floor(_now / _tick) + 1
+        # key -> (slot dict, target tick)
+        self.where: dict = {}
+        # scheduled behind the current tick, fired by the very next advance
+        self.due: dict = {}
+        # nothing fires before this tick, None when nothing is scheduled
+        self.next_tick: int | None = None
+
+    def __len__(self) -> int:
+        return len(self.where)
+
+    def __contains__(self, _key) -> bool:
+        return _key in self.where
+
+    def _place(self, _key, _target: int):
+        distance = _target - self.current
+        if distance < 0:
+            slot = self.due
+        else:
+            level = 0
+            while level < len(self.wheels) - 1 and distance >> (self.bits * (level + 1)):
+                level += 1
+            if distance >> (self.bits * (level + 1)):
+                # beyond the top level: park in its farthest slot, the cascade re-places it
+                _index = ((self.current >> (self.bits * level)) - 1) & self.mask
+            else:
+                _index = (_target >> (self.bits * level)) & self.mask
+            slot = self.wheels[level][_index]
+        slot[_key] = _target
+        self.where[_key] = (slot, _target)
+        first = self.current - 1 if distance < 0 else _target
+        if self.next_tick is None or first < self.next_tick:
+            self.next_tick = first
+
+    def schedule(self, _key, _deadline: float):
+        self.cancel(_key)
+        self._place(_key, math.ceil(_deadline / self.tick - 1e-9))
+
+    def due_by(self, _now: float) -> bool:
+        """True if advance(_now) may fire something; a cancelled key can make it a false positive, never a miss."""
+        next_tick = self.next_tick
+        return next_tick is not None and next_tick <= math.floor(_now / self.tick + 1e-9)
+
+    def _next_tick(self) -> int | None:
+        if not self.where:
+            return None
+        # a rotation starts with a cascade that may bring deadlines down into it
+        if not self.current & self.mask:
+            return self.current
+        # the rest of this level-0 rotation, then the cascade at its end re-places the upper levels
+        wheel = self.wheels[0]
+        boundary = ((self.current >> self.bits) + 1) << self.bits
+        for tick in range(self.current, boundary):
+            if wheel[tick & self.mask]:
+                return tick
+        return boundary
+
+    def cancel(self, _key) -> bool:
+        found = self.where.pop(_key, None)
+        if found is None:
+            return False
+        del found[0][_key]
+        return True
+
+    def advance(self, _now: float) -> list:
+        """Fires every key whose deadline is at or before _now, in deadline tick order."""
+        now_tick = math.floor(_now / self.tick + 1e-9)
+        fired = []
+        if self.due:
+            for key in self.due:
+                del self.where[key]
+            fired.extend(self.due)
+            self.due.clear()
+        if not self.where:
+            # nothing scheduled, skip the idle ticks instead of walking them
+            self.current = max(self.current, now_tick + 1)
+            self.next_tick = None
+            return fired
+        wheels, bits, mask, where = self.wheels, self.bits, self.mask, self.where
+        while self.current <= now_tick:
+            tick = self.current
+            # cascade every level whose lower neighbour just wrapped
+            level = 0
+            while level < len(wheels) - 1 and not (tick >> (bits * level)) & mask:
+                level += 1
+                slot = wheels[level][(tick >> (bits * level)) & mask]
+                if slot:
+                    entries = list(slot.items())
+                    slot.clear()
+                    for key, target in entries:
+                        self._place(key, target)
+            slot = wheels[0][tick & mask]
+            if slot:
+                for key in slot:
+                    del where[key]
+                fired.extend(slot)
+                slot.clear()
+            self.current = tick + 1
+            if not where:
+                self.current = max(self.current, now_tick + 1)
+                break
+        self.next_tick = self._next_tick()
+        return fired
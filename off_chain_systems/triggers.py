@@ -0,0 +1,87 @@
+from enum import Enum
+
+from sortedcontainers import SortedList
+
+from off_chain_systems.position_manager import Side
+
+class TriggerKind(Enum):
+    STOP = "stop"
+    TAKE_PROFIT = "take_profit"
+
+class TriggerIndex:
+    """
+    Armed stop-loss / take-profit triggers of open positions, in two SortedLists
+    keyed by trigger price. "falling" fires once the book trades at or below the
+    trigger (a long's stop, a short's take-profit), "rising" at or above it (a
+    long's take-profit, a short's stop). A trade price update bisects each list
+    once and slices off everything it crossed, O(log n + k) for k fired out of n
+    armed, so the price path never scans triggers that stay armed.
+
+    Entries remember the position they were armed for; the engine drops a fired
+    trigger whose position has since closed instead of closing a newer one.
+    """
+    def __init__(self):
+        # (trigger price, seq, trader, kind, position id), seq keeps arming order within a price
+        self.falling: SortedList = SortedList()
+        self.rising: SortedList = SortedList()
+        # trader -> {kind: (list, entry)}, so disarming never scans
+        self.armed: dict = {}
+        self.seq: int = 0
+
+    def __len__(self) -> int:
+        return len(self.falling) + len(self.rising)
+
+    def arm(self, _trader_id: str, _position_id: int, _position_side: Side, _kind: TriggerKind, _price: float):
+        """Arms (or re-arms at a new price) the _kind trigger of a position."""
+        self.disarm(_trader_id, _kind)
+        falls = (_position_side == Side.BUY) == (_kind == TriggerKind.STOP)
+        triggers = self.falling if falls else self.rising
+        self.seq += 1
+        entry = (_price, self.seq, _trader_id, _kind, _position_id)
+        triggers.add(entry)
+        self.armed.setdefault(_trader_id, {})[_kind] = (triggers, entry)
+
+    def disarm(self, _trader_id: str, _kind: TriggerKind | None = None):
+        """Drops one trigger of a trader, or all of them when _kind is None."""
+        armed = self.armed.get(_trader_id)
+        if not armed:
+            return
+        for kind in list(armed) if _kind is None else [_kind]:
+            found = armed.pop(kind, None)
+            if found is not None:
+                triggers, entry = found
+                triggers.remove(entry)
+        if not armed:
+            del self.armed[_trader_id]
+
+    def get(self, _trader_id: str, _kind: TriggerKind) -> float | None:
+        found = self.armed.get(_trader_id, {}).get(_kind)
+        return None if found is None else found[1][0]
+
+    def fired(self, _low: float, _high: float) -> list:
+        """
+        Pops every trigger crossed by trades between _low and _high and returns
+        them as (trader, kind, position id, trigger price), in the order the
+        price reached them: falling triggers highest first, then rising ones
+        lowest first.
+        """
+        fired = []
+        # (_low,) sorts before every entry at _low, so the tail is all triggers >= _low
+        start = self.falling.bisect_left((_low,))
+        if start < len(self.falling):
+            fired.extend(reversed(self.falling[start:]))
+            del self.falling[start:]
+        # (_high, inf) sorts after every entry at _high, so the head is all triggers <= _high
+        end = self.rising.bisect_right((_high, float("inf")))
+        if end:
+            fired.extend(self.rising[:end])
+            del self.rising[:end]
+
+        result = []
+        for price, _, trader_id, kind, position_id in fired:
+            armed = self.armed[trader_id]
+            del armed[kind]
+            if not armed:
+                del self.armed[trader_id]
+            result.append((trader_id, kind, position_id, price))
+        return result
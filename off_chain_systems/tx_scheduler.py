@@ -0,0 +1,168 @@
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import Future
+from enum import IntEnum
+from functools import partial
+
+from eth_account import Account
+from dotenv import load_dotenv
+
+from off_chain_systems import metrics
+from off_chain_systems.log import get_logger
+from off_chain_systems.receipt_tracker import ReceiptTracker, RECEIPT_TIMEOUT
+
+load_dotenv()
+
+PRIVATE_KEY = os.environ.get('PRIVATE_KEY')
+
+log = get_logger("tx_scheduler")
+
+# node rejections meaning the locally counted nonce was used by another sender of this key
+NONCE_ERRORS = ("nonce too low", "replacement transaction underpriced", "nonce has already been used")
+
+def chain_future(_target: Future, _source: Future):
+    if _source.exception() is not None:
+        _target.set_exception(_source.exception())
+    else:
+        _target.set_result(_source.result())
+
+class TxPriority(IntEnum):
+    # lower goes first
+    LIQUIDATION = 0
+    ORACLE = 1
+    CLOSE = 2
+    FILL = 3
+    OTHER = 4
+
+class TxScheduler:
+    """
+    Single sender for the hot wallet. Engine fills and closes, liquidations
+    and in-process funding updates all hand their built transactions here
+    instead of reading a nonce and sending on their own thread. One dispatcher
+    thread takes them highest priority first (arrival order within a class),
+    and stamps the nonce only then. It then signs and sends. Work waiting for a
+    nonce is therefore pre-empted by anything more urgent that arrives: a
+    liquidation goes out after at most the one send already in progress, however
+    many fills are queued.
+
+    The nonce is read once from the node ("pending") and counted locally, and
+    re-read after a failed send, since the node may or may not have taken it.
+    Another process on the same key (the oracle keeper) also uses up nonces:
+    when the node says ours is taken, the transaction is re-signed on a fresh
+    pending nonce and sent once more before its caller sees an error.
+    send() waits for its receipt on _receipts when given (registered before
+    the send, see ReceiptTracker), else on its own wait_for_transaction_receipt.
+    settle() only waits for the node to take the transaction and checks the
+    receipt off the caller's thread, for the engine's settlement calls.
+    """
+    def __init__(self, w3, _private_key: str = PRIVATE_KEY, _receipts: ReceiptTracker | None = None):
+        self.w3 = w3
+        self.account = Account.from_key(_private_key)
+        self.receipts = _receipts
+        # (priority, seq, queued at, tx, receipt future or None, future)
+        self.heap: list = []
+        self.seq: int = 0
+        self.nonce: int | None = None
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def submit(self, _priority: TxPriority, _tx: dict, _receipt: Future | None = None) -> Future:
+        """
+        Queues a built transaction; its nonce and sender are overwritten at
+        dispatch. The future resolves to the tx hash once the node accepted it.
+        _receipt, with a tracker, is resolved with the receipt.
+        """
+        if self._thread is None:
+            self.start()
+        future: Future = Future()
+        with self._cond:
+            self.seq += 1
+            heapq.heappush(self.heap, (_priority, self.seq, time.perf_counter(), _tx, _receipt, future))
+            self._cond.notify()
+        return future
+
+    def send(self, _priority: TxPriority, _tx: dict):
+        """submit() and wait for the receipt, for callers that need the outcome."""
+        receipt: Future | None = Future() if self.receipts is not None else None
+        with metrics.stage("send"):
+            tx_hash = self.submit(_priority, _tx, receipt).result()
+        with metrics.stage("receipt"):
+            if receipt is not None:
+                return receipt.result(timeout=RECEIPT_TIMEOUT)
+            return self.w3.eth.wait_for_transaction_receipt(tx_hash)
+
+    def settle(self, _priority: TxPriority, _tx: dict):
+        """
+        submit() and wait for the tx hash only. The receipt is checked on the
+        tracker's thread when it arrives, a revert or no receipt in time is
+        logged. Without a tracker this is send().
+        """
+        if self.receipts is None:
+            return self.send(_priority, _tx)
+        receipt: Future = Future()
+        with metrics.stage("send"):
+            tx_hash = self.submit(_priority, _tx, receipt).result()
+        receipt.add_done_callback(partial(self._settled, _priority, tx_hash))
+        return tx_hash
+
+    @staticmethod
+    def _settled(_priority: TxPriority, _tx_hash, _receipt: Future):
+        if _receipt.exception() is not None:
+            log.error("No receipt for settlement transaction: %s", _receipt.exception(),
+                      priority=_priority.name, tx_hash=_tx_hash.hex())
+        elif _receipt.result()["status"] != 1:
+            log.error("Settlement transaction reverted", priority=_priority.name, tx_hash=_tx_hash.hex())
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.heap:
+                    self._cond.wait()
+                priority, _, queued, tx, receipt, future = heapq.heappop(self.heap)
+            try:
+                future.set_result(self.dispatch(tx, receipt))
+            except Exception as exc:
+                log.error("Transaction send failed: %s", exc, priority=priority.name)
+                future.set_exception(exc)
+            metrics.observe_tx_submit(priority.name.lower(), time.perf_counter() - queued)
+
+    def dispatch(self, _tx: dict, _receipt: Future | None = None):
+        try:
+            return self._send(_tx, _receipt)
+        except Exception as exc:
+            if not any(error in str(exc).lower() for error in NONCE_ERRORS):
+                raise
+            log.warning("Nonce taken by another sender, resending: %s", exc)
+        return self._send(_tx, _receipt)
+
+    def _send(self, _tx: dict, _receipt: Future | None):
+        if self.nonce is None:
+            self.nonce = self.w3.eth.get_transaction_count(self.account.address, "pending")
+        tx = {**_tx, "from": self.account.address, "nonce": self.nonce}
+        with metrics.stage("sign"):
+            signed_tx = self.account.sign_transaction(tx)
+        if _receipt is not None:
+            # watched before the send and chained from here, so no block can confirm it unseen
+            self.receipts.watch(signed_tx.hash).add_done_callback(partial(chain_future, _receipt))
+        try:
+            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        except Exception:
+            self.nonce = None
+            if _receipt is not None:
+                self.receipts.forget(signed_tx.hash)
+            raise
+        self.nonce += 1
+        if _receipt is not None:
+            self.receipts.sent()
+        return tx_hash
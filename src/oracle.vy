@@ -1,13 +1,27 @@
 # pragma version 0.4.3
 # @license MIT
 
+# ------------------------------------------------------------------
+#                              FLAGS
+# ------------------------------------------------------------------
+# which prices of a market an update_prices entry writes
+flag PriceField:
+    ORACLE
+    PERP
+
+# ------------------------------------------------------------------
+#                              STRUCT
+# ------------------------------------------------------------------
+struct MarketPrice:
+    oracle_price: uint256
+    perp_price: uint256
+    last_update_time: uint256
+    last_update_time_perp: uint256
+
 # ------------------------------------------------------------------
 #                              STATE
 # ------------------------------------------------------------------
-oracle_price: public(uint256)
-perp_price: public(uint256)
-last_update_time: public(uint256)
-last_update_time_perp: public(uint256)
+markets: public(HashMap[uint256, MarketPrice])
 
 # ------------------------------------------------------------------
 #                            IMMUTABLES
@@ -19,37 +33,102 @@ authorized_oracle_updater: public(immutable(address))
 # ------------------------------------------------------------------
 STALE_TIME: constant(uint256) = 3600
 PRICE_SCALE: constant(uint256) = 10**6
+MAX_BATCH: constant(uint256) = 256
+# market served by the single-market functions below
+DEFAULT_MARKET: constant(uint256) = 0
 
 @deploy
 def __init__(_oracle_price: uint256, _authorized_oracle_updater: address, _perp_price: uint256):
     assert _authorized_oracle_updater != empty(address), "need to include an authorized address to update the oracle"
-    self.oracle_price = _oracle_price
-    self.perp_price = _perp_price
-    self.last_update_time = block.timestamp
+    self.markets[DEFAULT_MARKET].oracle_price = _oracle_price
+    self.markets[DEFAULT_MARKET].perp_price = _perp_price
+    self.markets[DEFAULT_MARKET].last_update_time = block.timestamp
     authorized_oracle_updater = _authorized_oracle_updater
 
+@internal
+@view
+def _get_oracle_price(_market_id: uint256) -> uint256:
+    assert block.timestamp - self.markets[_market_id].last_update_time <= STALE_TIME, "oracle has not been updated recently"
+    return self.markets[_market_id].oracle_price
+
+@internal
+@view
+def _get_perp_price(_market_id: uint256) -> uint256:
+    assert block.timestamp - self.markets[_market_id].last_update_time <= STALE_TIME, "oracle has not been updated recently"
+    return self.markets[_market_id].perp_price
+
+# refreshes up to MAX_BATCH markets in one transaction. _fields[i] says which of
+# market i's prices are written, so a keeper can push only oracle or only perp
+# prices and the other side is left alone; any price, 0 included, can be written
+@external
+def update_prices(_market_ids: DynArray[uint256, MAX_BATCH], _oracle_prices: DynArray[uint256, MAX_BATCH], _perp_prices: DynArray[uint256, MAX_BATCH], _fields: DynArray[PriceField, MAX_BATCH]):
+    assert msg.sender == authorized_oracle_updater, "not authorized to update oracle"
+    assert len(_oracle_prices) == len(_market_ids) and len(_perp_prices) == len(_market_ids) and len(_fields) == len(_market_ids), "length mismatch"
+
+    for i: uint256 in range(len(_market_ids), bound=MAX_BATCH):
+        market_id: uint256 = _market_ids[i]
+        oracle_price: uint256 = _oracle_prices[i]
+        perp_price: uint256 = _perp_prices[i]
+        if PriceField.ORACLE in _fields[i]:
+            assert oracle_price <= PRICE_SCALE, "price > 1e6"
+            self.markets[market_id].oracle_price = oracle_price
+            self.markets[market_id].last_update_time = block.timestamp
+        if PriceField.PERP in _fields[i]:
+            assert perp_price <= PRICE_SCALE, "price > 1e6"
+            self.markets[market_id].perp_price = perp_price
+            self.markets[market_id].last_update_time_perp = block.timestamp
+
 @external
 def update_oracle(_oracle_price: uint256):
     assert msg.sender == authorized_oracle_updater, "not authorized to update oracle"
     assert _oracle_price <= PRICE_SCALE, "price > 1e6"
-    self.oracle_price = _oracle_price
-    self.last_update_time = block.timestamp
+    self.markets[DEFAULT_MARKET].oracle_price = _oracle_price
+    self.markets[DEFAULT_MARKET].last_update_time = block.timestamp
 
 @external
 def update_perp(_perp_price: uint256):
     assert msg.sender == authorized_oracle_updater, "not authorized to update oracle"
     assert _perp_price <= PRICE_SCALE, "price > 1e6"
-    self.perp_price = _perp_price
-    self.last_update_time_perp = block.timestamp
+    self.markets[DEFAULT_MARKET].perp_price = _perp_price
+    self.markets[DEFAULT_MARKET].last_update_time_perp = block.timestamp
+
+@external
+@view
+def get_market_oracle_price(_market_id: uint256) -> uint256:
+    return self._get_oracle_price(_market_id)
+
+@external
+@view
+def get_market_perp_price(_market_id: uint256) -> uint256:
+    return self._get_perp_price(_market_id)
 
 @external
 @view
 def get_oracle_price() -> uint256:
-    assert block.timestamp - self.last_update_time <= STALE_TIME, "oracle has not been updated recently"
-    return self.oracle_price
+    return self._get_oracle_price(DEFAULT_MARKET)
 
 @external
 @view
 def get_perp_price() -> uint256:
-    assert block.timestamp - self.last_update_time <= STALE_TIME, "oracle has not been updated recently"
-    return self.perp_price
\ No newline at end of file
+    return self._get_perp_price(DEFAULT_MARKET)
+
+# single-market getters, these used to be public storage variables
+@external
+@view
+def oracle_price() -> uint256:
+    return self.markets[DEFAULT_MARKET].oracle_price
+
+@external
+@view
+def perp_price() -> uint256:
+    return self.markets[DEFAULT_MARKET].perp_price
+
+@external
+@view
+def last_update_time() -> uint256:
+    return self.markets[DEFAULT_MARKET].last_update_time
+
+@external
+@view
+def last_update_time_perp() -> uint256:
+    return self.markets[DEFAULT_MARKET].last_update_time_perp
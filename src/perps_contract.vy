@@ -16,7 +16,56 @@ interface VAULT:
     def receive_margin(_amount: uint256) -> bool: nonpayable
 
 interface ORACLE:
-    def get_perp_price() -> uint256: view
+    def get_market_perp_price(_market_id: uint256) -> uint256: view
+
+# ------------------------------------------------------------------
+#                              EVENTS
+# ------------------------------------------------------------------
+# every state change an off-chain indexer has to mirror, prices and margins in contract units
+event LimitOrderAdded:
+    trader: indexed(address)
+    leverage: uint256
+    margin: uint256
+    price: uint256
+    quantity: uint256
+    direction: bool
+
+event LimitOrderReplaced:
+    trader: indexed(address)
+    margin: uint256
+    price: uint256
+    quantity: uint256
+
+event LimitOrderClosed:
+    trader: indexed(address)
+
+event LimitOrderFilled:
+    trader: indexed(address)
+    quantity: uint256
+    price: uint256
+
+event PositionOpened:
+    trader: indexed(address)
+    margin: uint256
+    leverage: uint256
+    entry_price: uint256
+    direction: bool
+    funding_index_snapshot: int256
+
+event PositionClosed:
+    trader: indexed(address)
+    price: uint256
+    pnl: int256 # net of funding
+
+event PositionLiquidated:
+    trader: indexed(address)
+    liquidator: indexed(address)
+    equity: int256
+
+event FundingUpdated:
+    funding_index: int256
+    funding_rate_per_second: int256
+    timestamp: uint256
 
 # ------------------------------------------------------------------
 #                              STATE
@@ -44,6 +93,10 @@ OWNER: public(immutable(address))
 # ------------------------------------------------------------------
 FUNDING_SCALE: constant(uint256) = 10**18
 MAX_ELAPSED: constant(uint256) = 86400
+# accounts per call to the batch views, sized to stay well inside an eth_call gas cap
+MAX_VIEW_BATCH: constant(uint256) = 1000
+# limit orders per expire_limit_orders call, each one refunds its margin
+MAX_EXPIRE_BATCH: constant(uint256) = 100
 
 # ------------------------------------------------------------------
 #                              STRUCT
@@ -87,12 +140,14 @@ def __init__(_authorized_vault_address: address, _market_id: uint256, _market_na
     self.last_funding_timestamp = block.timestamp
 
 @internal
+@view
 def _get_perp_price() -> uint256:
-    return staticcall ORACLE(oracle_address).get_perp_price()
+    return staticcall ORACLE(oracle_address).get_market_perp_price(market_id)
 
 @internal
-def _get_funding_impact(pos: Position) -> int256:
-    delta_index: int256 = self.funding_index - pos.funding_index_snapshot
+@view
+def _get_funding_impact(pos: Position, _funding_index: int256) -> int256:
+    delta_index: int256 = _funding_index - pos.funding_index_snapshot
     impact: int256 = (convert(pos.size, int256) * delta_index) // convert(FUNDING_SCALE, int256)
     if pos.direction: 
         impact = -impact
@@ -110,15 +165,25 @@ def _integrate_funding():
     self.funding_index += self.funding_rate_per_second * convert(elapsed, int256)
     self.last_funding_timestamp = block.timestamp
 
+# funding_index as _integrate_funding would leave it in this block, for views
+@internal
+@view
+def _pending_funding_index() -> int256:
+    elapsed: uint256 = min(block.timestamp - self.last_funding_timestamp, MAX_ELAPSED)
+    return self.funding_index + self.funding_rate_per_second * convert(elapsed, int256)
+
 @internal
+@view
 def _calculate_health_factor(_address: address) -> int256:
     assert _address != empty(address), "No address provided"
     assert self.positions[_address].is_open, "No position open for address"
 
-    pos: Position = self.positions[_address]
+    return self._equity(self.positions[_address], self._get_perp_price(), self.funding_index)
 
+@internal
+@view
+def _equity(pos: Position, mark_price: uint256, _funding_index: int256) -> int256:
     entry_price: uint256 = pos.entry_price
-    mark_price: uint256 = self._get_perp_price()
     margin: uint256 = pos.margin
     leverage: uint256 = pos.leverage
 
@@ -129,17 +194,66 @@ def _calculate_health_factor(_address: address) -> int256:
     if not pos.direction:
         pnl = -pnl
 
-    funding_impact: int256 = self._get_funding_impact(pos)
+    funding_impact: int256 = self._get_funding_impact(pos, _funding_index)
     equity: int256 = convert(margin, int256) + pnl - funding_impact
 
     return equity
 
+# ------------------------------------------------------------------
+#                           BATCH VIEWS
+# ------------------------------------------------------------------
+# one eth_call for a whole chunk of accounts, results line up with _addresses
+
+@external
+@view
+def get_positions(_addresses: DynArray[address, MAX_VIEW_BATCH]) -> DynArray[Position, MAX_VIEW_BATCH]:
+    result: DynArray[Position, MAX_VIEW_BATCH] = []
+    for trader: address in _addresses:
+        result.append(self.positions[trader])
+    return result
+
+@external
+@view
+def get_limit_orders(_addresses: DynArray[address, MAX_VIEW_BATCH]) -> DynArray[LimitOrder, MAX_VIEW_BATCH]:
+    result: DynArray[LimitOrder, MAX_VIEW_BATCH] = []
+    for trader: address in _addresses:
+        result.append(self.limit_orders[trader])
+    return result
+
+# equity as liquidate() would compute it in this block, 0 for accounts without an open position.
+# empty while the oracle is stale, so a batch read of positions and orders still goes through
+@external
+@view
+def get_equities(_addresses: DynArray[address, MAX_VIEW_BATCH]) -> DynArray[int256, MAX_VIEW_BATCH]:
+    result: DynArray[int256, MAX_VIEW_BATCH] = []
+    success: bool = False
+    response: Bytes[32] = b""
+    success, response = raw_call(
+        oracle_address,
+        abi_encode(market_id, method_id=method_id("get_market_perp_price(uint256)")),
+        max_outsize=32,
+        is_static_call=True,
+        revert_on_failure=False
+    )
+    if not success:
+        return result
+    mark_price: uint256 = abi_decode(response, uint256)
+    funding_index: int256 = self._pending_funding_index()
+    for trader: address in _addresses:
+        pos: Position = self.positions[trader]
+        if pos.is_open:
+            result.append(self._equity(pos, mark_price, funding_index))
+        else:
+            result.append(0)
+    return result
+
 @external
 @nonreentrant
 def add_limit_order(_leverage: uint256, _margin: uint256, _price: uint256, _quantity: uint256, _direction: bool):
     assert _leverage > 0, "leverage cannot be <= 0"
     assert _margin > 0, "margin must be > 0"
     assert _price > 0, "price cannot be <= 0"
+    assert _quantity > 0, "quantity must be > 0"
     assert not self.positions[msg.sender].is_open, "cannot open limit with existing open position"
     assert not self.limit_orders[msg.sender].is_open, "already have a limit order placed"
 
@@ -160,6 +274,7 @@ def add_limit_order(_leverage: uint256, _margin: uint256, _price: uint256, _quan
     )
 
     self.limit_orders[msg.sender] = limit_order
+    log LimitOrderAdded(trader=msg.sender, leverage=_leverage, margin=_margin, price=_price, quantity=_quantity, direction=_direction)
 
 @external
 @nonreentrant
@@ -177,6 +292,58 @@ def close_limit_order():
 
     success: bool = extcall ERC20(margin_token_address).transfer(msg.sender, margin_to_send_back)
     assert success, "failed to return limit order margin"
+    log LimitOrderClosed(trader=msg.sender)
+
+@external
+@nonreentrant
+def expire_limit_orders(_addresses: DynArray[address, MAX_EXPIRE_BATCH]):
+    # the engine's batched close_limit_order for good-till-time orders past their expiry
+    assert msg.sender == authorized_matching_engine
+
+    for trader: address in _addresses:
+        # filled or cancelled since the engine expired it, nothing to refund
+        if not self.limit_orders[trader].is_open:
+            continue
+
+        margin_to_send_back: uint256 = self.limit_orders[trader].margin
+
+        self.limit_orders[trader].leverage = 0
+        self.limit_orders[trader].margin = 0
+        self.limit_orders[trader].price = 0
+        self.limit_orders[trader].quantity = 0
+        self.limit_orders[trader].is_open = False
+        self.limit_orders[trader].timestamp = 0
+
+        success: bool = extcall ERC20(margin_token_address).transfer(trader, margin_to_send_back)
+        assert success, "failed to return limit order margin"
+        log LimitOrderClosed(trader=trader)
+
+@external
+@nonreentrant
+def replace_limit_order(_margin: uint256, _price: uint256, _quantity: uint256):
+    assert self.limit_orders[msg.sender].is_open, "no limit orders open"
+    assert _margin > 0, "margin must be > 0"
+    assert _price > 0, "price cannot be <= 0"
+    assert _quantity > 0, "quantity must be > 0"
+
+    current_margin: uint256 = self.limit_orders[msg.sender].margin
+
+    self.limit_orders[msg.sender].margin = _margin
+    self.limit_orders[msg.sender].price = _price
+    self.limit_orders[msg.sender].quantity = _quantity
+    self.limit_orders[msg.sender].timestamp = block.timestamp
+    log LimitOrderReplaced(trader=msg.sender, margin=_margin, price=_price, quantity=_quantity)
+
+    # only the margin delta moves, the rest stays escrowed in the contract
+    if _margin > current_margin:
+        margin_delta: uint256 = _margin - current_margin
+        allowed: uint256 = staticcall ERC20(margin_token_address).allowance(msg.sender, self)
+        assert allowed >= margin_delta
+        success: bool = extcall ERC20(margin_token_address).transferFrom(msg.sender, self, margin_delta)
+        assert success
+    elif _margin < current_margin:
+        success: bool = extcall ERC20(margin_token_address).transfer(msg.sender, current_margin - _margin)
+        assert success, "failed to return limit order margin"
 
 @external
 @nonreentrant
@@ -248,6 +415,10 @@ def fill_limit_order(_address: address, _quantity_to_fill: uint256):
         self.limit_orders[_address].is_open = False
         self.limit_orders[_address].timestamp = 0
 
+    filled: Position = self.positions[_address]
+    log LimitOrderFilled(trader=_address, quantity=_quantity_to_fill, price=current_position.price)
+    log PositionOpened(trader=_address, margin=filled.margin, leverage=filled.leverage, entry_price=filled.entry_price, direction=filled.direction, funding_index_snapshot=filled.funding_index_snapshot)
+
 @external
 @nonreentrant
 def open_position(_margin: uint256, _leverage: uint256, _direction: bool, _price: uint256):
@@ -286,6 +457,7 @@ def open_position(_margin: uint256, _leverage: uint256, _direction: bool, _price
     )
 
     self.positions[msg.sender] = new_positions
+    log PositionOpened(trader=msg.sender, margin=_margin, leverage=_leverage, entry_price=_entry_price, direction=_direction, funding_index_snapshot=self.funding_index)
 
 @external
 @nonreentrant
@@ -297,7 +469,7 @@ def close_position(_address: address, _price: uint256):
 
     current_position: Position = self.positions[_address]
     current_price: uint256 = _price
-    funding_impact: int256 = self._get_funding_impact(self.positions[_address])
+    funding_impact: int256 = self._get_funding_impact(self.positions[_address], self.funding_index)
     assert current_position.entry_price > 0, "Bad entry price"
     price_differential: int256 = convert(current_price, int256) - convert(current_position.entry_price, int256)
     pnl: int256 = 0
@@ -338,6 +510,7 @@ def close_position(_address: address, _price: uint256):
         self.positions[_address].is_open = False
         self.positions[_address].size = 0
         self.positions[_address].entry_price = 0
+        log PositionClosed(trader=_address, price=current_price, pnl=adjusted_pnl)
         return
 
     if profit > 0:
@@ -359,6 +532,7 @@ def close_position(_address: address, _price: uint256):
     self.positions[_address].is_open = False
     self.positions[_address].size = 0
     self.positions[_address].entry_price = 0
+    log PositionClosed(trader=_address, price=current_price, pnl=adjusted_pnl)
 
 @external
 @nonreentrant
@@ -387,9 +561,11 @@ def liquidate(_address: address):
 
         success: bool = extcall VAULT(authorized_vault_address).payout(msg.sender, reward)
         assert success, "Failed to payout reward"
+        log PositionLiquidated(trader=_address, liquidator=msg.sender, equity=user_equity)
 
 @external
 def update_funding(_new_rate_per_second: int256):
     assert msg.sender == authorized_funding_updater, "Only authorized funding updater can update funding"
     self._integrate_funding()
-    self.funding_rate_per_second = _new_rate_per_second
\ No newline at end of file
+    self.funding_rate_per_second = _new_rate_per_second
+    log FundingUpdated(funding_index=self.funding_index, funding_rate_per_second=_new_rate_per_second, timestamp=block.timestamp)
\ No newline at end of file
@@ -0,0 +1,412 @@
+# tests/test_keeper.py
+
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import boa
+import pytest
+import rlp
+from eth_account import Account
+from web3 import AsyncWeb3
+from web3.providers.async_base import AsyncBaseProvider
+from vyper.compiler.output import build_abi_output
+
+from keeper import oracle_update_script as oracle_keeper
+
+KEEPER_KEY = "0x" + "11" * 32
+ORACLE_ABI = build_abi_output(boa.load_partial("src/oracle.vy").compiler_data)
+# pushes every price every cycle
+ALWAYS = oracle_keeper.UpdatePolicy(deviation_bps=0, heartbeat=0)
+ORACLE_A = "0x00000000000000000000000000000000000000a1"
+ORACLE_B = "0x00000000000000000000000000000000000000b2"
+
+
+# ---------------------------------------------------------------------
+#  Local stand-ins for Polymarket and the RPC node
+# ---------------------------------------------------------------------
+class FakePolymarket(ThreadingHTTPServer):
+    """Gamma slug lookups + CLOB (batch) midpoints over keep-alive HTTP/1.1."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakePolymarketHandler)
+        self.tokens = {}
+        self.midpoints = {}
+        self.connections = 0
+        self.requests = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakePolymarketHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests.append(url.path)
+        if url.path.startswith("/events/slug/"):
+            slug = url.path.rsplit("/", 1)[-1]
+            token = self.server.tokens.get(slug)
+            body = {"markets": [{"clobTokenIds": json.dumps([token, f"{token}-no"])}]} if token else None
+        elif url.path == "/midpoint":
+            token = parse_qs(url.query)["token_id"][0]
+            mid = self.server.midpoints.get(token)
+            body = {"mid": mid} if mid is not None else None
+        else:
+            body = None
+        self.respond(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.server.requests.append(url.path)
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if url.path == "/midpoints":
+            # like the CLOB, unknown tokens are left out of the response
+            body = {
+                entry["token_id"]: self.server.midpoints[entry["token_id"]]
+                for entry in request if entry["token_id"] in self.server.midpoints
+            }
+        else:
+            body = None
+        self.respond(body)
+
+    def respond(self, body):
+        payload = json.dumps(body if body is not None else {"error": "not found"}).encode()
+        self.send_response(200 if body is not None else 404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class RecordingProvider(AsyncBaseProvider):
+    def __init__(self, start_nonce: int = 5, fail_sends: int = 0, onchain: dict | None = None):
+        super().__init__()
+        self.calls = []
+        self.raw_transactions = []
+        self.start_nonce = start_nonce
+        self.fail_sends = fail_sends
+        # oracle address -> market 0's (oracle_price, last_update_time), anything else reads as never updated
+        self.onchain = onchain or {}
+
+    async def make_request(self, method, params):
+        self.calls.append(method)
+        if method == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(31337)}
+        if method == "eth_getTransactionCount":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(self.start_nonce + len(self.raw_transactions))}
+        if method == "eth_sendRawTransaction":
+            if self.fail_sends:
+                self.fail_sends -= 1
+                return {"jsonrpc": "2.0", "id": 1, "error": {"code": -32000, "message": "nonce too low"}}
+            self.raw_transactions.append(params[0])
+            return {"jsonrpc": "2.0", "id": 1, "result": "0x" + f"{len(self.raw_transactions):064x}"}
+        if method == "eth_call":
+            price, updated = self.onchain.get(params[0]["to"].lower(), (0, 0))
+            # markets(id) -> (oracle_price, perp_price, last_update_time, last_update_time_perp)
+            return {"jsonrpc": "2.0", "id": 1, "result": "0x" + "".join(f"{v:064x}" for v in (price, 0, updated, 0))}
+        raise AssertionError(f"unexpected RPC {method}")
+
+    async def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+    def sent(self) -> list:
+        """(nonce, to, calldata) of every accepted legacy transaction."""
+        decoded = []
+        for raw in self.raw_transactions:
+            nonce, _gas_price, _gas, to, _value, data, *_sig = rlp.decode(bytes.fromhex(raw[2:]))
+            decoded.append((int.from_bytes(nonce, "big"), "0x" + to.hex(), data))
+        return decoded
+
+
+@pytest.fixture
+def polymarket(monkeypatch, tmp_path):
+    server = FakePolymarket()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(oracle_keeper, "POLYMARKET_BASE_API", f"{server.url}/events/slug/")
+    monkeypatch.setattr(oracle_keeper, "POLYMARKET_CLOB_API", server.url)
+    monkeypatch.setattr(oracle_keeper, "ORACLE_ABI", json.dumps(ORACLE_ABI))
+    monkeypatch.setattr(oracle_keeper, "TOKEN_CACHE_PATH", str(tmp_path / "tokens.json"))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run_keeper(provider, markets, cycles: int = 1, token_cache=None, policy=ALWAYS):
+    async def _run():
+        w3 = AsyncWeb3(provider)
+        async with oracle_keeper.make_http_client() as client:
+            keeper = oracle_keeper.OracleKeeper(w3, client, markets, KEEPER_KEY, token_cache, policy)
+            await keeper.setup()
+            sent = [await keeper.run_cycle() for _ in range(cycles)]
+            return keeper, sent
+
+    return asyncio.run(_run())
+
+
+def update_calldata(market_ids: list, prices: list) -> bytes:
+    contract = AsyncWeb3().eth.contract(abi=ORACLE_ABI)
+    return bytes.fromhex(contract.encode_abi("update_prices", args=[market_ids, prices, [0] * len(prices), [oracle_keeper.UPDATE_ORACLE] * len(prices)])[2:])
+
+
+# ---------------------------------------------------------------------
+#  Tests
+# ---------------------------------------------------------------------
+def test_parse_midpoint_handles_strings():
+    assert oracle_keeper.parse_midpoint("0.235") == 235000
+    assert oracle_keeper.parse_midpoint(0.5) == 500000
+    assert oracle_keeper.parse_midpoint("~0.41") == 410000
+    with pytest.raises(ValueError):
+        oracle_keeper.parse_midpoint(None)
+
+
+def test_keeper_imports_without_env():
+    env = {key: value for key, value in os.environ.items()
+           if key not in ("ORACLE_ABI", "ORACLE_ADDRESS", "PRIVATE_KEY", "RPC_URL")}
+    result = subprocess.run([sys.executable, "-c", "import keeper.oracle_update_script"],
+                            env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_keeper_pipelines_updates_for_many_markets(polymarket):
+    polymarket.tokens = {"alpha": "tok-a", "beta": "tok-b"}
+    polymarket.midpoints = {"tok-a": "0.41", "tok-b": "0.62"}
+    provider = RecordingProvider(start_nonce=5)
+    markets = [oracle_keeper.Market("alpha", ORACLE_A), oracle_keeper.Market("beta", ORACLE_B)]
+
+    keeper, sent = run_keeper(provider, markets, cycles=2)
+
+    assert sent == [2, 2]
+    assert [nonce for nonce, _, _ in provider.sent()] == [5, 6, 7, 8]
+    nonce, to, data = provider.sent()[0]
+    assert to == ORACLE_A
+    assert data == update_calldata([0], [410000])
+    assert provider.sent()[1][1] == ORACLE_B
+    # the nonce is read once and sends never re-read the chain id, every tx only costs the send
+    first_send = provider.calls.index("eth_sendRawTransaction")
+    assert set(provider.calls[first_send:]) == {"eth_sendRawTransaction"}
+    assert provider.calls.count("eth_getTransactionCount") == 1
+    assert markets[1].last_price == 620000
+
+
+def test_keeper_reuses_pooled_connections(polymarket):
+    polymarket.tokens = {f"m{i}": f"tok-{i}" for i in range(4)}
+    polymarket.midpoints = {f"tok-{i}": "0.5" for i in range(4)}
+    markets = [oracle_keeper.Market(f"m{i}", ORACLE_A) for i in range(4)]
+
+    run_keeper(RecordingProvider(), markets, cycles=3)
+
+    # 4 slug lookups + one batched midpoint request per cycle, over at most one
+    # connection per concurrent request
+    assert polymarket.requests.count("/midpoints") == 3
+    assert len(polymarket.requests) == 7
+    assert polymarket.connections <= 4
+
+
+def test_keeper_chunks_midpoint_batches(polymarket, monkeypatch):
+    monkeypatch.setattr(oracle_keeper, "MIDPOINT_BATCH_SIZE", 2)
+    polymarket.tokens = {f"m{i}": f"tok-{i}" for i in range(5)}
+    polymarket.midpoints = {f"tok-{i}": f"0.{i + 1}" for i in range(5)}
+    markets = [oracle_keeper.Market(f"m{i}", ORACLE_A) for i in range(5)]
+
+    keeper, sent = run_keeper(RecordingProvider(), markets)
+
+    assert sent == [5]
+    assert polymarket.requests.count("/midpoints") == 3
+    assert [market.last_price for market in markets] == [100000, 200000, 300000, 400000, 500000]
+
+
+def test_keeper_batches_markets_sharing_an_oracle(polymarket, monkeypatch):
+    monkeypatch.setattr(oracle_keeper, "MAX_BATCH", 3)
+    polymarket.tokens = {f"m{i}": f"tok-{i}" for i in range(5)}
+    polymarket.midpoints = {f"tok-{i}": f"0.{i + 1}" for i in range(5)}
+    markets = [oracle_keeper.Market(f"m{i}", ORACLE_A, market_id=10 + i) for i in range(4)]
+    markets.append(oracle_keeper.Market("m4", ORACLE_B, market_id=0))
+    provider = RecordingProvider()
+
+    keeper, sent = run_keeper(provider, markets)
+
+    # ORACLE_A's four markets split at MAX_BATCH, ORACLE_B gets its own transaction
+    assert sent == [5]
+    assert [(nonce, to) for nonce, to, _ in provider.sent()] == [(5, ORACLE_A), (6, ORACLE_A), (7, ORACLE_B)]
+    assert provider.sent()[0][2] == update_calldata([10, 11, 12], [100000, 200000, 300000])
+    assert provider.sent()[1][2] == update_calldata([13], [400000])
+
+
+def test_keeper_caches_token_ids_on_disk(polymarket, tmp_path):
+    polymarket.tokens = {"alpha": "tok-a", "beta": "tok-b"}
+    polymarket.midpoints = {"tok-a": "0.41", "tok-b": "0.62"}
+    path = str(tmp_path / "cache.json")
+
+    def lookups(ttl):
+        before = len(polymarket.requests)
+        markets = [oracle_keeper.Market("alpha", ORACLE_A), oracle_keeper.Market("beta", ORACLE_B)]
+        run_keeper(RecordingProvider(), markets, token_cache=oracle_keeper.TokenCache(path, ttl))
+        assert [market.token_id for market in markets] == ["tok-a", "tok-b"]
+        return sum(1 for request in polymarket.requests[before:] if request.startswith("/events/slug/"))
+
+    assert lookups(ttl=3600) == 2
+    # a restart reads the file instead of hitting the gamma API
+    assert lookups(ttl=3600) == 0
+    # expired entries are resolved again
+    assert lookups(ttl=0) == 2
+
+
+def test_update_policy_deviation_and_heartbeat():
+    policy = oracle_keeper.UpdatePolicy(deviation_bps=50, heartbeat=1800)
+    market = oracle_keeper.Market("alpha", ORACLE_A)
+    assert policy.reason(market, 500000, 1000.0) == "initial"
+
+    market.last_price, market.last_update = 500000, 1000.0
+    assert policy.reason(market, 502500, 1100.0) is None  # exactly 50 bps
+    assert policy.reason(market, 497000, 1100.0) == "deviation"
+    assert policy.reason(market, 500000, 2800.0) == "heartbeat"
+
+    with pytest.raises(ValueError):
+        oracle_keeper.UpdatePolicy(deviation_bps=50, heartbeat=oracle_keeper.STALE_TIME)
+
+
+def test_keeper_skips_updates_within_deviation(polymarket):
+    polymarket.tokens = {"flat": "tok-f", "moved": "tok-m", "old": "tok-o"}
+    polymarket.midpoints = {"tok-f": "0.41", "tok-m": "0.62", "tok-o": "0.30"}
+    now = int(time.time())
+    oracle_c = "0x00000000000000000000000000000000000000c3"
+    provider = RecordingProvider(onchain={
+        ORACLE_A: (410000, now - 60),
+        ORACLE_B: (600000, now - 60),
+        oracle_c: (300000, now - 2000),
+    })
+    markets = [
+        oracle_keeper.Market("flat", ORACLE_A),
+        oracle_keeper.Market("moved", ORACLE_B),
+        oracle_keeper.Market("old", oracle_c),
+    ]
+
+    keeper, sent = run_keeper(provider, markets, cycles=2, policy=oracle_keeper.UpdatePolicy(50, 1800))
+
+    # cycle 1: "moved" deviates, "old" is past the heartbeat; cycle 2: all three are current
+    assert sent == [2, 0]
+    assert [to for _, to, _ in provider.sent()] == [ORACLE_B, oracle_c]
+    assert keeper.stats.sent == 2
+    assert keeper.stats.skipped == 4
+    assert 2000 <= keeper.stats.max_staleness < 2100
+    assert markets[0].last_update == now - 60
+    assert markets[1].last_price == 620000
+
+
+def test_keeper_skips_resolved_and_failed_markets(polymarket):
+    polymarket.tokens = {"live": "tok-live", "done": "tok-done", "flaky": "tok-flaky"}
+    polymarket.midpoints = {"tok-live": "0.3", "tok-done": "1"}
+    provider = RecordingProvider()
+    markets = [
+        oracle_keeper.Market("live", ORACLE_A),
+        oracle_keeper.Market("done", ORACLE_B),
+        oracle_keeper.Market("flaky", ORACLE_B),
+    ]
+
+    keeper, sent = run_keeper(provider, markets)
+
+    assert sent == [1]
+    assert markets[1].resolved
+    assert not markets[2].resolved
+    assert [market.slug for market in keeper.active_markets()] == ["live", "flaky"]
+
+
+def test_keeper_resyncs_nonce_after_rejected_send(polymarket):
+    polymarket.tokens = {"alpha": "tok-a", "beta": "tok-b"}
+    polymarket.midpoints = {"tok-a": "0.41", "tok-b": "0.62"}
+    provider = RecordingProvider(start_nonce=3, fail_sends=1)
+    markets = [oracle_keeper.Market("alpha", ORACLE_A), oracle_keeper.Market("beta", ORACLE_B)]
+
+    keeper, sent = run_keeper(provider, markets)
+
+    # both go out together on nonces 3 and 4, the first is rejected
+    assert sent == [1]
+    assert provider.calls.count("eth_getTransactionCount") == 2
+    assert [nonce for nonce, _, _ in provider.sent()] == [4]
+    assert keeper.nonce == 4
+
+
+# ---------------------------------------------------------------------
+#  anvil integration (skipped when anvil is not installed)
+# ---------------------------------------------------------------------
+ANVIL_KEY = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"
+
+
+@pytest.fixture
+def anvil():
+    if shutil.which("anvil") is None:
+        pytest.skip("anvil not installed")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        ["anvil", "--port", str(port), "--silent"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    yield url
+    process.terminate()
+    process.wait()
+
+
+def test_keeper_updates_oracle_on_anvil(polymarket, anvil):
+    import boa
+    from eth_abi import encode
+    from web3 import Web3
+
+    w3 = Web3(Web3.HTTPProvider(anvil))
+    deployer = Account.from_key(ANVIL_KEY)
+    compiled = boa.load_partial("src/oracle.vy").compiler_data
+    bytecode = compiled.bytecode + encode(["uint256", "address", "uint256"], [500000, deployer.address, 500000])
+    deploy_tx = deployer.sign_transaction({
+        "data": "0x" + bytecode.hex(),
+        "gas": 1_000_000,
+        "gasPrice": w3.to_wei(2, "gwei"),
+        "nonce": w3.eth.get_transaction_count(deployer.address),
+        "chainId": w3.eth.chain_id,
+        "value": 0,
+    })
+    receipt = w3.eth.wait_for_transaction_receipt(w3.eth.send_raw_transaction(deploy_tx.raw_transaction))
+    oracle_address = receipt.contractAddress
+
+    polymarket.tokens = {"alpha": "tok-a"}
+    polymarket.midpoints = {"tok-a": "0.37"}
+
+    async def _run():
+        async_w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(anvil))
+        async with oracle_keeper.make_http_client() as client:
+            keeper = oracle_keeper.OracleKeeper(async_w3, client, [oracle_keeper.Market("alpha", oracle_address)], ANVIL_KEY)
+            await keeper.setup()
+            tx_hash = await keeper.update_oracle(keeper.markets[0], (await keeper.fetch_prices())[0][1])
+            await async_w3.eth.wait_for_transaction_receipt(tx_hash)
+
+    asyncio.run(_run())
+
+    oracle = w3.eth.contract(address=oracle_address, abi=ORACLE_ABI)
+    assert oracle.functions.oracle_price().call() == 370000
@@ -1,5 +1,13 @@
 # tests/test_matching_engine.py
 
+import asyncio
+import io
+import json
+import time
+import threading
+from collections import deque
+import httpx
+import orjson
 import pytest
 from unittest.mock import Mock
 from types import SimpleNamespace
@@ -10,8 +18,16 @@ WEB3_IMPORT_PATHS = (
     "off_chain_systems.matching_engine.Web3",
     "off_chain_systems.position_manager.Web3",
 )
-from off_chain_systems.matching_engine import OrderBook, Side, Status, OrderType
-from off_chain_systems.position_manager import PositionManager, Side as PMSide, Status as PMStatus
+from off_chain_systems.matching_engine import OrderBook, Side, Status, OrderType, TimeInForce, Trade
+from off_chain_systems.position_manager import (
+    PositionManager, FundingIndex, MAX_ELAPSED, Side as PMSide, Status as PMStatus
+)
+from off_chain_systems import metrics, log as tachyon_log, funding_service, indexer, reconciler, matching_engine
+from off_chain_systems.premium_index import PremiumIndex
+from off_chain_systems.price_ladder import TickLadder
+from off_chain_systems.triggers import TriggerIndex, TriggerKind
+from off_chain_systems.timing_wheel import TimingWheel
+from off_chain_systems.admission import RateLimiter, EngineQueue, RateLimited, Overloaded, ENGINE_QUEUE_SIZE
 
 
 # ---------------------------------------------------------------------
@@ -105,6 +121,7 @@ def mock_orderbook():
     ob.send_open_position = Mock(return_value={"tx": "fake_tx"})
     ob.send_close_position = Mock(return_value={"tx": "fake_tx"})
     ob.send_limit_order_removal = Mock(return_value={"tx": "fake_tx"})
+    ob.send_limit_order_replacement = Mock(return_value={"tx": "fake_tx"})
 
     return ob
 
@@ -158,10 +175,25 @@ def api_client(monkeypatch):
         "asks": [{"price": 0.5, "quantity": 2.0}],
     }
     fake_engine.trade_events = [
-        SimpleNamespace(trade_id=1, price=0.44, quantity=1.5),
+        Trade(
+            timestamp=1700000000.0,
+            trade_id=1,
+            price=0.44,
+            quantity=1.5,
+            taker_id="0xTaker",
+            maker_id="0xMaker",
+            taker_side=Side.BUY,
+            taker_fee=0.001,
+            maker_fee=0.0004,
+        ),
     ]
+    fake_engine.version = 1
+    fake_engine.encoded_snapshot = Mock(side_effect=lambda: (fake_engine.version, orjson.dumps(fake_engine.snapshot())))
+    fake_engine.published_snapshot = fake_engine.encoded_snapshot
+    fake_engine.encoded_trades = Mock(side_effect=lambda: (fake_engine.version, orjson.dumps({"trades": fake_engine.trade_events})))
     fake_engine.market_order = Mock()
     fake_engine.remove_limit_order = Mock()
+    fake_engine.replace_limit_order = Mock(return_value=SimpleNamespace(order_id=7))
 
     def _add_limit_order(*args, **kwargs):
         fake_engine.order_id += 1
@@ -180,6 +212,9 @@ def api_client(monkeypatch):
                 leverage=5,
                 margin=20.0,
                 unrealized_pnl=0.0,
+                funding_paid=-0.5,
+                stop_price=0.3,
+                take_profit_price=None,
                 status=Status.OPEN,
                 is_open=True,
             )
@@ -190,6 +225,8 @@ def api_client(monkeypatch):
 
     monkeypatch.setattr(server, "engine", fake_engine)
     monkeypatch.setattr(server, "pm", fake_pm)
+    monkeypatch.setattr(server, "limiter", RateLimiter())
+    monkeypatch.setattr(server, "engine_queue", EngineQueue())
 
     client = TestClient(server.app)
     return client, fake_engine, fake_pm
@@ -264,6 +301,41 @@ def test_add_limit_order_rejects_invalid_prices(mock_orderbook):
     ob.send_limit_order.assert_not_called()
 
 
+def test_limit_prices_must_sit_on_the_tick_grid(mock_orderbook):
+    ob = mock_orderbook
+
+    with pytest.raises(ValueError, match="tick grid"):
+        ob.add_limit_order("0x1", Side.BUY, 0.2505, 1.0, 2)
+    ob.send_limit_order.assert_not_called()
+
+    ob.add_limit_order("0x1", Side.BUY, 0.25, 1.0, 2)
+    with pytest.raises(ValueError, match="tick grid"):
+        ob.replace_limit_order("0x1", 0.3333, 1.0)
+    ob.send_limit_order_replacement.assert_not_called()
+    assert ob.bids.keys() == [0.25]
+
+
+def test_tick_ladder_finds_best_levels_by_bitmap():
+    ladder = TickLadder(0.01)
+    for price in (0.42, 0.07, 0.93, 0.5):
+        ladder[price] = [price]
+
+    assert len(ladder) == 4
+    assert ladder.peekitem(0) == (0.07, [0.07])
+    assert ladder.peekitem(-1) == (0.93, [0.93])
+    assert ladder.keys() == [0.07, 0.42, 0.5, 0.93]
+    # float noise maps onto the same tick, prices between ticks are never present
+    assert 0.1 * 3 + 0.12 in ladder and 0.425 not in ladder
+
+    del ladder[0.07]
+    del ladder[0.93]
+    assert ladder.peekitem(0)[0] == 0.42 and ladder.peekitem(-1)[0] == 0.5
+    with pytest.raises(KeyError):
+        del ladder[0.93]
+    with pytest.raises(ValueError, match="divide 1"):
+        TickLadder(0.3)
+
+
 def test_remove_limit_order_clears_price_level_when_empty(mock_orderbook):
     ob = mock_orderbook
 
@@ -273,6 +345,193 @@ def test_remove_limit_order_clears_price_level_when_empty(mock_orderbook):
     ob.send_limit_order_removal.assert_called_once()
 
 
+def test_replace_limit_order_moves_order_to_new_level(mock_orderbook):
+    ob = mock_orderbook
+
+    ob.add_limit_order("0x1", Side.BUY, 0.25, 2.0, 2)
+    ob.add_limit_order("0x2", Side.BUY, 0.30, 1.0, 2)
+
+    order = ob.replace_limit_order("0x1", 0.30, 4.0)
+
+    assert 0.25 not in ob.bids
+    assert [o.trader_id for o in ob.bids[0.30]] == ["0x2", "0x1"]
+    assert order.order_id == 1
+    assert order.quantity == pytest.approx(4.0)
+    assert order.margin == pytest.approx((0.30 * 4.0) / 2)
+    ob.send_limit_order_replacement.assert_called_once()
+    ob.send_limit_order_removal.assert_not_called()
+
+
+def test_replace_limit_order_size_decrease_keeps_priority(mock_orderbook):
+    ob = mock_orderbook
+
+    ob.add_limit_order("0x1", Side.SELL, 0.40, 3.0, 2)
+    ob.add_limit_order("0x2", Side.SELL, 0.40, 1.0, 2)
+
+    ob.replace_limit_order("0x1", 0.40, 1.5)
+
+    assert [o.trader_id for o in ob.asks[0.40]] == ["0x1", "0x2"]
+    assert ob.asks[0.40][0].quantity == pytest.approx(1.5)
+
+
+def test_cancelled_orders_are_tombstoned_and_skipped_by_sweeps(mock_orderbook):
+    ob = mock_orderbook
+    makers = [f"0x{i}" for i in range(30)]
+    for maker in makers:
+        ob.add_limit_order(maker, Side.SELL, 0.40, 1.0, 2)
+
+    # cancel the head and every other order behind it, without searching the level
+    for maker in makers[:1] + makers[2:20:2]:
+        ob.remove_limit_order(maker)
+    level = ob.asks[0.40]
+    live = [m for m in makers if m not in makers[:1] + makers[2:20:2]]
+    assert len(level) == len(live) == 20
+    assert [o.trader_id for o in level] == live
+    assert level[0].trader_id == "0x1" and level[-1].trader_id == "0x29"
+    # tombstones are compacted once they outnumber live orders by enough
+    assert len(level.slots) <= 2 * len(level) + 8
+
+    ob.market_order("0xTaker", Side.BUY, 3.0, 2)
+
+    assert [t.maker_id for t in ob.trade_events] == live[:3]
+    assert [o.trader_id for o in ob.asks[0.40]] == live[3:]
+    assert set(ob.open_orders) == set(live[3:])
+    with pytest.raises(ValueError, match="No open limit order"):
+        ob.remove_limit_order("0x1")
+
+
+def test_replace_limit_order_requires_open_order(mock_orderbook):
+    ob = mock_orderbook
+
+    with pytest.raises(ValueError, match="No open limit order"):
+        ob.replace_limit_order("0x1", 0.40, 1.0)
+    ob.send_limit_order_replacement.assert_not_called()
+
+
+def test_apply_batch_returns_per_command_results(mock_orderbook, register_account):
+    ob = mock_orderbook
+    register_account("0xMaker")
+    register_account("0xTaker")
+
+    results = ob.apply_batch([
+        {"type": "limit", "trader_address": "0xMaker", "direction": "sell", "price": 0.40, "quantity": 1.0, "leverage": 2},
+        {"type": "limit", "trader_address": "0xQuoter", "direction": "buy", "price": 1.5, "quantity": 1.0, "leverage": 2},
+        {"type": "market", "trader_address": "0xTaker", "direction": "buy", "quantity": 1.0, "leverage": 2},
+        {"type": "cancel", "trader_address": "0xNobody"},
+        {"type": "limit", "trader_address": "0xQuoter", "direction": "buy", "price": 0.30},
+    ])
+
+    assert [r["status"] for r in results] == ["ok", "error", "ok", "error", "error"]
+    assert results[0]["order_id"] == 1
+    assert results[1]["error"] == "Cannot set limit at 1"
+    assert results[2]["trade_ids"] == [1]
+    assert results[4]["error"] == "Missing field: quantity"
+    assert not ob.asks
+
+
+def test_encoded_snapshot_is_reused_until_book_changes(mock_orderbook):
+    ob = mock_orderbook
+    ob.add_limit_order("0x1", Side.BUY, 0.25, 1.0, 2)
+
+    version, body = ob.encoded_snapshot()
+    assert orjson.loads(body) == {"bids": [[0.25, 1.0]], "asks": []}
+    assert ob.encoded_snapshot()[1] is body
+
+    ob.add_limit_order("0x2", Side.SELL, 0.40, 1.0, 2)
+    new_version, new_body = ob.encoded_snapshot()
+    assert new_version > version
+    assert orjson.loads(new_body)["asks"] == [[0.40, 1.0]]
+
+    ob.remove_limit_order("0x2")
+    assert ob.encoded_snapshot()[0] > new_version
+
+
+def test_published_snapshot_moves_only_on_publish(mock_orderbook):
+    ob = mock_orderbook
+    assert orjson.loads(ob.published_snapshot()[1]) == {"bids": [], "asks": []}
+
+    # readers on other threads keep the last published copy while the book changes under it
+    ob.add_limit_order("0x1", Side.BUY, 0.25, 1.0, 2)
+    assert orjson.loads(ob.published_snapshot()[1]) == {"bids": [], "asks": []}
+
+    ob.publish_snapshot()
+    version, body = ob.published_snapshot()
+    assert (version, orjson.loads(body)) == (ob.version, {"bids": [[0.25, 1.0]], "asks": []})
+
+
+def test_metrics_record_stages_and_outcomes(mock_orderbook, register_account):
+    ob = mock_orderbook
+    register_account("0xMaker")
+    register_account("0xTaker")
+
+    def stage_count(name):
+        counts, _ = metrics.ORDER_STAGE_SECONDS.labels(name).snapshot()
+        return sum(counts)
+
+    before = {name: stage_count(name) for name in ("validation", "match", "position_update")}
+    ok_before = metrics.ORDERS_TOTAL.labels("market", "ok").value
+    rejected_before = metrics.ORDERS_TOTAL.labels("market", "rejected").value
+
+    ob.add_limit_order("0xMaker", Side.SELL, 0.40, 1.0, 2)
+    ob.pm.get_perp_price.return_value = 0.40
+    ob.market_order("0xTaker", Side.BUY, 1.0, 2)
+
+    assert stage_count("validation") == before["validation"] + 2
+    assert stage_count("match") == before["match"] + 1
+    # maker fill + taker position
+    assert stage_count("position_update") == before["position_update"] + 2
+    assert metrics.ORDERS_TOTAL.labels("market", "ok").value == ok_before + 1
+
+    with pytest.raises(ValueError):
+        ob.market_order("0xTaker", Side.BUY, 1.0, 2)
+    assert metrics.ORDERS_TOTAL.labels("market", "rejected").value == rejected_before + 1
+
+
+def test_metrics_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "Test histogram.", ("stage",), (0.001, 0.01))
+    histogram.labels("match").observe(0.0005)
+    histogram.labels("match").observe(0.005)
+    histogram.labels("match").observe(1.0)
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="match",le="0.001"} 1' in lines
+    assert 'test_seconds_bucket{stage="match",le="0.01"} 2' in lines
+    assert 'test_seconds_bucket{stage="match",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="match"} 3' in lines
+
+
+def test_metrics_stage_time_is_exclusive_of_nested_stages():
+    outer = metrics.StageTimer(metrics._HistogramChild([10**9]))
+    inner = metrics.StageTimer(metrics._HistogramChild([10**9]))
+
+    with outer:
+        with inner:
+            time.sleep(0.02)
+
+    _, outer_ns = outer._child.snapshot()
+    _, inner_ns = inner._child.snapshot()
+    assert inner_ns >= 20_000_000
+    assert outer_ns < inner_ns
+
+
+def test_engine_logs_structured_json_off_thread(mock_orderbook):
+    buffer = io.StringIO()
+    tachyon_log.configure("INFO", "json", buffer)
+    try:
+        ob = mock_orderbook
+        ob.add_limit_order("0xLogger", Side.BUY, 0.25, 1.0, 2)
+        ob.remove_limit_order("0xLogger")
+        tachyon_log.flush()
+    finally:
+        tachyon_log.configure()
+
+    entries = [json.loads(line) for line in buffer.getvalue().splitlines()]
+    removed = next(entry for entry in entries if entry["msg"].startswith("Removed limit order"))
+    assert removed["level"] == "info"
+    assert removed["logger"] == "tachyon.matching_engine"
+    assert removed["trader"] == "0xLogger"
+
+
 def test_market_order_buy_consumes_levels_and_opens_position(mock_orderbook, register_account):
     ob = mock_orderbook
     register_account("0xMakerA")
@@ -305,7 +564,8 @@ def test_market_order_buy_consumes_levels_and_opens_position(mock_orderbook, reg
     assert total_qty == pytest.approx(3.0)
     assert avg_price == pytest.approx((0.40 * 1.0 + 0.45 * 2.0) / 3.0)
     assert leverage == 5
-    expected_margin = (ob.pm.get_perp_price.return_value * total_qty) / leverage
+    # margin is sized from the book's quote for the order, not from the perp price
+    expected_margin = (avg_price * total_qty) / leverage
     assert margin == pytest.approx(expected_margin)
 
 
@@ -340,6 +600,334 @@ def test_market_order_sell_closes_existing_position(mock_orderbook, register_acc
     assert maker_margin == pytest.approx(expected_maker_margin)
 
 
+def test_market_order_stops_at_worst_price(mock_orderbook):
+    ob = mock_orderbook
+    ob.add_limit_order("0xA", Side.SELL, 0.40, 1.0, 2)
+    ob.add_limit_order("0xB", Side.SELL, 0.45, 1.0, 2)
+    ob.add_limit_order("0xC", Side.SELL, 0.60, 5.0, 2)
+
+    fills = ob.market_order("0xBuyer", Side.BUY, 4.0, 2, _worst_price=0.45)
+
+    assert [(t.maker_id, t.price) for t in fills] == [("0xA", 0.40), ("0xB", 0.45)]
+    assert ob.asks.keys() == [0.60]
+    taker_call = ob.pm.create_position.call_args_list[-1][0]
+    assert taker_call[:5] == ("0xBuyer", "BTC", Side.BUY, pytest.approx(0.425), pytest.approx(2.0))
+    # margin covers the two units that traded, not the four asked for
+    assert taker_call[6] == pytest.approx(0.425 * 2.0 / 2)
+
+    with pytest.raises(ValueError, match="within worst price"):
+        ob.market_order("0xBuyer2", Side.BUY, 1.0, 2, _worst_price=0.55)
+
+
+def test_fill_or_kill_leaves_the_book_untouched_when_short(mock_orderbook):
+    ob = mock_orderbook
+    ob.add_limit_order("0xA", Side.BUY, 0.50, 1.0, 2)
+    ob.add_limit_order("0xB", Side.BUY, 0.45, 1.0, 2)
+
+    with pytest.raises(ValueError, match="Fill-or-kill"):
+        ob.market_order("0xSeller", Side.SELL, 3.0, 2, _time_in_force=TimeInForce.FOK)
+    with pytest.raises(ValueError, match="Fill-or-kill"):
+        ob.add_limit_order("0xSeller", Side.SELL, 0.48, 1.5, 2, TimeInForce.FOK)
+    with pytest.raises(ValueError, match="cannot rest"):
+        ob.market_order("0xSeller", Side.SELL, 1.0, 2, _time_in_force=TimeInForce.GTC)
+    assert ob.bids.keys() == [0.45, 0.50] and not ob.trade_events
+    ob.call_fill_limit_order.assert_not_called()
+
+    fills = ob.market_order("0xSeller", Side.SELL, 2.0, 2, _time_in_force=TimeInForce.FOK)
+    assert [t.maker_id for t in fills] == ["0xA", "0xB"]
+    assert not ob.bids
+
+
+def test_crossing_limit_trades_instead_of_resting(mock_orderbook):
+    ob = mock_orderbook
+    ob.add_limit_order("0xA", Side.SELL, 0.40, 1.0, 2)
+    ob.add_limit_order("0xB", Side.SELL, 0.45, 2.0, 2)
+    ob.add_limit_order("0xBid", Side.BUY, 0.35, 1.0, 2)
+    ob.send_limit_order.reset_mock()
+
+    with pytest.raises(ValueError, match="would not fill"):
+        ob.add_limit_order("0xBuyer", Side.BUY, 0.35, 3.0, 2, TimeInForce.IOC)
+    with pytest.raises(ValueError, match="cross the book"):
+        ob.replace_limit_order("0xB", 0.30, 2.0)
+
+    fills = ob.add_limit_order("0xBuyer", Side.BUY, 0.42, 3.0, 2)
+
+    # only the level inside the limit trades, the rest of the order is dropped rather than resting crossed
+    assert [(t.maker_id, t.quantity) for t in fills] == [("0xA", 1.0)]
+    assert ob.asks.keys() == [0.45] and ob.bids.keys() == [0.35]
+    assert "0xBuyer" not in ob.open_orders
+    ob.send_limit_order.assert_not_called()
+    ob.send_open_position.assert_called_once()
+    taker_call = ob.pm.create_position.call_args_list[-1][0]
+    assert taker_call[:5] == ("0xBuyer", "BTC", Side.BUY, pytest.approx(0.40), pytest.approx(1.0))
+    assert taker_call[6] == pytest.approx(0.42 * 1.0 / 2)
+
+
+def test_depth_index_tracks_resting_size(mock_orderbook):
+    ob = mock_orderbook
+    ob.add_limit_order("0xA", Side.SELL, 0.40, 1.0, 2)
+    ob.add_limit_order("0xB", Side.SELL, 0.45, 2.0, 2)
+    ob.add_limit_order("0xC", Side.SELL, 0.45, 1.5, 2)
+    ob.add_limit_order("0xD", Side.SELL, 0.60, 5.0, 2)
+    ob.add_limit_order("0xBid", Side.BUY, 0.30, 3.0, 2)
+
+    assert ob.ask_depth.within(0.45) == pytest.approx((4.5, 0.40 + 0.45 * 3.5))
+    assert ob.ask_depth.within(0.4499) == pytest.approx((1.0, 0.40))
+    assert ob.bid_depth.within(0.30) == pytest.approx((3.0, 0.90))
+    assert ob.bid_depth.within(0.31)[0] == 0
+    assert ob.ask_depth.cost(2.0) == pytest.approx((2.0, 0.40 + 0.45, 0.45))
+    assert ob.ask_depth.cost(20.0) == pytest.approx((9.5, 0.40 + 0.45 * 3.5 + 0.60 * 5.0, 0.60))
+
+    # cancels, in-place resizes, repricing and fills all move the index
+    ob.remove_limit_order("0xC")
+    ob.replace_limit_order("0xB", 0.45, 1.0)
+    ob.replace_limit_order("0xD", 0.50, 4.0)
+    ob.add_limit_order("0xTaker", Side.BUY, 0.40, 1.0, 2)
+    assert ob.ask_depth.total() == pytest.approx(5.0)
+    assert ob.ask_depth.cost(5.0) == pytest.approx((5.0, 0.45 + 0.50 * 4.0, 0.50))
+    assert ob.bid_depth.total() == pytest.approx(3.0)
+
+
+def test_quote_reports_vwap_impact_and_depth_within_bps(mock_orderbook):
+    ob = mock_orderbook
+    ob.add_limit_order("0xA", Side.SELL, 0.40, 1.0, 2)
+    ob.add_limit_order("0xB", Side.SELL, 0.44, 3.0, 2)
+    ob.send_limit_order.reset_mock()
+
+    quote = ob.quote(Side.BUY, 2.0, 1000)
+    assert quote["best_price"] == 0.40 and quote["worst_price"] == 0.44
+    assert quote["filled"] == pytest.approx(2.0)
+    assert quote["vwap"] == pytest.approx(0.42)
+    assert quote["impact_bps"] == pytest.approx(500)
+    # 10% over 0.40 reaches 0.44
+    assert quote["available"] == pytest.approx(4.0)
+    assert ob.quote(Side.BUY, _bps=500)["available"] == pytest.approx(1.0)
+
+    thin = ob.quote(Side.BUY, 10.0)
+    assert thin["filled"] == pytest.approx(4.0) and thin["worst_price"] == 0.44
+    empty = ob.quote(Side.SELL, 1.0)
+    assert empty["filled"] == 0 and empty["vwap"] is None and empty["best_price"] is None
+    with pytest.raises(ValueError, match="quantity, a bps range"):
+        ob.quote(Side.BUY)
+    # quoting never touches the book
+    assert ob.asks.keys() == [0.40, 0.44]
+    ob.send_limit_order.assert_not_called()
+
+
+def test_trigger_index_fires_only_what_the_price_crossed():
+    triggers = TriggerIndex()
+    triggers.arm("0xLong", 1, Side.BUY, TriggerKind.STOP, 0.40)
+    triggers.arm("0xLong", 1, Side.BUY, TriggerKind.TAKE_PROFIT, 0.60)
+    triggers.arm("0xShort", 2, Side.SELL, TriggerKind.STOP, 0.55)
+    triggers.arm("0xShort", 2, Side.SELL, TriggerKind.TAKE_PROFIT, 0.30)
+    triggers.arm("0xDeep", 3, Side.BUY, TriggerKind.STOP, 0.45)
+    # re-arming moves the trigger instead of adding a second one
+    triggers.arm("0xDeep", 3, Side.BUY, TriggerKind.STOP, 0.35)
+    assert len(triggers) == 5
+
+    assert triggers.fired(0.41, 0.54) == []
+    assert triggers.fired(0.50, 0.55) == [("0xShort", TriggerKind.STOP, 2, 0.55)]
+    # a sweep down through two stops fires the nearer one first
+    assert triggers.fired(0.35, 0.45) == [
+        ("0xLong", TriggerKind.STOP, 1, 0.40),
+        ("0xDeep", TriggerKind.STOP, 3, 0.35),
+    ]
+    assert triggers.get("0xLong", TriggerKind.TAKE_PROFIT) == 0.60
+
+    triggers.disarm("0xLong")
+    assert triggers.fired(0.01, 0.99) == [("0xShort", TriggerKind.TAKE_PROFIT, 2, 0.30)]
+    assert len(triggers) == 0 and triggers.armed == {}
+
+
+def test_stop_trigger_closes_position_at_market(mock_orderbook, position_manager):
+    ob = mock_orderbook
+    ob.pm = position_manager
+    position_manager.get_perp_price = Mock(return_value=0.5)
+    for address in ("0xTrader", "0xAsk", "0xBid1", "0xBid2", "0xSeller"):
+        position_manager.create_account(address)
+
+    ob.add_limit_order("0xAsk", Side.SELL, 0.50, 1.0, 2)
+    ob.market_order("0xTrader", Side.BUY, 1.0, 2)
+    position = position_manager.get_open_position("0xTrader", "BTC")
+
+    with pytest.raises(ValueError, match="stop must be below"):
+        ob.set_triggers("0xTrader", 0.60, 0.55)
+    with pytest.raises(ValueError, match="No open position"):
+        ob.set_triggers("0xBid1", 0.40)
+    ob.set_triggers("0xTrader", _stop_price=0.40, _take_profit_price=0.70)
+    assert (position.stop_price, position.take_profit_price) == (0.40, 0.70)
+
+    ob.add_limit_order("0xBid1", Side.BUY, 0.40, 1.0, 2)
+    ob.add_limit_order("0xBid2", Side.BUY, 0.39, 1.0, 2)
+    ob.send_close_position.reset_mock()
+
+    # someone else sells into 0.40, the stop closes the long into the next bid
+    ob.market_order("0xSeller", Side.SELL, 1.0, 2)
+
+    assert position.status == Status.CLOSED
+    assert position.stop_price is None and position.take_profit_price is None
+    assert len(ob.triggers) == 0
+    ob.send_close_position.assert_called_once_with(ob.w3, "0xTrader", pytest.approx(0.39))
+    assert [(t.taker_id, t.maker_id, t.price) for t in ob.trade_events[-2:]] == [
+        ("0xSeller", "0xBid1", 0.40),
+        ("0xTrader", "0xBid2", 0.39),
+    ]
+
+
+def test_rate_limiter_refills_and_hints_retry():
+    limiter = RateLimiter(_rate=10, _burst=5)
+    limiter.take("0xA", "limit_order", 5, _now=0.0)
+
+    with pytest.raises(RateLimited) as exc:
+        limiter.take("0xA", "limit_order", 1, _now=0.05)
+    # half a token refilled, the other half takes 0.05s more
+    assert exc.value.retry_after == pytest.approx(0.05)
+
+    limiter.take("0xA", "limit_order", 1, _now=0.1)
+    limiter.take("0xA", "market_order", 5, _now=0.1)
+    # a batch larger than the burst is hinted at a full bucket, never at infinity
+    with pytest.raises(RateLimited) as exc:
+        limiter.take("0xA", "limit_order", 50, _now=0.1)
+    assert exc.value.retry_after == pytest.approx(0.5)
+
+def test_engine_queue_runs_in_order_and_rejects_when_full():
+    commands = EngineQueue(_size=1)
+    ran = []
+    assert commands.submit(lambda: ran.append(1) or "done") == "done"
+    with pytest.raises(ValueError):
+        commands.submit(Mock(side_effect=ValueError("bad order")))
+
+    # hold the worker so the one queue slot stays taken
+    release = threading.Event()
+    held = threading.Thread(target=commands.submit, args=(release.wait,))
+    held.start()
+    while commands.waiting < 1:
+        time.sleep(0.001)
+    with pytest.raises(Overloaded):
+        commands.submit(ran.append, 2)
+    # internal callers are never turned away
+    waiter = threading.Thread(target=commands.submit, args=(ran.append, 3), kwargs={"_bounded": False})
+    waiter.start()
+    release.set()
+    held.join()
+    waiter.join()
+    commands.stop()
+    assert ran == [1, 3]
+
+def test_engine_queue_runs_after_hook_before_resolving():
+    ran = []
+    commands = EngineQueue(_after=lambda: ran.append("after"))
+    assert commands.submit(lambda: ran.append("command") or "done") == "done"
+    with pytest.raises(ValueError):
+        commands.submit(Mock(side_effect=ValueError("bad order")))
+    commands.stop()
+    # the caller only sees its result once the hook has run, failed commands included
+    assert ran == ["command", "after", "after"]
+
+def test_timing_wheel_cascades_and_never_fires_early():
+    # 4 slots x 3 levels: 64 ticks in range, later deadlines park at the top and cascade down
+    wheel = TimingWheel(_tick=1.0, _now=0.0, _bits=2, _levels=3)
+    deadlines = {"a": 2.5, "b": 7.0, "c": 40.2, "d": 300.0, "e": 20.0}
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+    wheel.schedule("e", 41.0)
+    assert wheel.cancel("b") and not wheel.cancel("b")
+
+    assert wheel.advance(2.9) == []
+    assert wheel.advance(3.0) == ["a"]
+    # both land on tick 41, 40.2 waits for it rather than firing at 40
+    assert wheel.advance(40.9) == []
+    assert sorted(wheel.advance(41.0)) == ["c", "e"]
+    assert wheel.advance(299.5) == []
+    assert wheel.advance(1000.0) == ["d"]
+    assert len(wheel) == 0
+
+
+def test_timing_wheel_due_by_never_misses_and_idles_when_nothing_is_due():
+    import random
+    rng = random.Random(3)
+    wheel = TimingWheel(_tick=1.0, _now=0.0, _bits=2, _levels=3)
+    assert not wheel.due_by(1e9)
+    for i in range(40):
+        wheel.schedule(i, rng.uniform(1, 200))
+    for i in range(0, 40, 3):
+        wheel.cancel(i)
+
+    idle = 0
+    for now in range(1, 260):
+        due = wheel.due_by(now)
+        fired = wheel.advance(now)
+        # a tick that fires was always flagged, most that do not are skipped
+        assert due or not fired
+        idle += not due
+    assert len(wheel) == 0 and not wheel.due_by(1e9)
+    assert idle > 150
+
+
+def test_expiry_loop_only_submits_when_something_is_due(mock_orderbook):
+    ob = mock_orderbook
+    ob.send_limit_order_expiry = Mock()
+    ob.expiries = TimingWheel(_tick=0.01, _now=time.time())
+    submitted = []
+
+    def submit(_fn):
+        submitted.append(_fn)
+        return _fn()
+
+    stop = threading.Event()
+    loop = threading.Thread(target=ob.expiry_loop, args=(stop, submit))
+    loop.start()
+    time.sleep(0.1)
+    assert submitted == []
+
+    ob.add_limit_order("0xA", Side.SELL, 0.40, 1.0, 2, TimeInForce.GTT, time.time() + 0.05)
+    deadline = time.time() + 5
+    while "0xA" in ob.open_orders and time.time() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    loop.join()
+    assert "0xA" not in ob.open_orders
+    assert 1 <= len(submitted) < 10
+
+
+def test_gtt_orders_expire_through_the_cancel_path(mock_orderbook, monkeypatch):
+    ob = mock_orderbook
+    ob.send_limit_order_expiry = Mock()
+    monkeypatch.setattr(matching_engine, "EXPIRE_BATCH", 2)
+    now = time.time()
+
+    with pytest.raises(ValueError, match="need an expiry"):
+        ob.add_limit_order("0xA", Side.SELL, 0.40, 1.0, 2, TimeInForce.GTT)
+    with pytest.raises(ValueError, match="need an expiry"):
+        ob.add_limit_order("0xA", Side.SELL, 0.40, 1.0, 2, _expires_at=now + 60)
+    with pytest.raises(ValueError, match="in the past"):
+        ob.add_limit_order("0xA", Side.SELL, 0.40, 1.0, 2, TimeInForce.GTT, now - 1)
+
+    for i, trader in enumerate(("0xA", "0xB", "0xC", "0xD")):
+        ob.add_limit_order(trader, Side.SELL, 0.40 + i / 100, 1.0, 2, TimeInForce.GTT, now + 10)
+    ob.add_limit_order("0xLater", Side.SELL, 0.50, 1.0, 2, TimeInForce.GTT, now + 100)
+    ob.add_limit_order("0xForever", Side.SELL, 0.60, 1.0, 2)
+    ob.remove_limit_order("0xC")
+    ob.replace_limit_order("0xB", 0.45, 2.0)
+    # a fill takes the order's expiry with it
+    ob.add_limit_order("0xBuyer", Side.BUY, 0.40, 1.0, 2)
+    assert len(ob.expiries) == 3
+
+    assert ob.expire_orders(now + 5) == []
+    version = ob.version
+    assert sorted(ob.expire_orders(now + 10.5)) == ["0xB", "0xD"]
+    assert ob.version > version
+    assert ob.asks.keys() == [0.50, 0.60]
+    assert ob.ask_depth.total() == pytest.approx(2.0)
+    ob.send_limit_order_expiry.assert_called_once()
+    assert sorted(ob.send_limit_order_expiry.call_args[0][1]) == ["0xB", "0xD"]
+    # expired orders never reach the trader-signed cancel
+    ob.send_limit_order_removal.assert_called_once_with(ob.w3, "0xC")
+
+    assert ob.expire_orders(now + 200) == ["0xLater"]
+    assert "0xForever" in ob.open_orders and len(ob.expiries) == 0
+
+
 def test_market_order_raises_without_depth(mock_orderbook, register_account):
     ob = mock_orderbook
     register_account("0xBuyer")
@@ -449,6 +1037,59 @@ def test_position_manager_close_position_full(position_manager):
     assert position.close_timestamp > 0
 
 
+def test_funding_index_mirrors_contract_integration():
+    index = FundingIndex(_index=0, _rate_per_second=10**12, _last_timestamp=1000)
+
+    # views accrue without moving the integration point, fractions of a second don't count
+    assert index.value(1010.9) == 10 * 10**12
+    assert index.last_timestamp == 1000
+
+    index.set_rate(-(10**12), 1010)
+    assert (index.index, index.rate_per_second, index.last_timestamp) == (10 * 10**12, -(10**12), 1010)
+    assert index.integrate(1015) == 5 * 10**12
+
+    # a single integration never covers more than MAX_ELAPSED, like _integrate_funding
+    assert index.value(1015 + 10 * MAX_ELAPSED) == 5 * 10**12 - MAX_ELAPSED * 10**12
+
+
+def test_position_manager_update_pnl_nets_funding(monkeypatch, position_manager):
+    now = int(time.time())
+    position_manager.funding.reset(0, 0, now - 100)
+    position_manager.create_account("0xAlice")
+    position_manager.create_account("0xBob")
+    position_manager.create_position("0xAlice", "BTC", PMSide.BUY, 0.5, 2.0, 2, 150)
+    position_manager.create_position("0xBob", "BTC", PMSide.SELL, 0.5, 2.0, 2, 150)
+    long, short = position_manager.accounts["0xAlice"].positions[0], position_manager.accounts["0xBob"].positions[0]
+    monkeypatch.setattr(position_manager, "get_perp_price", lambda: 0.5)
+
+    # 100s at 1e-4 per second on a 300 notional: 3.0, longs receive and shorts pay
+    position_manager.funding.reset(position_manager.funding.index, 10**14, now)
+    monkeypatch.setattr(time, "time", lambda: now + 100)
+    assert position_manager.update_pnl(long) == pytest.approx(0.0)
+    position_manager.update_pnl(short)
+
+    assert long.funding_paid == pytest.approx(-3.0)
+    assert long.unrealized_pnl == pytest.approx(3.0)
+    assert short.funding_paid == pytest.approx(3.0)
+    assert short.unrealized_pnl == pytest.approx(-3.0)
+
+
+def test_position_manager_close_position_realises_funding_share(monkeypatch, position_manager):
+    now = int(time.time())
+    position_manager.funding.reset(0, 10**14, now)
+    monkeypatch.setattr(time, "time", lambda: now)
+    position_manager.create_account("0xBob")
+    position_manager.create_position("0xBob", "BTC", PMSide.SELL, 0.5, 4.0, 2, 150)
+    position = position_manager.accounts["0xBob"].positions[0]
+
+    monkeypatch.setattr(time, "time", lambda: now + 100)
+    pnl = position_manager.close_position("0xBob", "BTC", 1.0, 0.5)
+
+    # a quarter of the 3.0 owed is realised, the rest stays on the open position
+    assert pnl == pytest.approx(-0.75)
+    assert position_manager.funding_impact(position) == pytest.approx(2.25)
+
+
 # ---------------------------------------------------------------------
 #  Server API tests
 # ---------------------------------------------------------------------
@@ -469,6 +1110,32 @@ def test_server_orderbook_endpoint(api_client):
     fake_engine.snapshot.assert_called_once()
 
 
+def test_server_orderbook_endpoint_honours_etag(api_client):
+    client, fake_engine, _ = api_client
+
+    first = client.get("/orderbook")
+    etag = first.headers["ETag"]
+
+    cached = client.get("/orderbook", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    fake_engine.version += 1
+    changed = client.get("/orderbook", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_server_metrics_endpoint(api_client):
+    client, _, _ = api_client
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE tachyon_order_stage_seconds histogram" in response.text
+    assert "# TYPE tachyon_orders_total counter" in response.text
+
+
 def test_server_positions_endpoint_known(api_client):
     client, _, fake_pm = api_client
 
@@ -478,9 +1145,24 @@ def test_server_positions_endpoint_known(api_client):
     assert "positions" in body
     assert len(body["positions"]) == 1
     assert body["positions"][0]["position_id"] == 10
+    assert body["positions"][0]["funding"] == -0.5
     fake_pm.accounts["0xKnown"]  # ensure fixture still accessible
 
 
+def test_server_engine_reads_run_on_the_engine_worker(api_client):
+    from off_chain_systems import server
+    client, _, fake_pm = api_client
+    threads = []
+    fake_pm.update_pnl.side_effect = lambda _position: threads.append(threading.current_thread())
+    fake_pm.get_oracle_price.return_value = 0.4
+    fake_pm.get_perp_price.side_effect = lambda *_args: threads.append(threading.current_thread()) or 0.45
+
+    assert client.get("/positions/0xKnown").status_code == 200
+    assert client.get("/prices").status_code == 200
+    assert client.get("/perp_price").json() == 0.45
+    assert threads == [server.engine_queue._thread] * 3
+
+
 def test_server_positions_endpoint_unknown(api_client):
     client, _, _ = api_client
 
@@ -504,6 +1186,135 @@ def test_server_price_endpoints(api_client):
     assert perp_response.status_code == 200
     assert perp_response.json() == 0.37
 
+
+def test_server_prices_endpoint_samples_once(api_client):
+    client, _, fake_pm = api_client
+
+    fake_pm.get_oracle_price.return_value = 0.4
+    fake_pm.get_perp_price.return_value = 0.45
+
+    response = client.get("/prices")
+    assert response.status_code == 200
+    assert response.json() == pytest.approx({"oracle_price": 0.4, "perp_price": 0.45, "funding_rate": 0.125})
+    fake_pm.get_oracle_price.assert_called_once()
+    # the perp fallback reuses the oracle read instead of making another one
+    fake_pm.get_perp_price.assert_called_once_with(0.4)
+
+def test_server_prices_endpoint_leaves_premium_index_alone(api_client, monkeypatch):
+    from off_chain_systems import server
+    client, _, fake_pm = api_client
+    index = PremiumIndex(_window=3600, _resolution=0)
+    index.update_oracle(0.4, time.time() - 10)
+    index.update_perp(0.44, time.time() - 10)
+    monkeypatch.setattr(server, "premium_index", index)
+    fake_pm.get_oracle_price.return_value = 0.4
+    fake_pm.get_perp_price.return_value = 0.5
+
+    state = (list(index.segments), index.last_time, index.oracle_price, index.perp_price)
+    for _ in range(5):
+        response = client.get("/prices")
+        assert response.status_code == 200
+        # the TWAP so far, not the polled prices
+        assert response.json()["funding_rate"] == pytest.approx(0.1)
+    assert (list(index.segments), index.last_time, index.oracle_price, index.perp_price) == state
+
+def test_server_quote_endpoint(api_client):
+    from off_chain_systems import server
+    client, fake_engine, _ = api_client
+    threads = []
+
+    def quote(**_kwargs):
+        threads.append(threading.current_thread())
+        return {"side": "buy", "best_price": 0.4, "quantity": 2.0, "filled": 2.0, "vwap": 0.42}
+
+    fake_engine.quote.side_effect = quote
+
+    response = client.get("/quote", params={"side": "buy", "quantity": 2.0})
+    assert response.status_code == 200
+    assert response.json()["vwap"] == 0.42
+    fake_engine.quote.assert_called_once_with(_side=Side.BUY, _quantity=2.0, _bps=None)
+    # reading the depth index flushes it, so quotes run on the engine queue's worker
+    assert threads == [server.engine_queue._thread]
+
+    fake_engine.quote.side_effect = ValueError("Quote needs a quantity, a bps range or both")
+    assert client.get("/quote", params={"side": "sell"}).status_code == 400
+
+def test_server_triggers_endpoint(api_client):
+    client, fake_engine, _ = api_client
+    fake_engine.set_triggers.return_value = SimpleNamespace(position_id=10, stop_price=0.3, take_profit_price=None)
+
+    response = client.post("/tx/triggers", json={"trader_address": "0xKnown", "stop_price": 0.3})
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok", "position_id": 10, "stop_price": 0.3, "take_profit_price": None}
+    fake_engine.set_triggers.assert_called_once_with(_trader_id="0xKnown", _stop_price=0.3, _take_profit_price=None)
+
+    fake_engine.set_triggers.side_effect = ValueError("No open position to attach triggers to")
+    assert client.post("/tx/triggers", json={"trader_address": "0xNobody"}).status_code == 400
+
+def test_server_rate_limits_per_trader_with_retry_after(api_client, monkeypatch):
+    from off_chain_systems import server
+    client, fake_engine, _ = api_client
+    monkeypatch.setattr(server, "limiter", RateLimiter(_rate=0.5, _burst=2))
+    cancel = {"trader_address": "0xFlooder"}
+
+    assert client.post("/tx/remove_limit_order", json=cancel).status_code == 200
+    assert client.post("/tx/remove_limit_order", json=cancel).status_code == 200
+    response = client.post("/tx/remove_limit_order", json=cancel)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert fake_engine.remove_limit_order.call_count == 2
+
+    # other traders and other endpoints have buckets of their own
+    assert client.post("/tx/remove_limit_order", json={"trader_address": "0xPolite"}).status_code == 200
+    assert client.post("/tx/replace_limit_order", json={**cancel, "price": 0.4, "quantity": 1.0}).status_code == 200
+
+def test_server_returns_503_when_engine_queue_is_full(api_client, monkeypatch):
+    from off_chain_systems import server
+    client, fake_engine, _ = api_client
+    full = EngineQueue(_size=0)
+    monkeypatch.setattr(server, "engine_queue", full)
+
+    response = client.post("/tx/remove_limit_order", json={"trader_address": "0xTrader"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    fake_engine.remove_limit_order.assert_not_called()
+
+def test_server_sheds_load_and_keeps_reads_up_at_default_queue_size(api_client):
+    from off_chain_systems import server
+    _, fake_engine, _ = api_client
+    gate = threading.Event()
+    fake_engine.remove_limit_order.side_effect = lambda *_args, **_kwargs: gate.wait(10)
+    assert server.engine_queue.size == ENGINE_QUEUE_SIZE
+    extra = 40
+
+    async def load():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # far more waiting requests than the server's threadpool has threads
+            pending = [
+                asyncio.create_task(client.post("/tx/remove_limit_order", json={"trader_address": f"0xTrader{i}"}))
+                for i in range(ENGINE_QUEUE_SIZE + extra)
+            ]
+            try:
+                deadline = time.monotonic() + 5
+                while server.engine_queue.waiting < ENGINE_QUEUE_SIZE and time.monotonic() < deadline:
+                    await asyncio.sleep(0.01)
+                overflow = await asyncio.wait_for(
+                    client.post("/tx/remove_limit_order", json={"trader_address": "0xLate"}), timeout=5
+                )
+                book = await asyncio.wait_for(client.get("/orderbook"), timeout=5)
+            finally:
+                gate.set()
+            return overflow, book, await asyncio.gather(*pending)
+
+    overflow, book, responses = asyncio.run(load())
+    assert overflow.status_code == 503
+    assert "Retry-After" in overflow.headers
+    assert book.status_code == 200
+    statuses = [response.status_code for response in responses]
+    assert statuses.count(200) == ENGINE_QUEUE_SIZE
+    assert statuses.count(503) == extra
+
 def test_server_limit_order_endpoint(api_client):
     client, fake_engine, _ = api_client
 
@@ -528,6 +1339,8 @@ def test_server_limit_order_endpoint(api_client):
     assert kwargs["_price"] == 0.45
     assert kwargs["_quantity"] == 2.0
     assert kwargs["_leverage"] == 3
+    assert kwargs["_time_in_force"] == TimeInForce.GTC
+    assert kwargs["_expires_at"] is None
     assert "_margin" not in kwargs
     fake_engine.snapshot.assert_called_once()
 
@@ -546,7 +1359,9 @@ def test_server_market_order_endpoint(api_client):
     body = response.json()
     assert body["status"] == "ok"
     assert body["orderbook"] == fake_engine.snapshot.return_value
-    assert body["trades"] == [trade.__dict__ for trade in fake_engine.trade_events]
+    assert body["trades"] == [
+        {**trade.__dict__, "taker_side": trade.taker_side.value} for trade in fake_engine.trade_events
+    ]
 
     fake_engine.market_order.assert_called_once()
     kwargs = fake_engine.market_order.call_args.kwargs
@@ -554,11 +1369,46 @@ def test_server_market_order_endpoint(api_client):
     assert kwargs["_side"] == Side.SELL
     assert kwargs["_quantity"] == 1.25
     assert kwargs["_leverage"] == 4
+    assert kwargs["_worst_price"] is None
+    assert kwargs["_time_in_force"] == TimeInForce.IOC
     assert "_price" not in kwargs
     assert "_margin" not in kwargs
     fake_engine.snapshot.assert_called_once()
 
 
+def test_server_order_endpoints_can_skip_orderbook(api_client):
+    client, fake_engine, _ = api_client
+
+    payload = {
+        "direction": "BUY",
+        "leverage": 3,
+        "price": 0.45,
+        "quantity": 2.0,
+        "trader_address": "0xTrader",
+    }
+    response = client.post("/tx/limit_order?include_book=false", json=payload)
+    assert response.status_code == 200
+    assert response.json()["orderbook"] is None
+    assert fake_engine.add_limit_order.call_args.kwargs["_side"] == Side.BUY
+    fake_engine.snapshot.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"direction": "buy", "leverage": 3, "quantity": 2.0, "trader_address": "0xTrader"},
+        {"direction": "up", "leverage": 3, "price": 0.45, "quantity": 2.0, "trader_address": "0xTrader"},
+        {"direction": "buy", "leverage": "lots", "price": 0.45, "quantity": 2.0, "trader_address": "0xTrader"},
+    ],
+)
+def test_server_limit_order_endpoint_validates_payload(api_client, payload):
+    client, fake_engine, _ = api_client
+
+    response = client.post("/tx/limit_order", json=payload)
+    assert response.status_code == 422
+    fake_engine.add_limit_order.assert_not_called()
+
+
 def test_server_remove_limit_order_endpoint(api_client):
     client, fake_engine, _ = api_client
 
@@ -577,6 +1427,61 @@ def test_server_remove_limit_order_endpoint(api_client):
     fake_engine.snapshot.assert_called_once()
 
 
+def test_server_replace_limit_order_endpoint(api_client):
+    client, fake_engine, _ = api_client
+
+    payload = {
+        "price": 0.41,
+        "quantity": 3.0,
+        "trader_address": "0xTrader",
+    }
+    response = client.post("/tx/replace_limit_order", json=payload)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ok"
+    assert body["order_id"] == 7
+    assert body["orderbook"] == fake_engine.snapshot.return_value
+
+    kwargs = fake_engine.replace_limit_order.call_args.kwargs
+    assert kwargs["_trader_id"] == "0xTrader"
+    assert kwargs["_price"] == 0.41
+    assert kwargs["_quantity"] == 3.0
+
+
+def test_server_batch_endpoint_compact(api_client):
+    client, fake_engine, _ = api_client
+    fake_engine.apply_batch.return_value = [
+        {"index": 0, "status": "ok", "order_id": 1},
+        {"index": 1, "status": "error", "error": "Cannot set limit at 1"},
+    ]
+
+    commands = [
+        {"type": "limit", "trader_address": "0xMM", "direction": "buy", "price": 0.40, "quantity": 1.0, "leverage": 2},
+        {"type": "limit", "trader_address": "0xMM2", "direction": "buy", "price": 1.0, "quantity": 1.0, "leverage": 2},
+    ]
+    response = client.post("/tx/batch", json={"commands": commands, "compact": True})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["results"] == fake_engine.apply_batch.return_value
+    assert "orderbook" not in body
+    # request defaults are filled in before the engine sees the commands
+    fake_engine.apply_batch.assert_called_once_with(
+        [{**command, "time_in_force": "gtc", "expires_at": None} for command in commands]
+    )
+    fake_engine.snapshot.assert_not_called()
+
+    response = client.post("/tx/batch", json={"commands": commands})
+    assert response.json()["orderbook"] == fake_engine.snapshot.return_value
+    fake_engine.snapshot.assert_called_once()
+
+
+def test_server_batch_endpoint_requires_commands(api_client):
+    client, _, _ = api_client
+
+    response = client.post("/tx/batch", json={"compact": True})
+    assert response.status_code == 422
+
+
 def test_server_trades_endpoint(api_client):
     client, fake_engine, _ = api_client
 
@@ -586,3 +1491,659 @@ def test_server_trades_endpoint(api_client):
     assert "trades" in body
     assert len(body["trades"]) == len(fake_engine.trade_events)
     assert body["trades"][0]["trade_id"] == fake_engine.trade_events[0].trade_id
+    assert body["trades"][0]["taker_side"] == "buy"
+
+
+# ---------------------------------------------------------------------
+#  Funding service
+# ---------------------------------------------------------------------
+FUNDING_TEST_ABIS = {
+    "ORACLE_ABI": [{
+        "type": "function", "name": "update_prices", "stateMutability": "nonpayable", "outputs": [],
+        "inputs": [
+            {"name": "_market_ids", "type": "uint256[]"},
+            {"name": "_oracle_prices", "type": "uint256[]"},
+            {"name": "_perp_prices", "type": "uint256[]"},
+            {"name": "_fields", "type": "uint256[]"},
+        ],
+    }],
+    "PERPS_ABI": [{
+        "type": "function", "name": "update_funding", "stateMutability": "nonpayable", "outputs": [],
+        "inputs": [{"name": "_funding_rate", "type": "int256"}],
+    }],
+}
+
+
+def test_sample_engine_prices_reads_oracle_once():
+    pm = PositionManager()
+    pm.get_oracle_price = Mock(return_value=0.4)
+    pm.orderbook = SimpleNamespace(trade_events=[], get_best_bid=lambda: None, get_best_ask=lambda: None)
+
+    sample = funding_service.sample_engine_prices(pm)
+    assert (sample.oracle_price, sample.perp_price, sample.funding_rate) == (0.4, 0.4, 0.0)
+
+    pm.orderbook = SimpleNamespace(trade_events=[], get_best_bid=lambda: 0.44, get_best_ask=lambda: 0.46)
+    sample = funding_service.sample_engine_prices(pm)
+    assert sample.perp_price == pytest.approx(0.45)
+    assert sample.funding_rate == pytest.approx(0.125)
+    assert pm.get_oracle_price.call_count == 2
+
+
+def test_funding_service_cycle_costs_one_sample_and_two_sends(monkeypatch):
+    import rlp
+    from eth_abi import decode
+    from web3 import Web3
+    from web3.providers.base import BaseProvider
+
+    class RecordingProvider(BaseProvider):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+            self.raw_transactions = []
+
+        def make_request(self, method, params):
+            self.calls.append(method)
+            if method == "eth_chainId":
+                return {"jsonrpc": "2.0", "id": 1, "result": hex(31337)}
+            if method == "eth_getTransactionCount":
+                return {"jsonrpc": "2.0", "id": 1, "result": hex(7 + len(self.raw_transactions))}
+            if method == "eth_sendRawTransaction":
+                self.raw_transactions.append(params[0])
+                return {"jsonrpc": "2.0", "id": 1, "result": "0x" + f"{len(self.raw_transactions):064x}"}
+            raise AssertionError(f"unexpected RPC {method}")
+
+    for name, abi in FUNDING_TEST_ABIS.items():
+        monkeypatch.setattr(funding_service, name, abi)
+    monkeypatch.setattr(funding_service, "ORACLE_ADDRESS", "0x00000000000000000000000000000000000000a1")
+    monkeypatch.setattr(funding_service, "PERPS_ADDRESS", "0x00000000000000000000000000000000000000b2")
+    provider = RecordingProvider()
+    sample = Mock(return_value=funding_service.PriceSample(0.4, 0.45, time.time()))
+    funding_index = FundingIndex(_last_timestamp=int(time.time()) - 10)
+    service = funding_service.FundingService(
+        Web3(provider), sample, "0x" + "11" * 32, _market_id=3, _funding_index=funding_index
+    )
+
+    service.run_cycle()
+    service.run_cycle()
+
+    assert sample.call_count == 2
+    assert provider.calls.count("eth_chainId") == 1
+    assert provider.calls.count("eth_getTransactionCount") == 2
+    sent = [rlp.decode(bytes.fromhex(raw[2:])) for raw in provider.raw_transactions]
+    assert [int.from_bytes(tx[0], "big") for tx in sent] == [7, 8, 9, 10]
+    assert ["0x" + tx[3].hex() for tx in sent[:2]] == [
+        "0x00000000000000000000000000000000000000a1", "0x00000000000000000000000000000000000000b2"
+    ]
+    assert decode(["uint256[]"] * 4, sent[0][5][4:]) == ((3,), (0,), (450000,), (funding_service.UPDATE_PERP,))
+    assert decode(["int256"], sent[1][5][4:]) == (int(sample.return_value.funding_rate * 10**18),)
+    assert service.last_sample == sample.return_value
+    assert funding_index.rate_per_second == int(sample.return_value.funding_rate * 10**18)
+
+
+# ---------------------------------------------------------------------
+#  Transaction scheduler
+# ---------------------------------------------------------------------
+class GatedSendProvider:
+    """Fake node whose first eth_sendRawTransaction waits for `gate`, so work queues up behind it."""
+    def __init__(self, _fail_sends: int = 0):
+        self.gate = threading.Event()
+        self.raw_transactions = []
+        self.nonce_reads = 0
+        self.fail_sends = _fail_sends
+
+    def get_transaction_count(self, _address, _block):
+        self.nonce_reads += 1
+        return 7 + len(self.raw_transactions)
+
+    def send_raw_transaction(self, _raw):
+        self.gate.wait()
+        if self.fail_sends:
+            self.fail_sends -= 1
+            raise ValueError("insufficient funds for gas * price + value")
+        self.raw_transactions.append(_raw)
+        return "0x" + f"{len(self.raw_transactions):064x}"
+
+def scheduled_tx(_data: str) -> dict:
+    return {"to": "0x00000000000000000000000000000000000000b2", "data": _data, "value": 0,
+            "gas": 21000, "gasPrice": 1, "chainId": 31337}
+
+def test_tx_scheduler_sends_by_priority_and_numbers_nonces_at_dispatch():
+    import rlp
+    from off_chain_systems.tx_scheduler import TxScheduler, TxPriority
+
+    node = GatedSendProvider()
+    scheduler = TxScheduler(SimpleNamespace(eth=node), "0x" + "11" * 32)
+    first = scheduler.submit(TxPriority.OTHER, scheduled_tx("0x01"))
+    while len(scheduler):
+        time.sleep(0.001)
+    # the dispatcher is stuck sending `first`, all of these wait for a nonce
+    queued = [
+        scheduler.submit(TxPriority.FILL, scheduled_tx("0x02")),
+        scheduler.submit(TxPriority.FILL, scheduled_tx("0x03")),
+        scheduler.submit(TxPriority.CLOSE, scheduled_tx("0x04")),
+        scheduler.submit(TxPriority.ORACLE, scheduled_tx("0x05")),
+        scheduler.submit(TxPriority.LIQUIDATION, scheduled_tx("0x06")),
+    ]
+    node.gate.set()
+    for future in [first, *queued]:
+        future.result(timeout=5)
+
+    sent = [rlp.decode(bytes(raw)) for raw in node.raw_transactions]
+    assert [tx[5].hex() for tx in sent] == ["01", "06", "05", "04", "02", "03"]
+    assert [int.from_bytes(tx[0], "big") for tx in sent] == [7, 8, 9, 10, 11, 12]
+    assert node.nonce_reads == 1
+
+def test_tx_scheduler_resends_when_another_sender_took_its_nonce():
+    import rlp
+    from off_chain_systems.tx_scheduler import TxScheduler, TxPriority
+
+    class SharedKeyNode:
+        def __init__(self):
+            self.next_nonce = 7
+            self.sent_nonces = []
+            self.nonce_reads = 0
+
+        def get_transaction_count(self, _address, _block):
+            self.nonce_reads += 1
+            return self.next_nonce
+
+        def send_raw_transaction(self, _raw):
+            nonce = int.from_bytes(rlp.decode(bytes(_raw))[0], "big")
+            if nonce < self.next_nonce:
+                raise ValueError(f"nonce too low: next nonce {self.next_nonce}, tx nonce {nonce}")
+            self.next_nonce = nonce + 1
+            self.sent_nonces.append(nonce)
+            return "0x" + f"{nonce:064x}"
+
+    node = SharedKeyNode()
+    scheduler = TxScheduler(SimpleNamespace(eth=node), "0x" + "11" * 32)
+    scheduler.submit(TxPriority.FILL, scheduled_tx("0x01")).result(timeout=5)
+    # the oracle keeper sends two updates from the same key
+    node.next_nonce += 2
+
+    scheduler.submit(TxPriority.LIQUIDATION, scheduled_tx("0x02")).result(timeout=5)
+    scheduler.submit(TxPriority.FILL, scheduled_tx("0x03")).result(timeout=5)
+    assert node.sent_nonces == [7, 10, 11]
+    assert node.nonce_reads == 2
+
+def test_tx_scheduler_rereads_nonce_after_failed_send():
+    from off_chain_systems.tx_scheduler import TxScheduler, TxPriority
+
+    node = GatedSendProvider(_fail_sends=1)
+    node.gate.set()
+    scheduler = TxScheduler(SimpleNamespace(eth=node), "0x" + "11" * 32)
+
+    with pytest.raises(ValueError):
+        scheduler.submit(TxPriority.FILL, scheduled_tx("0x01")).result(timeout=5)
+    scheduler.submit(TxPriority.FILL, scheduled_tx("0x02")).result(timeout=5)
+    scheduler.submit(TxPriority.FILL, scheduled_tx("0x03")).result(timeout=5)
+    assert node.nonce_reads == 2
+
+
+class FakeChain:
+    """Blocks of receipts for ReceiptTracker, counting every call it gets."""
+    def __init__(self, _bulk: bool = True):
+        self.blocks = {10: []}
+        self.calls = []
+        self.bulk = _bulk
+
+    @property
+    def block_number(self):
+        self.calls.append("eth_blockNumber")
+        return max(self.blocks)
+
+    def mine(self, *_hashes):
+        self.blocks[max(self.blocks) + 1] = [{"transactionHash": h, "status": 1} for h in _hashes]
+
+    def get_block_receipts(self, _number):
+        from web3.exceptions import MethodUnavailable
+        self.calls.append("eth_getBlockReceipts")
+        if not self.bulk:
+            raise MethodUnavailable("the method eth_getBlockReceipts does not exist")
+        return self.blocks[_number]
+
+    def get_transaction_receipt(self, _hash):
+        from web3.exceptions import TransactionNotFound
+        self.calls.append("eth_getTransactionReceipt")
+        for receipts in self.blocks.values():
+            for receipt in receipts:
+                if receipt["transactionHash"] == _hash:
+                    return receipt
+        raise TransactionNotFound(_hash)
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_receipt_tracker_resolves_pending_hashes_per_block(bulk):
+    from off_chain_systems.receipt_tracker import ReceiptTracker
+
+    chain = FakeChain(bulk)
+    tracker = ReceiptTracker(SimpleNamespace(eth=chain), _interval=0.01)
+    hashes = [bytes([i]) * 32 for i in range(1, 4)]
+    futures = [tracker.watch(h) for h in hashes]
+    assert tracker.watch(hashes[0]) is futures[0]
+
+    chain.mine(hashes[0], hashes[1], b"\xff" * 32)
+    chain.mine(hashes[2])
+    tracker.sent()
+    receipts = [future.result(timeout=5) for future in futures]
+    assert [receipt["transactionHash"] for receipt in receipts] == hashes
+    if bulk:
+        # one bulk read per block, however many hashes were pending
+        assert chain.calls.count("eth_getBlockReceipts") == 2
+        assert "eth_getTransactionReceipt" not in chain.calls
+
+    # nothing pending, nothing polled
+    time.sleep(0.05)
+    calls = len(chain.calls)
+    time.sleep(0.05)
+    assert len(chain.calls) == calls
+    assert tracker.block is None
+    tracker.stop()
+
+def test_tx_scheduler_settle_returns_once_sent_and_logs_reverts():
+    from eth_utils import keccak
+    from off_chain_systems.receipt_tracker import ReceiptTracker
+    from off_chain_systems.tx_scheduler import TxScheduler, TxPriority
+
+    class SettlingChain(FakeChain):
+        def get_transaction_count(self, _address, _block):
+            return 0
+
+        def send_raw_transaction(self, _raw):
+            return keccak(bytes(_raw))
+
+    chain = SettlingChain()
+    tracker = ReceiptTracker(SimpleNamespace(eth=chain), _interval=0.01)
+    scheduler = TxScheduler(SimpleNamespace(eth=chain), "0x" + "11" * 32, tracker)
+    buffer = io.StringIO()
+    tachyon_log.configure("INFO", "json", buffer)
+    try:
+        # no block yet, settle only waits for the node to take the transaction
+        tx_hash = scheduler.settle(TxPriority.FILL, scheduled_tx("0x01"))
+        assert len(tracker) == 1
+        chain.blocks[max(chain.blocks) + 1] = [{"transactionHash": tx_hash, "status": 0}]
+        deadline = time.monotonic() + 5
+        while "reverted" not in buffer.getvalue() and time.monotonic() < deadline:
+            time.sleep(0.01)
+            tachyon_log.flush()
+    finally:
+        tachyon_log.configure()
+        tracker.stop()
+
+    entries = [json.loads(line) for line in buffer.getvalue().splitlines()]
+    reverted = next(entry for entry in entries if entry["msg"] == "Settlement transaction reverted")
+    assert reverted["level"] == "error"
+    assert reverted["priority"] == "FILL"
+    assert reverted["tx_hash"] == tx_hash.hex()
+
+
+# ---------------------------------------------------------------------
+#  Premium index
+# ---------------------------------------------------------------------
+def test_premium_index_time_weights_ticks():
+    index = PremiumIndex(_window=60, _resolution=0)
+    assert index.twap(0.0) is None
+
+    index.update_oracle(0.5, 0.0)
+    index.update_perp(0.55, 0.0)
+    # no time has passed, the instantaneous premium
+    assert index.twap(0.0) == pytest.approx(0.1)
+
+    index.update_perp(0.5, 10.0)
+    # 10s at +10%, 10s at 0%
+    assert index.twap(20.0) == pytest.approx(0.05)
+    # a single noisy point barely moves it
+    index.update_perp(0.75, 20.0)
+    index.update_perp(0.5, 20.5)
+    assert index.twap(30.0) == pytest.approx((0.1 * 10 + 0.5 * 0.5) / 30)
+
+
+def test_premium_index_slides_window():
+    index = PremiumIndex(_window=10, _resolution=0)
+    index.update_oracle(0.5, 0.0)
+    index.update_perp(0.55, 0.0)
+    index.update_perp(0.5, 10.0)
+
+    # [5, 15]: half at +10%, half at 0%; the straddling segment is trimmed
+    assert index.twap(15.0) == pytest.approx(0.05)
+    assert index.twap(25.0) == pytest.approx(0.0)
+    assert len(index.segments) == 1
+    # out-of-order timestamps are clamped instead of rewinding the index
+    index.update_perp(0.6, 24.0)
+    assert index.last_time == 25.0
+    assert index.twap(35.0) == pytest.approx(0.2)
+
+
+def test_premium_index_peek_matches_twap_without_advancing():
+    index = PremiumIndex(_window=10, _resolution=0)
+    assert index.peek(0.0) is None
+    index.update_oracle(0.5, 0.0)
+    index.update_perp(0.55, 0.0)
+    index.update_perp(0.5, 10.0)
+    index.update_perp(0.6, 12.0)
+
+    for now in (12.0, 15.0, 21.0, 30.0, 11.0):
+        before = (list(index.segments), index.last_time, index.area, index.covered)
+        peeked = index.peek(now)
+        assert (list(index.segments), index.last_time, index.area, index.covered) == before
+        twin = PremiumIndex(_window=10, _resolution=0)
+        twin.__dict__.update({**index.__dict__, "segments": deque(index.segments), "_lock": threading.Lock()})
+        assert peeked == pytest.approx(twin.twap(now))
+
+
+def test_premium_index_coalesces_ticks():
+    index = PremiumIndex(_window=100, _resolution=0)
+    index.update_oracle(0.5, 0.0)
+    for t in range(1, 50):
+        index.update_perp(0.55, float(t))
+    # repeated prices extend one segment
+    assert len(index.segments) == 1
+    assert index.twap(50.0) == pytest.approx(0.1)
+
+    bucketed = PremiumIndex(_window=100, _resolution=10)
+    bucketed.update_oracle(0.5, 0.0)
+    for i in range(400):
+        bucketed.update_perp(0.55 if i % 2 else 0.45, i * 0.25)
+    # alternating +-10% every 250ms, folded into 10s buckets
+    assert len(bucketed.segments) <= 11
+    assert bucketed.twap(100.0) == pytest.approx(0.0, abs=1e-9)
+
+
+def test_engine_trades_feed_premium_index(mock_orderbook):
+    ob = mock_orderbook
+    index = PremiumIndex(_window=60)
+    index.update_oracle(0.5, time.time() - 1)
+    ob.trade_listeners.append(index.record_trade)
+
+    ob.add_limit_order(_trader_id="0xMaker", _side=Side.SELL, _price=0.55, _quantity=1.0, _leverage=2)
+    ob.market_order(_trader_id="0xTaker", _side=Side.BUY, _quantity=1.0, _leverage=2)
+
+    assert index.perp_price == 0.55
+    assert index.premium == pytest.approx(0.1)
+
+
+def test_sample_engine_prices_uses_premium_twap():
+    pm = SimpleNamespace(get_oracle_price=lambda: 0.5, get_perp_price=lambda _oracle: 0.55)
+    index = PremiumIndex(_window=60)
+    index.update_oracle(0.5, time.time() - 30)
+    index.update_perp(0.5, time.time() - 30)
+
+    sample = funding_service.sample_engine_prices(pm, index)
+
+    # 30s at 0% and the 10% premium only just started, so funding stays ~0
+    assert sample.premium == pytest.approx(0.0, abs=1e-3)
+    assert sample.funding_rate == sample.premium
+    assert (sample.oracle_price, sample.perp_price) == (0.5, 0.55)
+
+
+def test_premium_sampler_ticks_the_index_until_stopped():
+    pm = SimpleNamespace(get_oracle_price=lambda: 0.5, get_perp_price=lambda _oracle: 0.55)
+    index = PremiumIndex(_window=60)
+    stop = threading.Event()
+    thread = threading.Thread(target=funding_service.premium_sampler, args=(pm, index, stop, 0.01))
+    thread.start()
+    deadline = time.monotonic() + 5
+    while index.premium is None and time.monotonic() < deadline:
+        time.sleep(0.005)
+    stop.set()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert index.premium == pytest.approx(0.1)
+
+
+# ---------------------------------------------------------------------
+#  Chain indexer
+# ---------------------------------------------------------------------
+PERPS_ADDRESS = "0x00000000000000000000000000000000000000c3"
+TRADER_A = "0x000000000000000000000000000000000000000A"
+TRADER_B = "0x000000000000000000000000000000000000000b"
+
+
+@pytest.fixture(scope="module")
+def perps_abi():
+    import boa
+    from vyper.compiler.output import build_abi_output
+    return build_abi_output(boa.load_partial("src/perps_contract.vy").compiler_data)
+
+
+def event_log(abi, name, block, **args):
+    """Raw eth_getLogs entry for one perps event, as a node would return it."""
+    from eth_abi import encode
+    from eth_utils import event_abi_to_log_topic
+
+    event = next(e for e in abi if e["type"] == "event" and e["name"] == name)
+    topics = [event_abi_to_log_topic(event)] + [
+        encode([i["type"]], [args[i["name"]]]) for i in event["inputs"] if i["indexed"]
+    ]
+    data = [i for i in event["inputs"] if not i["indexed"]]
+    return {
+        "address": PERPS_ADDRESS, "blockNumber": hex(block), "logIndex": "0x0", "transactionIndex": "0x0",
+        "blockHash": "0x" + "11" * 32, "transactionHash": "0x" + "22" * 32, "removed": False,
+        "topics": ["0x" + topic.hex() for topic in topics],
+        "data": "0x" + encode([i["type"] for i in data], [args[i["name"]] for i in data]).hex(),
+    }
+
+
+@pytest.fixture
+def chain(monkeypatch, perps_abi):
+    from web3 import Web3
+    from web3.providers.base import BaseProvider
+
+    class LogNode(BaseProvider):
+        """eth_blockNumber and eth_getLogs over a list of logs, optionally capping the range per call."""
+        def __init__(self):
+            super().__init__()
+            self.head = 0
+            self.logs = []
+            self.ranges = []
+            self.max_range = None
+
+        def make_request(self, method, params):
+            if method == "eth_blockNumber":
+                return {"jsonrpc": "2.0", "id": 1, "result": hex(self.head)}
+            if method == "eth_getLogs":
+                start, end = int(params[0]["fromBlock"], 16), int(params[0]["toBlock"], 16)
+                if self.max_range is not None and end - start + 1 > self.max_range:
+                    return {"jsonrpc": "2.0", "id": 1, "error": {"code": -32005, "message": "range too large"}}
+                self.ranges.append((start, end))
+                result = [entry for entry in self.logs if start <= int(entry["blockNumber"], 16) <= end]
+                return {"jsonrpc": "2.0", "id": 1, "result": result}
+            raise AssertionError(f"unexpected RPC {method}")
+
+    monkeypatch.setattr(indexer, "PERPS_ADDRESS", PERPS_ADDRESS)
+    monkeypatch.setattr(indexer, "PERPS_ABI", perps_abi)
+    node = LogNode()
+    return Web3(node), node
+
+
+def test_indexer_applies_onchain_only_changes(chain, perps_abi, position_manager, tmp_path):
+    w3, node = chain
+    position_manager.create_account(TRADER_A)
+    position_manager.create_position(TRADER_A, "BTC", PMSide.BUY, 0.5, 2.0, 2, 150)
+    node.logs = [
+        # the engine's own open, already applied locally
+        event_log(perps_abi, "PositionOpened", 3, trader=TRADER_A, margin=150 * 10**6, leverage=2,
+                  entry_price=500000, direction=True, funding_index_snapshot=7),
+        # someone else liquidates it straight on the contract
+        event_log(perps_abi, "PositionLiquidated", 5, trader=TRADER_A, liquidator=TRADER_B, equity=10**6),
+        # and a position this engine never saw
+        event_log(perps_abi, "PositionOpened", 6, trader=TRADER_B, margin=100 * 10**6, leverage=3,
+                  entry_price=250000, direction=False, funding_index_snapshot=9),
+        event_log(perps_abi, "FundingUpdated", 8, funding_index=12, funding_rate_per_second=-3, timestamp=1700),
+    ]
+    node.head = 10
+    chain_indexer = indexer.ChainIndexer(w3, position_manager, "BTC", str(tmp_path / "checkpoint.json"))
+
+    assert chain_indexer.poll() == 4
+    assert chain_indexer.poll() == 0
+
+    [position_a] = position_manager.accounts[TRADER_A].positions
+    assert position_a.status == PMStatus.LIQUIDATED
+    assert position_a.funding_index_snapshot == 7
+    [position_b] = position_manager.accounts[TRADER_B].positions
+    assert (position_b.side, position_b.margin, position_b.leverage, position_b.entry_price) == (PMSide.SELL, 100, 3, 0.25)
+    assert position_b.quantity == pytest.approx(1200)
+    assert position_b.funding_index_snapshot == 9
+    funding = position_manager.funding
+    assert (funding.index, funding.rate_per_second, funding.last_timestamp) == (12, -3, 1700)
+
+
+def test_indexer_lagging_events_land_on_the_position_they_belong_to(chain, perps_abi, position_manager, tmp_path):
+    w3, node = chain
+    position_manager.create_account(TRADER_A)
+    first = position_manager.create_position(TRADER_A, "BTC", PMSide.BUY, 0.5, 2.0, 2, 150)
+    first.status = PMStatus.CLOSED
+    # the engine has already closed #1 and opened #2 before the indexer catches up
+    second = position_manager.create_position(TRADER_A, "BTC", PMSide.SELL, 0.6, 1.0, 3, 200)
+    second.funding_index_snapshot = 11
+    node.logs = [
+        event_log(perps_abi, "PositionOpened", 3, trader=TRADER_A, margin=150 * 10**6, leverage=2,
+                  entry_price=500000, direction=True, funding_index_snapshot=7),
+        event_log(perps_abi, "PositionClosed", 4, trader=TRADER_A, price=550000, pnl=10**6),
+        event_log(perps_abi, "PositionLiquidated", 4, trader=TRADER_A, liquidator=TRADER_B, equity=0),
+    ]
+    node.head = 5
+    chain_indexer = indexer.ChainIndexer(w3, position_manager, "BTC", str(tmp_path / "checkpoint.json"))
+    chain_indexer.poll()
+
+    assert (first.status, first.funding_index_snapshot, first.open_block) == (PMStatus.CLOSED, 7, 3)
+    assert (second.status, second.funding_index_snapshot, second.open_block) == (PMStatus.OPEN, 11, None)
+
+    # #2's own open confirms it, and only its liquidation touches it
+    node.logs.append(event_log(perps_abi, "PositionOpened", 6, trader=TRADER_A, margin=200 * 10**6, leverage=3,
+                               entry_price=600000, direction=False, funding_index_snapshot=12))
+    node.logs.append(event_log(perps_abi, "PositionLiquidated", 7, trader=TRADER_A, liquidator=TRADER_B, equity=0))
+    node.head = 7
+    chain_indexer.poll()
+
+    assert (first.status, first.realized_pnl) == (PMStatus.CLOSED, 0)
+    assert (second.status, second.funding_index_snapshot, second.open_block) == (PMStatus.LIQUIDATED, 12, 6)
+    assert len(position_manager.accounts[TRADER_A].positions) == 2
+
+
+def test_indexer_batches_ranges_and_resumes_from_checkpoint(chain, perps_abi, position_manager, tmp_path):
+    w3, node = chain
+    checkpoint = str(tmp_path / "checkpoint.json")
+    node.logs = [event_log(perps_abi, "LimitOrderAdded", 2500, trader=TRADER_A, leverage=2,
+                           margin=10**6, price=500000, quantity=4, direction=True)]
+    node.head = 4500
+    indexer.ChainIndexer(w3, position_manager, "BTC", checkpoint, _batch_blocks=2000).poll()
+    assert node.ranges == [(0, 1999), (2000, 3999), (4000, 4500)]
+
+    # a fresh process resumes from the checkpoint, with the traders it had seen
+    position_manager.accounts.clear()
+    node.ranges.clear()
+    node.head = 9000
+    node.max_range = 1500
+    resumed = indexer.ChainIndexer(w3, position_manager, "BTC", checkpoint, _batch_blocks=2000)
+    assert TRADER_A in position_manager.accounts
+    resumed.poll()
+
+    # the node caps ranges at 1500 blocks, so the batch halves once and stays there
+    assert node.ranges == [(4501, 5500), (5501, 6500), (6501, 7500), (7501, 8500), (8501, 9000)]
+    assert json.load(open(checkpoint))["block"] == 9000
+
+
+# ---------------------------------------------------------------------
+#  Reconciler
+# ---------------------------------------------------------------------
+POSITION_TYPE = "(uint256,uint256,uint256,uint256,int256,bool,bool)[]"
+LIMIT_ORDER_TYPE = "(address,uint256,uint256,uint256,uint256,bool,bool,uint256)[]"
+CLOSED_POSITION = (0, 0, 0, 0, 0, False, False)
+
+
+def test_reconciler_diffs_accounts_against_batch_views(monkeypatch, perps_abi, position_manager):
+    from eth_abi import decode, encode
+    from eth_utils import function_abi_to_4byte_selector
+    from web3 import Web3
+    from web3.providers.base import BaseProvider
+
+    traders = [Web3.to_checksum_address(f"0x{i:040x}") for i in range(1, 6)]
+    a, b, c, d, e = traders
+    chain_positions = {
+        a: (150 * 10**6, 2, 500000, 300 * 10**6, 4, True, True),
+        c: (100 * 10**6, 3, 250000, 300 * 10**6, 9, False, True),
+        d: (150 * 10**6, 2, 450000, 300 * 10**6, 0, True, True),
+    }
+    selectors = {
+        "0x" + function_abi_to_4byte_selector(entry).hex(): entry["name"]
+        for entry in perps_abi if entry["type"] == "function"
+    }
+
+    class ViewNode(BaseProvider):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+            self.stale_oracle = False
+
+        def make_request(self, method, params):
+            if method == "eth_chainId":
+                return {"jsonrpc": "2.0", "id": 1, "result": hex(31337)}
+            if method == "eth_blockNumber":
+                return {"jsonrpc": "2.0", "id": 1, "result": hex(42)}
+            assert method == "eth_call"
+            name = selectors[params[0]["data"][:10]]
+            self.calls.append((name, params[1]))
+            [addresses] = decode(["address[]"], bytes.fromhex(params[0]["data"][10:]))
+            addresses = [Web3.to_checksum_address(address) for address in addresses]
+            if name == "get_positions":
+                result = encode([POSITION_TYPE], [[chain_positions.get(t, CLOSED_POSITION) for t in addresses]])
+            elif name == "get_equities":
+                equities = [] if self.stale_oracle else [170 * 10**6 if t in chain_positions else 0 for t in addresses]
+                result = encode(["int256[]"], [equities])
+            else:
+                result = encode([LIMIT_ORDER_TYPE], [[(t, 0, 0, 0, 0, False, False, 0) for t in addresses]])
+            return {"jsonrpc": "2.0", "id": 1, "result": "0x" + result.hex()}
+
+    monkeypatch.setattr(reconciler, "PERPS_ADDRESS", PERPS_ADDRESS)
+    monkeypatch.setattr(reconciler, "PERPS_ABI", perps_abi)
+    for trader in traders:
+        position_manager.create_account(trader)
+    long_ago = time.time() - 3600
+    matched = position_manager.create_position(a, "BTC", PMSide.BUY, 0.5, 600, 2, 150)
+    failed_fill = position_manager.create_position(b, "BTC", PMSide.BUY, 0.5, 600, 2, 150)
+    closed = position_manager.create_position(c, "BTC", PMSide.SELL, 0.25, 1200, 3, 100)
+    wrong_entry = position_manager.create_position(d, "BTC", PMSide.BUY, 0.5, 600, 2, 150)
+    pending = position_manager.create_position(e, "BTC", PMSide.BUY, 0.5, 600, 2, 150)
+    for position in (matched, failed_fill, closed, wrong_entry):
+        position.open_timestamp = long_ago
+    closed.status, closed.close_timestamp = PMStatus.CLOSED, long_ago
+    engine = SimpleNamespace(asks={}, bids={0.4: [
+        SimpleNamespace(trader_id=a, status=Status.OPEN, timestamp=long_ago),
+        SimpleNamespace(trader_id=e, status=Status.OPEN, timestamp=time.time()),
+    ]})
+    node = ViewNode()
+
+    # the diff walks the book, so it runs on the engine queue's worker like the server's does
+    commands = EngineQueue()
+    report = reconciler.Reconciler(Web3(node), position_manager, engine, "BTC", _chunk=2, _submit=commands.submit).run_cycle()
+    commands.stop()
+
+    # 5 accounts in chunks of 2, three views each, all read at the same block
+    assert report.calls == len(node.calls) == 9
+    assert {block for _, block in node.calls} == {hex(42)}
+    assert report.missing == [(c, (100 * 10**6, 3, 250000, False, 9))]
+    assert report.stale == [b]
+    assert [trader for trader, _ in report.mismatched] == [d]
+    assert report.stale_orders == [a]
+    assert report.equities == {a: 170.0, c: 170.0, d: 170.0}
+
+    assert matched.funding_index_snapshot == 4
+    assert failed_fill.status == PMStatus.CLOSED
+    assert wrong_entry.entry_price == 0.45
+    assert pending.status == PMStatus.OPEN
+    recovered = position_manager.get_open_position(c, "BTC")
+    assert (recovered.side, recovered.margin, recovered.entry_price, recovered.funding_index_snapshot) == (PMSide.SELL, 100, 0.25, 9)
+
+    # the oracle goes stale, and b's new position closes between read() and apply()
+    node.stale_oracle = True
+    reopened = position_manager.create_position(b, "BTC", PMSide.BUY, 0.5, 600, 2, 150)
+    reopened.open_timestamp = long_ago
+    stale_pass = reconciler.Reconciler(Web3(node), position_manager, None, "BTC", _chunk=2)
+    report = reconciler.ReconcileReport(block=42)
+    stale_pass.diff(traders, *stale_pass.read(traders, report.block, report), report)
+    reopened.status = PMStatus.CLOSED
+    stale_pass.apply(report)
+
+    assert report.stale == [b]
+    assert (report.stale_oracle, report.equities) == (True, {})
@@ -77,7 +77,69 @@ def test_can_payout(deploy_test_system, test_user):
         usdc.approve(vault, 1000)
         vault.add_liquidity(1000)
 
-        # ------------------------------------------------------------------
+# ------------------------------------------------------------------
+#                           ORACLE TESTS
+# ------------------------------------------------------------------
+
+# PriceField flag values in oracle.vy
+ORACLE, PERP = 1, 2
+BOTH = ORACLE | PERP
+
+def test_update_prices_batches_markets(deploy_test_system):
+    owner = deploy_test_system["owner"]
+    oracle = deploy_test_system["oracle"]
+
+    with boa.env.prank(owner):
+        oracle.update_prices([0, 1, 2], [400000, 300000, 500000], [410000, 600000, 200000], [BOTH, ORACLE, PERP])
+
+    assert oracle.get_market_oracle_price(0) == 400000
+    assert oracle.get_market_perp_price(0) == 410000
+    assert oracle.markets(1).oracle_price == 300000
+    assert oracle.markets(1).last_update_time != 0
+    # a side left out of the fields is untouched, whatever price was passed
+    assert oracle.markets(1).perp_price == 0
+    assert oracle.markets(2).oracle_price == 0
+    assert oracle.markets(2).perp_price == 200000
+    assert oracle.markets(2).last_update_time == 0
+
+    # a 0 price is a price like any other
+    with boa.env.prank(owner):
+        oracle.update_prices([2], [0], [0], [PERP])
+    assert oracle.markets(2).perp_price == 0
+    assert oracle.markets(2).last_update_time_perp != 0
+
+    # the single-market views still read market 0
+    assert oracle.oracle_price() == 400000
+    assert oracle.get_perp_price() == 410000
+
+def test_update_prices_rejects_bad_batches(deploy_test_system, test_user):
+    owner = deploy_test_system["owner"]
+    oracle = deploy_test_system["oracle"]
+
+    with boa.env.prank(test_user):
+        with boa.reverts("not authorized to update oracle"):
+            oracle.update_prices([0], [400000], [0], [ORACLE])
+
+    with boa.env.prank(owner):
+        with boa.reverts("length mismatch"):
+            oracle.update_prices([0, 1], [400000], [0, 0], [ORACLE, ORACLE])
+        with boa.reverts("length mismatch"):
+            oracle.update_prices([0, 1], [400000, 400000], [0, 0], [ORACLE])
+        with boa.reverts("price > 1e6"):
+            oracle.update_prices([0], [0], [10**6 + 1], [PERP])
+
+def test_market_price_goes_stale(deploy_test_system):
+    owner = deploy_test_system["owner"]
+    oracle = deploy_test_system["oracle"]
+
+    with boa.env.prank(owner):
+        oracle.update_prices([7], [400000], [0], [ORACLE])
+
+    boa.env.time_travel(seconds=3601)
+    with boa.reverts("oracle has not been updated recently"):
+        oracle.get_market_oracle_price(7)
+
+# ------------------------------------------------------------------
 #                       PERPS CONTRACT TEST
 # ------------------------------------------------------------------
 
@@ -161,6 +223,70 @@ def test_close_limit_order(deploy_test_system, test_user):
     assert usdc.balanceOf(perps.address) == 0
     assert usdc.balanceOf(test_user) == 2000
 
+def test_replace_limit_order_pulls_margin_delta(deploy_test_system, test_user):
+    usdc = deploy_test_system["usdc"]
+    perps = deploy_test_system["perps"]
+
+    price: int = int(0.25 * (10**6))
+    new_price: int = int(0.3 * (10**6))
+
+    with boa.env.prank(test_user):
+        usdc.mint(test_user, 2000)
+        usdc.approve(perps, 800)
+        perps.add_limit_order(2, 500, price, 4000, True)
+        perps.replace_limit_order(800, new_price, 5000)
+
+    assert perps.limit_orders(test_user).margin == 800
+    assert perps.limit_orders(test_user).price == new_price
+    assert perps.limit_orders(test_user).quantity == 5000
+    assert perps.limit_orders(test_user).leverage == 2
+    assert perps.limit_orders(test_user).direction
+    assert perps.limit_orders(test_user).is_open
+    assert usdc.balanceOf(perps.address) == 800
+    assert usdc.balanceOf(test_user) == 1200
+
+def test_replace_limit_order_refunds_margin_delta(deploy_test_system, test_user):
+    usdc = deploy_test_system["usdc"]
+    perps = deploy_test_system["perps"]
+
+    price: int = int(0.25 * (10**6))
+
+    with boa.env.prank(test_user):
+        usdc.mint(test_user, 2000)
+        usdc.approve(perps, 500)
+        perps.add_limit_order(2, 500, price, 4000, True)
+        perps.replace_limit_order(200, price, 1600)
+
+    assert perps.limit_orders(test_user).margin == 200
+    assert perps.limit_orders(test_user).quantity == 1600
+    assert usdc.balanceOf(perps.address) == 200
+    assert usdc.balanceOf(test_user) == 1800
+
+def test_cannot_place_or_replace_zero_quantity_limit_order(deploy_test_system, test_user):
+    usdc = deploy_test_system["usdc"]
+    perps = deploy_test_system["perps"]
+
+    price: int = int(0.25 * (10**6))
+
+    with boa.env.prank(test_user):
+        usdc.mint(test_user, 2000)
+        usdc.approve(perps, 500)
+        with boa.reverts("quantity must be > 0"):
+            perps.add_limit_order(2, 500, price, 0, True)
+        perps.add_limit_order(2, 500, price, 4000, True)
+        with boa.reverts("quantity must be > 0"):
+            perps.replace_limit_order(500, price, 0)
+
+    assert perps.limit_orders(test_user).quantity == 4000
+    assert perps.limit_orders(test_user).is_open
+
+def test_cannot_replace_non_existing_limit_order(deploy_test_system, test_user):
+    perps = deploy_test_system["perps"]
+
+    with boa.env.prank(test_user):
+        with boa.reverts("no limit orders open"):
+            perps.replace_limit_order(200, int(0.25 * (10**6)), 1600)
+
 def test_cannot_close_non_existing_limit_order(deploy_test_system, test_user):
     vault = deploy_test_system["vault"]
     usdc = deploy_test_system["usdc"]
@@ -176,6 +302,34 @@ def test_cannot_close_non_existing_limit_order(deploy_test_system, test_user):
         with boa.reverts("no limit orders open"):
             perps.close_limit_order()
 
+def test_engine_expires_limit_orders_in_one_call(deploy_test_system, test_user, test_user_two, test_user_three):
+    usdc = deploy_test_system["usdc"]
+    owner = deploy_test_system["owner"]
+    perps = deploy_test_system["perps"]
+
+    price: int = int(0.25 * (10**6))
+
+    for user in (test_user, test_user_two):
+        with boa.env.prank(user):
+            usdc.mint(user, 2000)
+            usdc.approve(perps, 500)
+            perps.add_limit_order(2, 500, price, 4000, True)
+
+    with boa.env.prank(test_user):
+        with boa.reverts():
+            perps.expire_limit_orders([test_user])
+
+    # a trader with no open order is skipped, not a revert
+    with boa.env.prank(owner):
+        perps.expire_limit_orders([test_user, test_user_two, test_user_three])
+
+    for user in (test_user, test_user_two):
+        assert not perps.limit_orders(user).is_open
+        assert perps.limit_orders(user).margin == 0
+        assert perps.limit_orders(user).timestamp == 0
+        assert usdc.balanceOf(user) == 2000
+    assert usdc.balanceOf(perps.address) == 0
+
 def test_can_fill_limit_order_full(deploy_test_system, test_user):
     vault = deploy_test_system["vault"]
     usdc = deploy_test_system["usdc"]
@@ -404,4 +558,90 @@ def test_can_liquidate_position(deploy_test_system, test_user, test_user_two):
     assert usdc.balanceOf(test_user_two) == 25 * SCALE
     assert usdc.balanceOf(owner) == 0
     assert vault.total_usd_balance() == 10475 * SCALE
-    assert usdc.balanceOf(perps.address) == 0
\ No newline at end of file
+    assert usdc.balanceOf(perps.address) == 0
+def test_state_changes_emit_events(deploy_test_system, test_user, test_user_two):
+    vault = deploy_test_system["vault"]
+    usdc = deploy_test_system["usdc"]
+    owner = deploy_test_system["owner"]
+    oracle = deploy_test_system["oracle"]
+    perps = deploy_test_system["perps"]
+
+    SCALE: int = 10**6
+    price: int = int(0.25 * SCALE)
+
+    with boa.env.prank(owner):
+        usdc.mint(owner, 10000 * SCALE)
+        usdc.approve(vault, 10000 * SCALE)
+        vault.add_liquidity(10000 * SCALE)
+        vault.authorize_perp_address(perps.address)
+
+    with boa.env.prank(test_user):
+        usdc.mint(test_user, 2000 * SCALE)
+        usdc.approve(perps, 500 * SCALE)
+        perps.add_limit_order(2, 500 * SCALE, price, 4000, True)
+        [added] = [e for e in perps.get_logs() if type(e).__name__ == "LimitOrderAdded"]
+        assert (added.trader, added.margin, added.price, added.quantity) == (test_user, 500 * SCALE, price, 4000)
+
+    with boa.env.prank(owner):
+        perps.update_funding(10**12)
+        [funding] = perps.get_logs()
+        assert (funding.funding_rate_per_second, funding.timestamp) == (10**12, boa.env.evm.patch.timestamp)
+
+        boa.env.time_travel(seconds=100)
+        perps.fill_limit_order(test_user, 4000)
+        filled, opened = perps.get_logs()[-2:]
+        assert (filled.trader, filled.quantity, filled.price) == (test_user, 4000, price)
+        assert (opened.trader, opened.margin, opened.leverage, opened.direction) == (test_user, 500 * SCALE, 2, True)
+        assert opened.funding_index_snapshot == 100 * 10**12
+
+        oracle.update_oracle(int(0.1375 * SCALE))
+        oracle.update_perp(int(0.1375 * SCALE))
+
+    with boa.env.prank(test_user_two):
+        perps.liquidate(test_user)
+        [liquidated] = [e for e in perps.get_logs() if type(e).__name__ == "PositionLiquidated"]
+        assert (liquidated.trader, liquidated.liquidator) == (test_user, test_user_two)
+        assert liquidated.equity <= 100 * SCALE
+
+def test_batch_views_line_up_with_addresses(deploy_test_system, test_user, test_user_two, test_user_three):
+    usdc = deploy_test_system["usdc"]
+    owner = deploy_test_system["owner"]
+    oracle = deploy_test_system["oracle"]
+    perps = deploy_test_system["perps"]
+
+    SCALE: int = 10**6
+    price: int = int(0.25 * SCALE)
+
+    with boa.env.prank(test_user):
+        usdc.mint(test_user, 2000 * SCALE)
+        usdc.approve(perps, 500 * SCALE)
+        perps.open_position(500 * SCALE, 2, True, price)
+
+    with boa.env.prank(test_user_two):
+        usdc.mint(test_user_two, 2000 * SCALE)
+        usdc.approve(perps, 100 * SCALE)
+        perps.add_limit_order(3, 100 * SCALE, price, 1200, False)
+
+    with boa.env.prank(owner):
+        perps.update_funding(10**12)
+        oracle.update_oracle(int(0.3 * SCALE))
+        oracle.update_perp(int(0.3 * SCALE))
+    boa.env.time_travel(seconds=100)
+
+    traders = [test_user, test_user_two, test_user_three]
+    positions = perps.get_positions(traders)
+    orders = perps.get_limit_orders(traders)
+    equities = perps.get_equities(traders)
+
+    assert [p.is_open for p in positions] == [True, False, False]
+    assert positions[0].margin == 500 * SCALE
+    assert [o.is_open for o in orders] == [False, True, False]
+    assert (orders[1].trader_address, orders[1].margin, orders[1].quantity) == (test_user_two, 100 * SCALE, 1200)
+
+    # 20% up on 1000 notional, and the long is owed 100s of funding on its 1000 size
+    assert equities == [500 * SCALE + 200 * SCALE + 100 * 10**12 * 1000 * SCALE // 10**18, 0, 0]
+
+    # a stale oracle empties the equities instead of reverting the batch, positions still read
+    boa.env.time_travel(seconds=3601)
+    assert perps.get_equities(traders) == []
+    assert [p.is_open for p in perps.get_positions(traders)] == [True, False, False]